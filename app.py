@@ -1,15 +1,47 @@
-from flask import Flask, render_template, jsonify, session, send_from_directory, request
-from flask_socketio import SocketIO, emit, join_room
+import os
+
+# Server concurrency mode: 'threading' (default), 'gevent' or 'eventlet'. The async
+# modes must monkey-patch the standard library before anything else is imported.
+ASYNC_MODE = os.environ.get('ASYNC_MODE', 'threading')
+if ASYNC_MODE == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+elif ASYNC_MODE == 'eventlet':
+    import eventlet
+    eventlet.monkey_patch()
+
+from flask import Flask, render_template, jsonify, send_from_directory, request, Response
+from flask_socketio import SocketIO, emit, join_room, leave_room
 from flask_cors import CORS
-import logging
 import json
-import os
+import atexit
 import base64
 import hashlib
-from app.crypto.rsa_utils import generate_key_pair, sign_message, verify_signature, encrypt_message, decrypt_message
-from app.crypto.rsa_utils import generate_certificate, verify_certificate
+import zlib
+from functools import wraps
+from app.crypto.rsa_utils import generate_key_pair, sign_message, verify_signature, encrypt_message
+from app.crypto.rsa_utils import generate_certificate, export_key_der, import_key_der, use_openssl
+from app.crypto.rsa_utils import key_context, key_contexts
+from app.crypto.key_pool import KeyPool
+from app.crypto.envelope import encrypt_envelope, encrypt_multi_envelope, split_multi_envelope, max_rsa_payload
+from app.crypto.session_cache import SessionKeyCache
+from app.crypto.verify_cache import CertificateVerificationCache, RevocationListFull, is_expired
+from app.crypto.offload import CryptoOffloader
+from app.crypto.admission import CryptoAdmission, CryptoBusy
+from app.crypto.keystore import KeyStore
 from app.backend.message_handler import MessageHandler
-from app.utils.logger import setup_logger
+from app.backend.groups import GroupManager
+from app.backend.offline_queue import OfflineQueue
+from app.backend.presence import PresenceTracker, UserDirectory
+from app.backend.wire import WireFormats, encode_message, negotiate, message_room, JSON as WIRE_JSON, BINARY_ZLIB
+from app.backend.storage import InMemoryMessageStore, SegmentLogMessageStore
+from app.backend.cluster import SharedState, BrokerState, LocalSocketManager
+from app.utils.logger import setup_logger, parse_sample_rates
+from app.utils.bounded import BoundedCache, BoundedSet
+from app.utils.rate_limit import RateLimits, parse_rate_limits
+from app.utils.process_stats import get_process_stats
+from app.utils.timing import timings as crypto_timings
+from app.utils.metrics import create_socketio_metrics, operation_timings_collector, process_collector
 
 # Initialize Flask app
 app = Flask(__name__, 
@@ -20,37 +52,377 @@ app.config['SECRET_KEY'] = os.urandom(24).hex()
 # Enable CORS for all origins
 CORS(app, resources={r"/*": {"origins": "*"}})
 
-# Initialize Socket.IO with proper CORS settings
+# Multi-node deployments point every node at the same broker (python -m app.backend.cluster)
+CLUSTER_BROKER_URL = os.environ.get('CLUSTER_BROKER_URL')
+
+# Initialize Socket.IO with proper CORS settings; with a broker, emits fan out to rooms on every node
 socketio = SocketIO(
     app,
     cors_allowed_origins="*",  # Allow all origins for testing
     ping_timeout=60,
     ping_interval=25,
-    async_mode='threading',  # Use threading mode for better compatibility
-    always_connect=True
+    async_mode=ASYNC_MODE,
+    always_connect=True,
+    client_manager=LocalSocketManager(CLUSTER_BROKER_URL) if CLUSTER_BROKER_URL else None
+)
+
+def _env_int(name):
+    value = os.environ.get(name)
+    return int(value) if value else None
+
+# Setup logger; records are written by a background thread unless LOG_QUEUE=0.
+# Set LOG_MAX_BYTES and/or LOG_ROTATE_WHEN to write a rotating logs/app.log instead of one file per run.
+logger = setup_logger(
+    use_queue=os.environ.get('LOG_QUEUE', '1') == '1',
+    log_file=os.environ.get('LOG_FILE'),
+    max_bytes=_env_int('LOG_MAX_BYTES'),
+    rotate_when=os.environ.get('LOG_ROTATE_WHEN'),
+    backup_count=_env_int('LOG_BACKUP_COUNT') or 5,
+    json_lines=os.environ.get('LOG_JSON', '0') == '1',
+    sample_rates=parse_sample_rates(os.environ.get('LOG_SAMPLE')),
+    rate_limit=_env_int('LOG_RATE_LIMIT')
+)
+
+def _encode_key_pair(key_pair):
+    return {name: export_key_der(key) for name, key in key_pair.items()}
+
+def _decode_key_pair(key_pair):
+    return {name: import_key_der(der) for name, der in key_pair.items()}
+
+# Users, keys and certificates, shared between nodes when a cluster broker is configured.
+# These rarely change once written, so each node caches what it reads of them.
+shared_state = BrokerState(
+    CLUSTER_BROKER_URL,
+    node_ttl=_env_int('CLUSTER_NODE_TTL') or 15,
+    cached=('users', 'user_keys', 'ca', 'user_certificates', 'certificates_by_fingerprint'),
+    cache_size=_env_int('CLUSTER_CACHE_SIZE') or 10000
+) if CLUSTER_BROKER_URL else SharedState()
+
+# Keys and certificates persisted across restarts, encrypted with KEYSTORE_PASSPHRASE
+keystore = KeyStore(os.environ['KEYSTORE_DIR'], os.environ.get('KEYSTORE_PASSPHRASE')) \
+    if os.environ.get('KEYSTORE_DIR') else None
+
+def _load_user(user_id):
+    """
+    Bring back a user persisted in the keystore, e.g. after a restart
+
+    Returns:
+        RSA key: The user's public key, or None if they aren't in the keystore
+    """
+    if keystore is None:
+        return None
+    entry = keystore.get_user(user_id)
+    if entry is None or entry['certificate'] is None or is_expired(entry['certificate']['data']):
+        return None
+    user_keys[user_id] = {
+        'private_key': entry['private_key'],
+        'public_key': entry['public_key']
+    }
+    user_certificates[user_id] = entry['certificate']
+    certificates_by_fingerprint[entry['certificate']['fingerprint']] = entry['certificate']
+    message_handler.add_user(user_id, entry['public_key'])
+    logger.info(f"Loaded keys and certificate for {user_id} from the keystore")
+    return entry['public_key']
+
+# Initialize message handler; MESSAGE_STORE_DIR switches from memory to a durable segment log
+message_store = None
+if os.environ.get('MESSAGE_STORE_DIR'):
+    message_store = SegmentLogMessageStore(
+        os.environ['MESSAGE_STORE_DIR'],
+        segment_bytes=_env_int('MESSAGE_STORE_SEGMENT_BYTES') or 64 * 1024 * 1024,
+        max_segments=_env_int('MESSAGE_STORE_MAX_SEGMENTS'),
+        max_bytes=_env_int('MESSAGE_STORE_MAX_BYTES'),
+        max_age=_env_int('MESSAGE_STORE_MAX_AGE')
+    )
+else:
+    message_store = InMemoryMessageStore(
+        max_messages=_env_int('MESSAGE_RETENTION_MAX_MESSAGES') or 100000,
+        max_bytes=_env_int('MESSAGE_RETENTION_MAX_BYTES'),
+        max_age=_env_int('MESSAGE_RETENTION_MAX_AGE')
+    )
+# Messages for users with no connected socket; journaled next to the segment log when there is one
+offline_queue = OfflineQueue(
+    max_messages=_env_int('OFFLINE_QUEUE_MAX_MESSAGES') or 1000,
+    max_age=_env_int('OFFLINE_QUEUE_MAX_AGE') or 7 * 24 * 3600,
+    max_users=_env_int('OFFLINE_QUEUE_MAX_USERS') or 100000,
+    max_bytes=_env_int('OFFLINE_QUEUE_MAX_BYTES') or 256 * 1024 * 1024,
+    on_evict=lambda reason, count: metrics.inc('offline_evicted_total', count, (('reason', reason),)),
+    journal_path=os.environ.get('OFFLINE_QUEUE_JOURNAL') or
+                 (os.path.join(os.environ['MESSAGE_STORE_DIR'], 'offline.journal')
+                  if os.environ.get('MESSAGE_STORE_DIR') else None)
+)
+OFFLINE_DRAIN_CHUNK = _env_int('OFFLINE_DRAIN_CHUNK') or 100
+
+message_handler = MessageHandler(
+    store=message_store,
+    users=shared_state.namespace('users', encode=export_key_der, decode=import_key_der),
+    offline_queue=offline_queue,
+    load_user=_load_user
+)
+
+# Which users have a connected socket, so messages to everyone else go to their offline queue
+presence = PresenceTracker(shared_state.namespace('presence'))
+
+# Registered users for the client user list: fetched once in pages, then kept current with
+# user_list_delta events coalesced over USER_LIST_DELTA_WINDOW seconds
+directory = UserDirectory(
+    message_handler.users,
+    presence,
+    versions=shared_state.namespace('directory'),
+    window=float(os.environ.get('USER_LIST_DELTA_WINDOW', 0.25)),
+    publish=lambda delta: socketio.emit('user_list_delta', delta)
 )
+# Also broadcast the whole list on every registration, for clients built before deltas
+USER_LIST_BROADCAST = os.environ.get('USER_LIST_BROADCAST', '0') == '1'
 
-# Setup logger
-logger = setup_logger()
+# How each session wants new_message payloads: JSON dicts by default, or the binary wire format
+wire_formats = WireFormats(shared_state.namespace('wire_formats'))
+atexit.register(message_handler.close)
 
-# Initialize message handler
-message_handler = MessageHandler()
+# RSA key size for user and CA keys, and which library runs the RSA primitives. Clients and
+# certificates speak RSA, so of the providers in app.crypto.providers only the RSA ones apply here.
+RSA_KEY_SIZE = _env_int('RSA_KEY_SIZE') or 2048
+CRYPTO_PROVIDER = os.environ.get('CRYPTO_PROVIDER', 'rsa')
+if CRYPTO_PROVIDER == 'rsa-openssl':
+    use_openssl()
+elif CRYPTO_PROVIDER != 'rsa':
+    raise ValueError(f"CRYPTO_PROVIDER must be 'rsa' or 'rsa-openssl', not {CRYPTO_PROVIDER!r}")
+
+# Per-key cipher/signer objects and cached PEM/DER exports, roughly two entries per active user
+key_contexts.max_entries = int(os.environ.get('KEY_CONTEXT_CACHE_SIZE', 4096))
+
+# Worker processes for RSA work so event handlers (and the gevent/eventlet loop) never block on it.
+# Defaults to one worker per core in the async modes and inline execution in threading mode.
+crypto_offload = CryptoOffloader(
+    workers=_env_int('CRYPTO_WORKERS') if os.environ.get('CRYPTO_WORKERS') else
+            (0 if ASYNC_MODE == 'threading' else os.cpu_count())
+)
+
+# Pre-generated key pairs so registration doesn't wait on RSA key generation. In the async
+# modes KEY_POOL_WORKERS of the crypto workers generate them rather than a second process pool.
+key_pool = KeyPool(
+    key_size=RSA_KEY_SIZE,
+    pool_size=int(os.environ.get('KEY_POOL_SIZE', 16)),
+    workers=int(os.environ.get('KEY_POOL_WORKERS', 2)),
+    offload=None if ASYNC_MODE == 'threading' else crypto_offload
+)
+
+# Opt-in per-call latency histograms for the RSA primitives, reported in /api/stats
+if os.environ.get('CRYPTO_TIMING', '0') == '1':
+    crypto_timings.enable()
+
+# Per-conversation symmetric session keys, so RSA is only used for key setup
+session_cache = SessionKeyCache(
+    max_sessions=int(os.environ.get('SESSION_CACHE_SIZE', 1024)),
+    ttl=int(os.environ.get('SESSION_KEY_TTL', 3600)),
+    max_messages=int(os.environ.get('SESSION_KEY_MAX_MESSAGES', 1000)),
+    run=crypto_offload.run
+)
+
+# Conversation history page sizes
+DEFAULT_HISTORY_PAGE_SIZE = 100
+MAX_HISTORY_PAGE_SIZE = 500
+
+# Largest page of the user directory
+MAX_USER_PAGE_SIZE = 500
+
+# Incremental sync pages; pages at least this large are zlib-compressed for clients that ask
+SYNC_COMPRESS_MIN_BYTES = _env_int('SYNC_COMPRESS_MIN_BYTES') or 1024
+
+# Binary wire format string fields at least this large are zlib-compressed for clients that accept it
+WIRE_COMPRESS_MIN_BYTES = _env_int('WIRE_COMPRESS_MIN_BYTES') or 1024
+
+# Upper bound on recipients of a single send_batch
+MAX_BATCH_RECIPIENTS = _env_int('MAX_BATCH_RECIPIENTS') or 1000
 
 # Store user key pairs (in a real app, these would be properly managed)
-user_keys = {}
+user_keys = shared_state.namespace('user_keys', encode=_encode_key_pair, decode=_decode_key_pair)
 
 # Store message hashes for integrity checking
-message_hashes = {}
+message_hashes = BoundedCache(
+    max_entries=_env_int('MESSAGE_HASHES_MAX_ENTRIES') or 100000,
+    max_bytes=_env_int('MESSAGE_HASHES_MAX_BYTES'),
+    ttl=_env_int('MESSAGE_HASHES_TTL') or 24 * 3600
+)
 
 # Track intercepted messages to prevent duplicate delivery
-intercepted_messages = set()
+intercepted_messages = BoundedSet(
+    max_entries=_env_int('INTERCEPTED_MESSAGES_MAX_ENTRIES') or 100000,
+    ttl=_env_int('INTERCEPTED_MESSAGES_TTL') or 24 * 3600
+)
+
+# Outstanding registration challenges by connection: (user_id, random bytes)
+registration_challenges = BoundedCache(
+    max_entries=_env_int('REGISTRATION_CHALLENGES_MAX_ENTRIES') or 100000,
+    ttl=_env_int('REGISTRATION_CHALLENGE_TTL') or 60
+)
+
+# Certificate authority key pair; in a cluster the first node's CA is used by all
+ca_keys = shared_state.namespace('ca', encode=_encode_key_pair, decode=_decode_key_pair)
+_ca_key_pair = {}
 
-# Generate CA key pair for certificate authority
-ca_private_key, ca_public_key = generate_key_pair()
-logger.info("Certificate Authority keys generated")
+def get_ca_key_pair():
+    """
+    Get the CA key pair, loading or generating it on first use
+
+    Startup doesn't wait on the CA: it is read from the keystore (or the
+    cluster) when first needed and only generated if there is none.
+
+    Returns:
+        dict: private_key and public_key
+    """
+    if not _ca_key_pair:
+        if 'key_pair' not in ca_keys:
+            key_pair = keystore.get_ca() if keystore is not None else None
+            persisted = key_pair is not None
+            if not persisted:
+                ca_private_key, ca_public_key = generate_key_pair(RSA_KEY_SIZE)
+                key_pair = {'private_key': ca_private_key, 'public_key': ca_public_key}
+                logger.info("Certificate Authority keys generated")
+            # Another node (or thread) may have set the CA first; persist whichever one won
+            key_pair = ca_keys.setdefault('key_pair', key_pair)
+            if keystore is not None and not persisted:
+                keystore.put_ca(key_pair['private_key'], key_pair['public_key'])
+        _ca_key_pair.update(ca_keys['key_pair'])
+    return _ca_key_pair
 
 # Store user certificates
-user_certificates = {}
+user_certificates = shared_state.namespace('user_certificates')
+
+# Current certificates by fingerprint, so messages can reference them instead of embedding them
+certificates_by_fingerprint = shared_state.namespace('certificates_by_fingerprint')
+
+# Cached certificate verification results
+certificate_cache = CertificateVerificationCache(
+    max_entries=int(os.environ.get('CERTIFICATE_CACHE_SIZE', 4096)),
+    max_revoked=_env_int('CERTIFICATE_MAX_REVOKED') or 65536
+)
+
+# Group conversations; each group key is RSA-wrapped per member only when membership changes
+group_manager = GroupManager(
+    groups=shared_state.namespace('groups'),
+    memberships=shared_state.namespace('group_memberships'),
+    get_public_key=message_handler.get_user_public_key,
+    run=crypto_offload.run,
+    max_members=_env_int('MAX_GROUP_MEMBERS') or 256
+)
+
+# Socket.IO event metrics, served from /metrics; emits are counted through the wrapped emit.
+# Only one dict payload in METRICS_PAYLOAD_SAMPLE_EVERY is serialized to estimate payload bytes.
+metrics = create_socketio_metrics(payload_sample_every=_env_int('METRICS_PAYLOAD_SAMPLE_EVERY') or 16)
+emit = metrics.count_emits(emit)
+metrics.gauge_callback('registered_users', lambda: len(message_handler.get_users()), "Registered users")
+metrics.gauge_callback('stored_messages', lambda: len(message_store), "Messages held by the message store")
+metrics.describe('offline_evicted_total', 'counter', "Offline messages evicted or refused by the global queue caps")
+metrics.add_collector(operation_timings_collector('securechat_crypto_operation_seconds', crypto_timings,
+                                                  "RSA primitive latency (CRYPTO_TIMING=1)"))
+metrics.add_collector(process_collector(get_process_stats))
+
+# Admission control for crypto-heavy events: a bounded number run at once, the rest queue fairly
+# per user, and callers get a busy event with a retry-after once the queue is full
+crypto_admission = CryptoAdmission(
+    max_active=_env_int('CRYPTO_MAX_ACTIVE') or crypto_offload.workers or os.cpu_count(),
+    max_queue=_env_int('CRYPTO_MAX_QUEUE') or 256,
+    max_per_user=_env_int('CRYPTO_MAX_QUEUE_PER_USER') or 16,
+    max_wait=float(os.environ.get('CRYPTO_MAX_WAIT', 5)),
+    on_wait=lambda seconds: metrics.observe('crypto_queue_wait_seconds', seconds)
+)
+metrics.describe('crypto_queue_wait_seconds', 'histogram', "Time crypto-heavy events waited for a slot")
+metrics.describe('crypto_rejected_total', 'counter', "Crypto-heavy events rejected as busy")
+metrics.gauge_callback('crypto_queue_depth', lambda: crypto_admission.queued, "Crypto-heavy events waiting for a slot")
+metrics.gauge_callback('crypto_active', lambda: crypto_admission.active, "Crypto-heavy events running")
+
+# Token-bucket quotas per user and per connection, as rate per second and burst. RATE_LIMITS
+# overrides or adds events, e.g. RATE_LIMITS=send_message=50/100; RATE_LIMIT=0 turns limiting off.
+DEFAULT_RATE_LIMITS = {
+    'register_user': (0.5, 10),
+    'send_message': (20, 40),
+    'send_batch': (2, 5),
+    'send_group_message': (10, 20),
+    'verify_user': (10, 20),
+    'create_group': (1, 5),
+    'add_group_members': (1, 5),
+    'remove_group_members': (1, 5),
+    'sync': (5, 10),
+}
+rate_limits = RateLimits(
+    dict(DEFAULT_RATE_LIMITS, **parse_rate_limits(os.environ.get('RATE_LIMITS')))
+    if os.environ.get('RATE_LIMIT', '1') == '1' else {},
+    idle_ttl=_env_int('RATE_LIMIT_IDLE_TTL'),
+    max_keys=_env_int('RATE_LIMIT_MAX_KEYS') or 100000
+)
+metrics.describe('rate_limited_total', 'counter', "Events rejected by rate limiting")
+
+def rate_limited(event, by_address=False):
+    """
+    Decorator for a Socket.IO handler: charge each call to the caller's token buckets
+    
+    Calls are charged to the connection and the user registered on it.
+    With `by_address`, for events like registration where the payload
+    names a user the caller hasn't proven to be, they are charged to the
+    connection and its remote address instead; user IDs in the payload are
+    never used as bucket keys. A rejected call gets a rate_limited event
+    and ack with retry_after.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(data=None, *args, **kwargs):
+            if by_address:
+                user_id, address = None, request.remote_addr
+            else:
+                user_id, address = presence.session_user(request.sid), None
+            scope, retry_after = rate_limits.check(event, user_id, request.sid, address)
+            if scope is not None:
+                metrics.inc('rate_limited_total', 1, (('event', event), ('scope', scope)))
+                logger.warning(f"Rate limited {event} from {user_id or address or request.sid} ({scope})")
+                limited = {'event': event, 'scope': scope, 'retry_after': round(retry_after, 2)}
+                emit('rate_limited', limited)
+                return dict(limited, error='rate_limited')
+            return func(data, *args, **kwargs)
+        return wrapper
+    return decorator
+
+def crypto_caller():
+    """
+    Who a crypto_admission slot is charged to
+    
+    Fairness is per registered user, or per connection before the caller
+    registers; the user IDs in event payloads are not trusted for this.
+    """
+    return presence.session_user(request.sid) or request.sid
+
+def _encrypted(data):
+    return isinstance(data, dict) and bool(data.get('encrypted'))
+
+def crypto_admitted(event, when=None, inline=False):
+    """
+    Decorator for a crypto-heavy Socket.IO handler: run it under crypto_admission
+    
+    With `when`, only calls whose payload it accepts take a slot, so e.g.
+    plaintext sends never queue behind RSA work. With `inline`, the
+    handler takes a slot itself, with crypto_admission.admit(crypto_caller()),
+    around just the work that needs one. Either way, a rejected call gets a
+    busy event and a busy ack with retry_after.
+    """
+    labels = (('event', event),)
+    
+    def decorator(func):
+        @wraps(func)
+        def wrapper(data=None, *args, **kwargs):
+            caller = crypto_caller()
+            try:
+                if inline or (when is not None and not when(data)):
+                    return func(data, *args, **kwargs)
+                with crypto_admission.admit(caller):
+                    return func(data, *args, **kwargs)
+            except CryptoBusy as e:
+                metrics.inc('crypto_rejected_total', 1, labels)
+                logger.warning(f"Rejected {event} from {caller}: {e}")
+                busy = {'event': event, 'retry_after': e.retry_after, 'reason': e.reason}
+                emit('busy', busy)
+                return dict(busy, error='busy')
+        return wrapper
+    return decorator
 
 # Routes
 @app.route('/')
@@ -69,46 +441,237 @@ def serve_styles(filename):
 def serve_js(filename):
     return send_from_directory('app/static/js', filename)
 
+def _emit_message(message, user_id):
+    """
+    Emit new_message to all of a user's sessions, encoding it once per wire format in use
+    
+    JSON sessions get the dict; binary sessions get the encoded bytes,
+    which Socket.IO sends as a binary attachment.
+    """
+    for encoding in wire_formats.in_use(user_id) or (WIRE_JSON,):
+        if encoding == WIRE_JSON:
+            payload = message
+        else:
+            payload = encode_message(message, 'zlib' if encoding == BINARY_ZLIB else None, WIRE_COMPRESS_MIN_BYTES)
+        emit('new_message', payload, to=message_room(user_id, encoding))
+
+def _page_limit(value, default=DEFAULT_HISTORY_PAGE_SIZE, cap=MAX_HISTORY_PAGE_SIZE):
+    """
+    A client's page size, clamped to 1..cap
+    
+    Raises:
+        ValueError: If the value isn't an integer
+    """
+    return max(1, min(int(value if value is not None else default), cap))
+
+def _seq_cursor(value):
+    """
+    A client's seq cursor as a non-negative int, or None if absent
+    
+    Raises:
+        ValueError: If the value isn't an integer
+    """
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        raise ValueError(f"Invalid cursor {value!r}")
+    return max(0, int(value))
+
+def _deliver(message, recipient):
+    """
+    Emit a message to a recipient, or queue it if they have no connected socket
+    
+    Returns:
+        bool: True if it was emitted, False if it was queued, None if the
+            recipient is unknown or the offline queues are full
+    """
+    if presence.is_online(recipient):
+        _emit_message(message, recipient)
+        return True
+    if message_handler.queue_offline(recipient, message) is None:
+        return None
+    return False
+
+def _send_offline_chunk(user_id):
+    """Send the requesting client the next chunk of a user's offline messages"""
+    messages, remaining = message_handler.get_offline_chunk(user_id, OFFLINE_DRAIN_CHUNK)
+    if messages:
+        emit('offline_messages', {
+            'user_id': user_id,
+            'messages': messages,
+            'up_to': messages[-1]['offline_seq'],
+            'remaining': remaining
+        })
+
 # Socket.IO event handlers
 @socketio.on('connect')
 def handle_connect():
+    metrics.gauge_add('socketio_connected_clients', 1)
     logger.info("Client connected")
 
+@socketio.on('disconnect')
+def handle_disconnect():
+    metrics.gauge_add('socketio_connected_clients', -1)
+    user_id = presence.disconnect(request.sid)
+    wire_formats.discard(request.sid)
+    registration_challenges.pop(request.sid)
+    if user_id is not None:
+        logger.info(f"User {user_id} went offline")
+        directory.left(user_id)
+
+@socketio.on('ping_server')
+@metrics.track_event('ping_server')
+def handle_ping_server(data=None):
+    """Echo the payload back as an ack; used to measure round-trip latency"""
+    return data
+
+def _registration_proof(user_id, challenge):
+    """
+    The bytes a client signs to prove it holds a user's persisted private key
+
+    They start with 0xFF, which never occurs in UTF-8, so no message text
+    the server signs on a user's behalf can double as a proof.
+    """
+    return b'\xffsecurechat-register\x00' + user_id.encode('utf-8') + b'\x00' + challenge
+
+@socketio.on('get_registration_challenge')
+@metrics.track_event('get_registration_challenge')
+def handle_get_registration_challenge(data):
+    """
+    Issue a challenge for registering with a user's persisted keys
+
+    The client signs _registration_proof(user_id, challenge) with the
+    private key it kept and passes it to register_user as
+    challenge_signature. One challenge is outstanding per connection.
+    """
+    user_id = data.get('user_id') if isinstance(data, dict) else None
+    if not isinstance(user_id, str) or not user_id:
+        return {'error': 'user_id is required'}
+    challenge = os.urandom(32)
+    registration_challenges[request.sid] = (user_id, challenge)
+    return {'challenge': base64.b64encode(challenge).decode('utf-8')}
+
+def _proves_key_possession(user_id, challenge_signature):
+    """Whether a signature over this connection's challenge verifies under the user's persisted public key"""
+    pending = registration_challenges.get(request.sid)
+    # A challenge is good for one attempt
+    registration_challenges.pop(request.sid)
+    if pending is None or pending[0] != user_id or user_id not in user_keys:
+        return False
+    try:
+        signature = base64.b64decode(challenge_signature, validate=True)
+    except (TypeError, ValueError):
+        return False
+    return crypto_offload.run(verify_signature, _registration_proof(user_id, pending[1]), signature,
+                              user_keys[user_id]['public_key'])
+
 @socketio.on('register_user')
+@metrics.track_event('register_user')
+@rate_limited('register_user', by_address=True)
+@crypto_admitted('register_user', inline=True)
 def handle_register(data):
     user_id = data['user_id']
     logger.info(f"Registering user: {user_id}")
     
-    # Generate RSA key pair for this user
-    private_key, public_key = generate_key_pair()
-    user_keys[user_id] = {
-        'private_key': private_key,
-        'public_key': public_key
-    }
-    
-    # Generate certificate for the user
-    certificate = generate_certificate(user_id, public_key, ca_private_key)
-    user_certificates[user_id] = certificate
-    logger.info(f"Certificate generated for user: {user_id}")
+    # With a keystore, users keep their keys and certificate across restarts until it expires, but
+    # only after proving they hold the private key; anyone else registering the name gets new keys
+    if keystore is not None and user_id not in user_certificates:
+        # Loaded either way, so that rotating below revokes the persisted certificate
+        _load_user(user_id)
+    reused = (keystore is not None and data.get('challenge_signature') is not None and
+              user_id in user_certificates and not is_expired(user_certificates[user_id]['data']) and
+              _proves_key_possession(user_id, data['challenge_signature']))
+    if reused:
+        private_key = None
+        public_key = user_keys[user_id]['public_key']
+        certificate = user_certificates[user_id]
+        logger.info(f"Reusing persisted keys and certificate for user: {user_id}")
+    else:
+        # Only key generation and certificate signing take a crypto slot, not key reuse
+        with crypto_admission.admit(crypto_caller()):
+            # Re-registration replaces the user's certificate, so revoke the old one first;
+            # if the revocation list is full, the user keeps their current keys
+            if user_id in user_certificates:
+                previous = user_certificates[user_id]
+                try:
+                    certificate_cache.revoke(previous)
+                except RevocationListFull as e:
+                    logger.error(f"Refusing to rotate keys for {user_id}: {e}")
+                    return {'error': 'revocation_list_full'}
+                certificates_by_fingerprint.pop(previous['fingerprint'], None)
+            
+            # Take a pre-generated RSA key pair for this user
+            private_key, public_key = key_pool.acquire()
+            user_keys[user_id] = {
+                'private_key': private_key,
+                'public_key': public_key
+            }
+        
+            # Any sessions set up under the user's previous keys are now unreadable
+            session_cache.invalidate_user(user_id)
+        
+            # Generate certificate for the user
+            certificate = crypto_offload.run(generate_certificate, user_id, public_key,
+                                             get_ca_key_pair()['private_key'])
+            user_certificates[user_id] = certificate
+            certificates_by_fingerprint[certificate['fingerprint']] = certificate
+            logger.info(f"Certificate generated for user: {user_id}")
+        
+            if keystore is not None:
+                keystore.put_user(user_id, private_key, public_key, certificate)
     
     # Store user in message handler
+    is_new_user = user_id not in message_handler.users
     message_handler.add_user(user_id, public_key)
     
+    if reused:
+        # The member's wrapped group keys are still valid
+        rejoined_groups = [group_manager.get_group(group['id']) for group in group_manager.groups_for_user(user_id)]
+    else:
+        # Group keys stay the same, but the user's copies must be wrapped under their new key
+        rejoined_groups = group_manager.rewrap_member(user_id)
+    
     # Join a room with the user's ID
     join_room(user_id)
+    came_online = presence.connect(user_id, request.sid)
+    
+    # Messages arrive as JSON until the session asks for the binary wire format
+    previous_encoding = wire_formats.get(request.sid)
+    if previous_encoding is not None:
+        leave_room(message_room(*previous_encoding))
+    wire_formats.set(user_id, request.sid, WIRE_JSON)
+    join_room(message_room(user_id, WIRE_JSON))
     
-    # Broadcast updated user list
-    emit('user_list_updated', {'users': list(message_handler.get_users())}, broadcast=True)
+    # Other clients learn about the user from the next coalesced directory delta
+    if is_new_user:
+        directory.added(user_id)
+    if came_online:
+        directory.joined(user_id)
+    if USER_LIST_BROADCAST:
+        emit('user_list_updated', {'users': list(message_handler.get_users())}, broadcast=True)
     
-    # Send user's key pair and certificate back
-    emit('key_generated', {
-        'private_key': private_key.export_key().decode('utf-8'),
-        'public_key': public_key.export_key().decode('utf-8'),
+    # Send the user's certificate back, with the private key only when it was just generated;
+    # a persisted private key never leaves the server
+    keys = {
+        'public_key': key_context(public_key).pem,
         'certificate': certificate,
-        'ca_public_key': ca_public_key.export_key().decode('utf-8')
-    })
+        'ca_public_key': key_context(get_ca_key_pair()['public_key']).pem,
+        'reused': reused
+    }
+    if private_key is not None:
+        keys['private_key'] = key_context(private_key).pem
+    emit('key_generated', keys)
+    
+    for group in rejoined_groups:
+        emit('group_key', dict(GroupManager.key_info(group, user_id), group=GroupManager.public_info(group)))
+    
+    # Start draining anything that arrived while the user was away
+    _send_offline_chunk(user_id)
 
 @socketio.on('send_message')
+@metrics.track_event('send_message')
+@rate_limited('send_message')
+@crypto_admitted('send_message', when=_encrypted)
 def handle_message(data):
     sender = data['sender']
     recipient = data['recipient']
@@ -126,46 +689,226 @@ def handle_message(data):
         'encrypted': encrypted,
     }
     
-    # Add certificate to message for sender verification
-    if sender in user_certificates:
-        message['certificate'] = user_certificates[sender]
+    # Reference the sender's certificate for verification; clients fetch it once with get_certificate
+    certificate = user_certificates.get(sender)
+    if certificate is not None:
+        message['certificate_fingerprint'] = certificate['fingerprint']
     
     # Calculate message hash for integrity checking
     message_hash = hashlib.sha256(message_text.encode()).hexdigest()
     message['hash'] = message_hash
     
-    # Generate a unique message ID
-    message_id = f"{sender}_{recipient}_{message_handler.get_timestamp()}_{message_text}"
+    # Generate a compact unique message ID
+    message_id = message_handler.generate_message_id()
+    message['id'] = message_id
     
     # Store original hash with the message ID
     message_hashes[message_id] = message_hash
     
-    if encrypted:
+    if encrypted and data.get('session', False):
+        # Encrypt under the conversation's session key; RSA only runs on session setup or rotation
+        recipient_public_key = message_handler.get_user_public_key(recipient)
+        message['session'] = session_cache.encrypt(sender, recipient, message_text,
+                                                   user_keys[sender]['private_key'],
+                                                   recipient_public_key)
+    elif encrypted:
         # Sign the message with sender's private key
-        signature = sign_message(message_text, user_keys[sender]['private_key'])
+        signature = crypto_offload.run(sign_message, message_text, user_keys[sender]['private_key'])
         message['signature'] = base64.b64encode(signature).decode('utf-8')
-          # Encrypt the message with recipient's public key
+        
         recipient_public_key = message_handler.get_user_public_key(recipient)
-        encrypted_message = encrypt_message(message_text, recipient_public_key)
-        message['encrypted_message'] = base64.b64encode(encrypted_message).decode('utf-8')
+        if data.get('envelope', False) or \
+           len(message_text.encode('utf-8')) > max_rsa_payload(recipient_public_key):
+            # Hybrid RSA+AES envelope for large messages or clients that ask for it
+            message['envelope'] = crypto_offload.run(encrypt_envelope, message_text, recipient_public_key)
+        else:
+            # Encrypt the message with recipient's public key
+            encrypted_message = crypto_offload.run(encrypt_message, message_text, recipient_public_key)
+            message['encrypted_message'] = base64.b64encode(encrypted_message).decode('utf-8')
+    
+    # Log message for attacker to intercept; this also assigns its seq
+    message_handler.log_message(message)
     
     # Always send a copy back to the sender immediately (they see their original message)
     sender_copy = message.copy()
-    emit('new_message', sender_copy, to=sender)
+    _emit_message(sender_copy, sender)
     logger.info(f"Sent original message confirmation to sender {sender}")
     
-    # Log message for attacker to intercept
-    message_handler.log_message(message)
-    
     # Only deliver to recipient if not being intercepted by attacker
     # In normal operation, the attacker script will intercept and either forward 
     # the original or a tampered version using tampered_message event
     if not message_handler.is_tampering_active():
-        # Attacker not active, deliver normally
-        emit('new_message', message, to=recipient)
-        logger.info(f"Delivered message directly to recipient {recipient} (no attacker active)")
+        # Attacker not active, deliver normally (or hold it until the recipient reconnects)
+        if _deliver(message, recipient):
+            logger.info(f"Delivered message directly to recipient {recipient} (no attacker active)")
+
+@socketio.on('send_batch')
+@metrics.track_event('send_batch')
+@rate_limited('send_batch')
+@crypto_admitted('send_batch', when=_encrypted)
+def handle_send_batch(data):
+    """
+    Send one message to many recipients in a single pass
+    
+    The message is signed once and, when encrypted, its content is encrypted
+    once with the AES key wrapped for each recipient. Each recipient gets an
+    ordinary new_message with an envelope; the ack reports every recipient.
+    """
+    sender = data['sender']
+    message_text = data['message']
+    encrypted = data.get('encrypted', False)
+    if not presence.has_session(sender, request.sid):
+        return {'error': 'Not registered on this connection'}
+    
+    recipients = data.get('recipients', [])
+    if not isinstance(recipients, list) or not all(isinstance(recipient, str) for recipient in recipients):
+        return {'error': 'recipients must be a list of user IDs'}
+    recipients = list(dict.fromkeys(recipients))
+    if len(recipients) > MAX_BATCH_RECIPIENTS:
+        return {'error': f"At most {MAX_BATCH_RECIPIENTS} recipients per batch"}
+    
+    logger.info(f"Batch message from {sender} to {len(recipients)} recipients: {'[ENCRYPTED]' if encrypted else message_text}")
+    
+    results = {}
+    deliverable = []
+    public_keys = []
+    for recipient in recipients:
+        public_key = message_handler.get_user_public_key(recipient)
+        if public_key is None:
+            results[recipient] = {'status': 'unknown_recipient'}
+        else:
+            deliverable.append(recipient)
+            public_keys.append(public_key)
+    
+    # Fields shared by every recipient's copy
+    batch_id = message_handler.generate_message_id()
+    message_hash = hashlib.sha256(message_text.encode()).hexdigest()
+    template = {
+        'sender': sender,
+        'timestamp': message_handler.get_timestamp(),
+        'message': message_text,
+        'encrypted': encrypted,
+        'hash': message_hash,
+        'batch_id': batch_id
+    }
+    certificate = user_certificates.get(sender)
+    if certificate is not None:
+        template['certificate_fingerprint'] = certificate['fingerprint']
+    
+    envelopes = None
+    if encrypted and deliverable:
+        # One signature and one payload encryption for the whole batch
+        signature = crypto_offload.run(sign_message, message_text, user_keys[sender]['private_key'])
+        template['signature'] = base64.b64encode(signature).decode('utf-8')
+        envelopes = split_multi_envelope(
+            crypto_offload.run(encrypt_multi_envelope, message_text, tuple(public_keys)))
+    
+    tampering = message_handler.is_tampering_active()
+    for index, recipient in enumerate(deliverable):
+        message = dict(template, recipient=recipient, id=message_handler.generate_message_id())
+        if envelopes is not None:
+            message['envelope'] = envelopes[index]
+        message_hashes[message['id']] = message_hash
+        message_handler.log_message(message)
+        
+        # While the attacker is intercepting, it decides what reaches the recipient
+        if tampering:
+            status = 'intercepted'
+        else:
+            status = {True: 'delivered', False: 'queued', None: 'dropped'}[_deliver(message, recipient)]
+        results[recipient] = {
+            'status': status,
+            'message_id': message['id'],
+            'seq': message.get('seq')
+        }
+    
+    logger.info(f"Batch {batch_id} from {sender}: {len(deliverable)} of {len(recipients)} recipients reached")
+    return {'batch_id': batch_id, 'results': {recipient: results[recipient] for recipient in recipients}}
+
+@socketio.on('ack_offline')
+@metrics.track_event('ack_offline')
+def handle_ack_offline(data):
+    """Client has stored offline messages up to up_to; drop them and send the next chunk"""
+    user_id = data.get('user_id')
+    if not presence.has_session(user_id, request.sid):
+        return {'error': 'Not registered on this connection'}
+    try:
+        up_to = _seq_cursor(data.get('up_to')) or 0
+    except (TypeError, ValueError):
+        return {'error': 'Invalid up_to'}
+    message_handler.ack_offline(user_id, up_to)
+    _send_offline_chunk(user_id)
+
+@socketio.on('set_wire_format')
+@metrics.track_event('set_wire_format')
+def handle_set_wire_format(data):
+    """
+    Choose how this session receives new_message payloads
+    
+    format is 'json' or 'binary'; compression lists what the client can
+    decompress. The reply is the encoding the server settled on.
+    """
+    user_id = data.get('user_id')
+    if not presence.has_session(user_id, request.sid):
+        return {'error': 'Not registered on this connection'}
+    encoding = negotiate(data.get('format'), data.get('compression'))
+    previous = wire_formats.set(user_id, request.sid, encoding)
+    if previous != encoding:
+        if previous is not None:
+            leave_room(message_room(user_id, previous))
+        join_room(message_room(user_id, encoding))
+    logger.info(f"Session of {user_id} switched to the {encoding} wire format")
+    return {'encoding': encoding, 'compress_min_bytes': WIRE_COMPRESS_MIN_BYTES}
+
+@socketio.on('sync')
+@metrics.track_event('sync')
+@rate_limited('sync')
+def handle_sync(data):
+    """
+    Return the caller's messages newer than their cursor, across all conversations
+    
+    Reconnecting clients send the cursor from their last page and only
+    receive what they missed, paging until has_more is false. With
+    compress set, large pages come back as zlib-compressed JSON bytes.
+    """
+    user_id = data.get('user_id')
+    if not presence.has_session(user_id, request.sid):
+        return {'error': 'Not registered on this connection'}
+    try:
+        cursor = _seq_cursor(data.get('cursor')) or 0
+        limit = _page_limit(data.get('limit'))
+    except (TypeError, ValueError):
+        return {'error': 'Invalid cursor or limit'}
+    
+    group_ids = [group['id'] for group in group_manager.groups_for_user(user_id)]
+    messages, next_cursor, has_more = message_handler.sync(user_id, cursor, limit, group_ids)
+    logger.info(f"Sync for {user_id} from cursor {cursor}: {len(messages)} messages, has_more={has_more}")
+    
+    page = {'cursor': next_cursor, 'has_more': has_more, 'count': len(messages), 'encoding': 'identity'}
+    if data.get('compress') and messages:
+        encoded = json.dumps(messages, separators=(',', ':')).encode('utf-8')
+        if len(encoded) >= SYNC_COMPRESS_MIN_BYTES:
+            # Sent as a binary attachment, so there is no base64 overhead
+            page['encoding'] = 'zlib'
+            page['messages'] = zlib.compress(encoded)
+            return page
+    page['messages'] = messages
+    return page
+
+@socketio.on('get_session_key')
+@metrics.track_event('get_session_key')
+def handle_get_session_key(data):
+    """Resend the setup info for the current session between two users"""
+    sender = data.get('sender')
+    recipient = data.get('recipient')
+    emit('session_key', {
+        'sender': sender,
+        'recipient': recipient,
+        'session_key': session_cache.get_setup_info(sender, recipient)
+    })
 
 @socketio.on('intercept_message')
+@metrics.track_event('intercept_message')
 def handle_intercept_message(data):
     """Handle notification that a message is being intercepted"""
     message_id = data.get('message_id')
@@ -174,6 +917,7 @@ def handle_intercept_message(data):
         logger.info(f"Message {message_id} is being intercepted by attacker")
 
 @socketio.on('tampered_message')
+@metrics.track_event('tampered_message')
 def handle_tampered_message(data):
     """Handle tampered messages from the attacker"""
     logger.warning(f"Received tampered message from attacker")
@@ -202,16 +946,18 @@ def handle_tampered_message(data):
                 # For unencrypted messages, don't mark as tampered - this is expected behavior
                 logger.info(f"Unencrypted message modified: '{original_text}' -> '{tampered_text}'")
           # Only send to recipient
-        emit('new_message', data, to=data['recipient'])
-        logger.info(f"Forwarded tampered message to recipient {data['recipient']}")
+        if _deliver(data, data['recipient']):
+            logger.info(f"Forwarded tampered message to recipient {data['recipient']}")
 
 @socketio.on('request_intercept')
+@metrics.track_event('request_intercept')
 def handle_intercept():
     """Endpoint for the attacker to intercept messages"""
     messages = message_handler.get_logged_messages()
     emit('intercepted_messages', {'messages': messages})
 
 @socketio.on('set_tampering_mode')
+@metrics.track_event('set_tampering_mode')
 def handle_set_tampering_mode(data):
     """Set whether tampering is active"""
     active = data.get('active', False)
@@ -219,6 +965,9 @@ def handle_set_tampering_mode(data):
     logger.info(f"Tampering mode set to: {active}")
 
 @socketio.on('verify_user')
+@metrics.track_event('verify_user')
+@rate_limited('verify_user')
+@crypto_admitted('verify_user')
 def handle_verify_user(data):
     """Handle user certificate verification"""
     try:
@@ -229,7 +978,7 @@ def handle_verify_user(data):
         
         if user_id and certificate:
             # Verify the certificate using CA public key
-            is_valid = verify_certificate(certificate, ca_public_key)
+            is_valid = certificate_cache.verify(certificate, get_ca_key_pair()['public_key'])
             
             # Return verification result
             emit('verification_result', {
@@ -246,29 +995,53 @@ def handle_verify_user(data):
             'error': str(e)
         })
             
+def _find_certificate(fingerprint):
+    """Look up a current certificate by fingerprint, falling back to the keystore after a restart"""
+    certificate = certificates_by_fingerprint.get(fingerprint)
+    if certificate is None and keystore is not None and fingerprint:
+        entry = keystore.get_by_fingerprint(fingerprint)
+        if entry is not None and _load_user(entry['id']) is not None:
+            certificate = certificates_by_fingerprint.get(fingerprint)
+    return certificate
+
+@socketio.on('get_certificate')
+@metrics.track_event('get_certificate')
+def handle_get_certificate(data):
+    """Look up a certificate by the fingerprint referenced in messages"""
+    fingerprint = data.get('fingerprint')
+    emit('certificate', {
+        'fingerprint': fingerprint,
+        'certificate': _find_certificate(fingerprint)
+    })
+
 @socketio.on('get_conversation')
+@metrics.track_event('get_conversation')
 def handle_get_conversation(data):
     """Handle request to get conversation history between two users"""
     try:
         user_id = data.get('user_id')
         recipient_id = data.get('recipient_id')
+        limit = _page_limit(data.get('limit'))
+        before = _seq_cursor(data.get('before'))
+        after = _seq_cursor(data.get('after'))
         
         logger.info(f"Retrieving conversation history between {user_id} and {recipient_id}")
         
-        # In a real app, we'd fetch from a database. Here we'll just return any cached messages
-        conversation_messages = []
-        for msg in message_handler.messages:
-            if (msg['sender'] == user_id and msg['recipient'] == recipient_id) or \
-               (msg['sender'] == recipient_id and msg['recipient'] == user_id):
-                conversation_messages.append(msg)
-        
-        # Sort messages by timestamp
-        conversation_messages.sort(key=lambda x: x.get('timestamp', ''))
+        # Fetch one page from the conversation index using the client's seq cursors
+        conversation_messages, has_more = message_handler.get_conversation(
+            user_id, recipient_id,
+            before=before,
+            after=after,
+            limit=limit
+        )
         
-        # Send conversation history to requesting client
+        # Send conversation history to requesting client; the echoed cursor tells
+        # a client paging back through older messages which page this is
         emit('conversation_history', {
             'conversation_with': recipient_id,
-            'messages': conversation_messages
+            'messages': conversation_messages,
+            'has_more': has_more,
+            'before': before
         })
         
         logger.info(f"Sent {len(conversation_messages)} messages for conversation between {user_id} and {recipient_id}")
@@ -280,9 +1053,243 @@ def handle_get_conversation(data):
             'error': str(e)
         })
 
+def _send_group_keys(group):
+    """Send every member their wrapped copy of the group's current key"""
+    info = GroupManager.public_info(group)
+    for member in group['members']:
+        emit('group_key', dict(GroupManager.key_info(group, member), group=info), to=member)
+
+@socketio.on('create_group')
+@metrics.track_event('create_group')
+@rate_limited('create_group')
+@crypto_admitted('create_group')
+def handle_create_group(data):
+    """Create a group conversation and distribute its key to the members"""
+    creator = data['creator']
+    if not presence.has_session(creator, request.sid):
+        return {'error': 'Not registered on this connection'}
+    try:
+        group = group_manager.create_group(data.get('name', ''), creator, data.get('members', []))
+    except ValueError as e:
+        return {'error': str(e)}
+    
+    logger.info(f"Group {group['id']} created by {creator} with {len(group['members'])} members")
+    _send_group_keys(group)
+    return {'group': GroupManager.public_info(group)}
+
+@socketio.on('add_group_members')
+@metrics.track_event('add_group_members')
+@rate_limited('add_group_members')
+@crypto_admitted('add_group_members')
+def handle_add_group_members(data):
+    """Add members to a group; any member may add others, which rekeys the group"""
+    group_id = data['group_id']
+    if not presence.has_session(data['user_id'], request.sid):
+        return {'error': 'Not registered on this connection'}
+    if not group_manager.is_member(group_id, data['user_id']):
+        return {'error': 'Not a member of this group'}
+    try:
+        group, added = group_manager.add_members(group_id, data.get('members', []))
+    except ValueError as e:
+        return {'error': str(e)}
+    
+    if added:
+        logger.info(f"Added {added} to group {group_id}")
+        _send_group_keys(group)
+    return {'group': GroupManager.public_info(group), 'added': added}
+
+@socketio.on('remove_group_members')
+@metrics.track_event('remove_group_members')
+@rate_limited('remove_group_members')
+@crypto_admitted('remove_group_members')
+def handle_remove_group_members(data):
+    """Remove members from a group; only the owner may remove others, anyone may leave"""
+    group_id = data['group_id']
+    user_id = data['user_id']
+    if not presence.has_session(user_id, request.sid):
+        return {'error': 'Not registered on this connection'}
+    group = group_manager.get_group(group_id)
+    members = data.get('members', [user_id])
+    if group is None or user_id not in group['members']:
+        return {'error': 'Not a member of this group'}
+    if user_id != group['owner'] and set(members) != {user_id}:
+        return {'error': 'Only the group owner can remove other members'}
+    
+    try:
+        group, removed = group_manager.remove_members(group_id, members)
+    except ValueError as e:
+        return {'error': str(e)}
+    for member in removed:
+        emit('group_removed', {'group_id': group_id}, to=member)
+    if removed and group['members']:
+        logger.info(f"Removed {removed} from group {group_id}")
+        _send_group_keys(group)
+    return {'group': GroupManager.public_info(group), 'removed': removed}
+
+@socketio.on('send_group_message')
+@metrics.track_event('send_group_message')
+@rate_limited('send_group_message')
+@crypto_admitted('send_group_message', when=_encrypted)
+def handle_send_group_message(data):
+    """Send a message to every member of a group with a single group-key encryption"""
+    sender = data['sender']
+    group_id = data['group_id']
+    message_text = data['message']
+    encrypted = data.get('encrypted', False)
+    if not presence.has_session(sender, request.sid):
+        return {'error': 'Not registered on this connection'}
+    
+    group = group_manager.get_group(group_id)
+    if group is None or sender not in group['members']:
+        return {'error': 'Not a member of this group'}
+    
+    logger.info(f"Group message from {sender} to {group_id}: {'[ENCRYPTED]' if encrypted else message_text}")
+    
+    message = {
+        'sender': sender,
+        'group_id': group_id,
+        'timestamp': message_handler.get_timestamp(),
+        'message': message_text,
+        'encrypted': encrypted,
+        'hash': hashlib.sha256(message_text.encode()).hexdigest(),
+        'id': message_handler.generate_message_id()
+    }
+    certificate = user_certificates.get(sender)
+    if certificate is not None:
+        message['certificate_fingerprint'] = certificate['fingerprint']
+    message_hashes[message['id']] = message['hash']
+    
+    if encrypted:
+        # One signature and one AES-GCM encryption, whatever the group size
+        signature = crypto_offload.run(sign_message, message_text, user_keys[sender]['private_key'])
+        message['signature'] = base64.b64encode(signature).decode('utf-8')
+        message['group'] = group_manager.encrypt(group, sender, message_text)
+    
+    # Stored once under the group's conversation
+    message_handler.log_message(message)
+    
+    _emit_message(message, sender)
+    if not message_handler.is_tampering_active():
+        for member in group['members']:
+            if member != sender:
+                _deliver(message, member)
+    return {'message_id': message['id'], 'seq': message.get('seq'), 'epoch': group['epoch']}
+
+@socketio.on('get_user_directory')
+@metrics.track_event('get_user_directory')
+def handle_get_user_directory(data=None):
+    """Socket.IO equivalent of /api/users"""
+    data = data if isinstance(data, dict) else {}
+    try:
+        return _directory_page(data.get('cursor'), data.get('limit'))
+    except (TypeError, ValueError):
+        return {'error': 'Invalid cursor or limit'}
+
+@socketio.on('get_group_key')
+@metrics.track_event('get_group_key')
+def handle_get_group_key(data):
+    """Resend a member's wrapped copy of the current group key"""
+    user_id = data.get('user_id')
+    if not presence.has_session(user_id, request.sid):
+        return {'error': 'Not registered on this connection'}
+    group = group_manager.get_group(data.get('group_id'))
+    if group is None or user_id not in group['members']:
+        return {'error': 'Not a member of this group'}
+    emit('group_key', dict(GroupManager.key_info(group, user_id), group=GroupManager.public_info(group)))
+
+@socketio.on('get_groups')
+@metrics.track_event('get_groups')
+def handle_get_groups(data):
+    """List the groups a user belongs to"""
+    user_id = data.get('user_id')
+    if not presence.has_session(user_id, request.sid):
+        emit('group_list', {'groups': [], 'error': 'Not registered on this connection'})
+        return
+    emit('group_list', {'groups': group_manager.groups_for_user(user_id)})
+
+@socketio.on('get_group_conversation')
+@metrics.track_event('get_group_conversation')
+def handle_get_group_conversation(data):
+    """Page through a group's history with the same seq cursors as get_conversation"""
+    group_id = data.get('group_id')
+    if not presence.has_session(data.get('user_id'), request.sid):
+        emit('group_history', {'group_id': group_id, 'messages': [], 'error': 'Not registered on this connection'})
+        return
+    if not group_manager.is_member(group_id, data.get('user_id')):
+        emit('group_history', {'group_id': group_id, 'messages': [], 'error': 'Not a member of this group'})
+        return
+    
+    try:
+        limit = _page_limit(data.get('limit'))
+        before = _seq_cursor(data.get('before'))
+        after = _seq_cursor(data.get('after'))
+    except (TypeError, ValueError):
+        emit('group_history', {'group_id': group_id, 'messages': [], 'error': 'Invalid cursor or limit'})
+        return
+    messages, has_more = message_handler.get_group_conversation(
+        group_id,
+        before=before,
+        after=after,
+        limit=limit
+    )
+    emit('group_history', {
+        'group_id': group_id,
+        'messages': messages,
+        'has_more': has_more
+    })
+
+def _directory_page(cursor, limit):
+    return directory.page(cursor or None, _page_limit(limit, MAX_USER_PAGE_SIZE, MAX_USER_PAGE_SIZE))
+
 @app.route('/api/users', methods=['GET'])
 def get_users():
-    return jsonify({'users': list(message_handler.get_users())})
+    """One page of the user directory; pass next_cursor back as cursor for the next page"""
+    try:
+        return jsonify(_directory_page(request.args.get('cursor'), request.args.get('limit')))
+    except ValueError:
+        return jsonify({'error': 'Invalid limit'}), 400
+
+@app.route('/api/certificates/<fingerprint>', methods=['GET'])
+def get_certificate(fingerprint):
+    certificate = _find_certificate(fingerprint)
+    if certificate is None:
+        return jsonify({'error': 'Unknown certificate'}), 404
+    return jsonify({'certificate': certificate})
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/stats', methods=['GET'])
+def get_stats():
+    return jsonify({
+        'process': get_process_stats(),
+        'key_pool': key_pool.get_stats(),
+        'sessions': session_cache.get_stats(),
+        'certificates': certificate_cache.get_stats(),
+        'key_contexts': key_contexts.get_stats(),
+        'groups': group_manager.get_stats(),
+        'presence': presence.get_stats(),
+        'directory': directory.get_stats(),
+        'wire_formats': wire_formats.get_stats(),
+        'crypto_admission': crypto_admission.get_stats(),
+        'rate_limits': rate_limits.get_stats(),
+        'keystore': keystore.get_stats() if keystore is not None else None,
+        'cluster_cache': shared_state.get_stats() if CLUSTER_BROKER_URL else None,
+        'crypto_timings': crypto_timings.get_stats(),
+        'memory': {
+            'message_hashes': message_hashes.get_stats(),
+            'intercepted_messages': intercepted_messages.get_stats(),
+            'messages': message_handler.get_stats()
+        }
+    })
 
 if __name__ == '__main__':
-    socketio.run(app, debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    crypto_offload.start()
+    key_pool.start()
+    atexit.register(crypto_offload.stop)
+    atexit.register(key_pool.stop)
+    # The werkzeug server used in threading mode refuses to start without debug unless told otherwise
+    run_options = {'allow_unsafe_werkzeug': True} if ASYNC_MODE == 'threading' else {}
+    socketio.run(app, debug=os.environ.get('FLASK_DEBUG', '1') == '1', host='0.0.0.0',
+                 port=int(os.environ.get('PORT', 5000)), **run_options)
\ No newline at end of file
@@ -0,0 +1,585 @@
+"""
+Multi-node support: shared state and cross-node Socket.IO fan-out
+
+Server nodes share users, keys and certificates through a SharedState and
+relay emits to each other through a pub/sub message queue. LocalBroker is
+a small TCP broker that provides both, so several nodes can run behind a
+load balancer without Redis. Frames are length-prefixed JSON, with bytes
+carried as base64, so nothing received from the network is ever unpickled.
+The broker has no authentication; keep its port on a private network.
+
+Run the broker with: python -m app.backend.cluster --port 5055
+"""
+from collections import OrderedDict
+from collections.abc import MutableMapping
+import argparse
+import base64
+import json
+import logging
+import socket
+import socketserver
+import struct
+import threading
+import time
+import uuid
+from urllib.parse import urlparse
+
+import socketio
+
+logger = logging.getLogger(__name__)
+
+FRAME_HEADER = struct.Struct('>I')
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+# Seconds a node's members outlive its last heartbeat
+DEFAULT_NODE_TTL = 15
+# Pub/sub channel announcing writes to cached namespaces
+INVALIDATE_CHANNEL = 'state-invalidate'
+
+def _json_default(value):
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return {'__bytes__': base64.b64encode(bytes(value)).decode('ascii')}
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    raise TypeError(f"Cannot send {type(value).__name__} through the cluster broker")
+
+def _json_object_hook(obj):
+    if len(obj) == 1 and '__bytes__' in obj:
+        return base64.b64decode(obj['__bytes__'])
+    return obj
+
+def _send_frame(sock, obj):
+    payload = json.dumps(obj, default=_json_default, separators=(',', ':')).encode('utf-8')
+    sock.sendall(FRAME_HEADER.pack(len(payload)) + payload)
+
+def _recv_exact(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            raise ConnectionError("Broker connection closed")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+def _recv_frame(sock):
+    (length,) = FRAME_HEADER.unpack(_recv_exact(sock, FRAME_HEADER.size))
+    if length > MAX_FRAME_SIZE:
+        raise ConnectionError(f"Broker frame of {length} bytes exceeds the limit")
+    try:
+        return json.loads(_recv_exact(sock, length), object_hook=_json_object_hook)
+    except ValueError as e:
+        raise ConnectionError(f"Malformed broker frame: {e}")
+
+def parse_broker_url(url):
+    """Split a tcp://host:port broker URL into (host, port)"""
+    parsed = urlparse(url)
+    return parsed.hostname or '127.0.0.1', parsed.port or 5055
+
+class _BrokerHandler(socketserver.BaseRequestHandler):
+    """Serves one client connection: key-value requests or a pub/sub subscription"""
+
+    def handle(self):
+        broker = self.server
+        try:
+            while True:
+                op, *args = _recv_frame(self.request)
+                if op == 'subscribe':
+                    broker.add_subscriber(args[0], self.request)
+                    try:
+                        # Subscribers only receive; block until they hang up
+                        while self.request.recv(1):
+                            pass
+                    finally:
+                        broker.remove_subscriber(args[0], self.request)
+                    return
+                _send_frame(self.request, broker.execute(op, args))
+        except (ConnectionError, OSError, ValueError, TypeError):
+            return
+
+class LocalBroker(socketserver.ThreadingTCPServer):
+    """
+    In-process stand-in for Redis: namespaced key-value store plus pub/sub
+
+    Operations are executed under one lock, so setdefault, replace_if,
+    add_member and remove_member are atomic across nodes. Members added with add_member
+    belong to the node that added them and are dropped once that node
+    misses its heartbeats for its TTL, so a crashed node's sessions don't
+    stay online forever.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=5055):
+        super().__init__((host, port), _BrokerHandler)
+        self._lock = threading.Lock()
+        self._data = {}
+        self._subscribers = {}
+        # node -> monotonic deadline, and node -> (namespace, key, member) it added
+        self._nodes = {}
+        self._owned = {}
+        self._next_sweep = 0.0
+
+    def _discard_member(self, name, key, member):
+        namespace = self._data.get(name, {})
+        members = namespace.get(key)
+        if members is None:
+            return 0
+        members.pop(member, None)
+        if not members:
+            del namespace[key]
+        return len(members)
+
+    def _sweep(self, now):
+        """Drop the members of nodes whose heartbeat expired; caller holds the lock"""
+        self._next_sweep = now + 1.0
+        for node, deadline in list(self._nodes.items()):
+            if deadline > now:
+                continue
+            del self._nodes[node]
+            owned = self._owned.pop(node, ())
+            for name, key, member in owned:
+                self._discard_member(name, key, member)
+            logger.warning(f"Node {node} missed its heartbeat, dropped {len(owned)} of its members")
+
+    def execute(self, op, args):
+        if op == 'publish':
+            channel, payload = args
+            with self._lock:
+                subscribers = list(self._subscribers.get(channel, {}).items())
+            for sock, send_lock in subscribers:
+                try:
+                    with send_lock:
+                        _send_frame(sock, payload)
+                except OSError:
+                    self.remove_subscriber(channel, sock)
+            return None
+
+        with self._lock:
+            now = time.monotonic()
+            if now >= self._next_sweep:
+                self._sweep(now)
+            if op == 'heartbeat':
+                node, ttl = args
+                known = node in self._nodes
+                self._nodes[node] = now + ttl
+                return known
+
+            namespace = self._data.setdefault(args[0], {})
+            if op == 'add_member':
+                name, key, member, value, node = args
+                namespace.setdefault(key, {})[member] = value
+                # Members added without a node never expire
+                if node is not None:
+                    if node not in self._nodes:
+                        self._nodes[node] = now + DEFAULT_NODE_TTL
+                    self._owned.setdefault(node, set()).add((name, key, member))
+                return len(namespace[key])
+            if op == 'remove_member':
+                name, key, member, node = args
+                if node is not None:
+                    self._owned.get(node, set()).discard((name, key, member))
+                return self._discard_member(name, key, member)
+            if op == 'get':
+                return namespace.get(args[1])
+            if op == 'set':
+                namespace[args[1]] = args[2]
+                return None
+            if op == 'setdefault':
+                return namespace.setdefault(args[1], args[2])
+            if op == 'replace_if':
+                name, key, field, expected, value = args
+                current = namespace.get(key)
+                if current is None or current.get(field) != expected:
+                    return False
+                if value is None:
+                    del namespace[key]
+                else:
+                    namespace[key] = value
+                return True
+            if op == 'delete':
+                return namespace.pop(args[1], None) is not None
+            if op == 'contains':
+                return args[1] in namespace
+            if op == 'keys':
+                return list(namespace)
+            if op == 'len':
+                return len(namespace)
+            raise ValueError(f"Unknown broker operation: {op}")
+
+    def add_subscriber(self, channel, sock):
+        with self._lock:
+            self._subscribers.setdefault(channel, {})[sock] = threading.Lock()
+
+    def remove_subscriber(self, channel, sock):
+        with self._lock:
+            self._subscribers.get(channel, {}).pop(sock, None)
+
+    def start(self):
+        """Serve in a background thread, e.g. inside tests or a single node"""
+        thread = threading.Thread(target=self.serve_forever, name='local-broker', daemon=True)
+        thread.start()
+        return thread
+
+class BrokerClient:
+    """
+    Request/response connections to a LocalBroker
+
+    Each call borrows an idle connection, or opens one, so concurrent
+    handlers don't queue behind one socket. At most `max_idle`
+    connections are kept open between calls.
+    """
+
+    def __init__(self, url, max_idle=8):
+        self.address = parse_broker_url(url)
+        self.max_idle = max_idle
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def call(self, op, *args):
+        for attempt in range(2):
+            with self._lock:
+                sock = self._idle.pop() if self._idle else None
+            try:
+                if sock is None:
+                    sock = socket.create_connection(self.address)
+                _send_frame(sock, (op,) + args)
+                result = _recv_frame(sock)
+            except (ConnectionError, OSError):
+                if sock is not None:
+                    sock.close()
+                if attempt:
+                    raise
+                continue
+            with self._lock:
+                if len(self._idle) < self.max_idle:
+                    self._idle.append(sock)
+                    sock = None
+            if sock is not None:
+                sock.close()
+            return result
+
+    def publish(self, channel, payload):
+        self.call('publish', channel, payload)
+
+    def subscribe(self, channel, on_connect=None):
+        """
+        Yield payloads published to a channel, reconnecting if the broker goes away
+
+        Args:
+            channel (str): Channel name
+            on_connect (callable): Called after every (re)subscription, since
+                anything published while disconnected was missed
+        """
+        while True:
+            try:
+                sock = socket.create_connection(self.address)
+                _send_frame(sock, ('subscribe', channel))
+                if on_connect is not None:
+                    on_connect()
+                while True:
+                    yield _recv_frame(sock)
+            except (ConnectionError, OSError) as e:
+                logger.warning(f"Lost broker subscription to {channel}: {e}")
+                time.sleep(1)
+
+class LocalSocketManager(socketio.PubSubManager):
+    """Socket.IO client manager that relays emits between nodes through a LocalBroker"""
+
+    name = 'localbroker'
+
+    def __init__(self, url='tcp://127.0.0.1:5055', channel='socketio', write_only=False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.client = BrokerClient(url)
+
+    def _publish(self, data):
+        # Published as a dict; python-socketio would otherwise unpickle bytes messages
+        self.client.publish(self.channel, data)
+
+    def _listen(self):
+        yield from self.client.subscribe(self.channel)
+
+class LocalNamespace(dict):
+    """
+    A process-local namespace
+
+    A dict plus the member-set operations of BrokerNamespace, so callers
+    like PresenceTracker work the same with or without a cluster.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._lock = threading.Lock()
+
+    def add_member(self, key, member, value=True, owned=True):
+        """
+        Add a member to the {member: value} map stored under key
+
+        `owned` only matters for BrokerNamespace; there is no other node here.
+
+        Returns:
+            int: How many members the key has now
+        """
+        with self._lock:
+            members = dict(self.get(key) or {})
+            members[member] = value
+            self[key] = members
+            return len(members)
+
+    def remove_member(self, key, member):
+        """
+        Remove a member, deleting the key once it has none left
+
+        Returns:
+            int: How many members the key has left
+        """
+        with self._lock:
+            members = dict(self.get(key) or {})
+            members.pop(member, None)
+            if members:
+                self[key] = members
+            else:
+                self.pop(key, None)
+            return len(members)
+
+    def replace_if(self, key, field, expected, value):
+        """
+        Replace a dict value, or delete it when value is None, if its field still has the expected value
+
+        Returns:
+            bool: Whether the value was replaced
+        """
+        with self._lock:
+            current = self.get(key)
+            if current is None or current.get(field) != expected:
+                return False
+            if value is None:
+                del self[key]
+            else:
+                self[key] = value
+            return True
+
+class SharedState:
+    """Process-local shared state; namespaces are LocalNamespace dicts"""
+
+    def __init__(self):
+        self._namespaces = {}
+
+    def namespace(self, name, encode=None, decode=None):
+        """
+        Get a mapping for one kind of shared data
+
+        Args:
+            name (str): Namespace name, e.g. 'user_keys'
+            encode (callable): Turns a value into something JSON-serializable (bytes allowed) for remote backends
+            decode (callable): Inverse of encode
+
+        Returns:
+            MutableMapping: The namespace
+        """
+        if name not in self._namespaces:
+            self._namespaces[name] = LocalNamespace()
+        return self._namespaces[name]
+
+class BrokerNamespace(MutableMapping):
+    """
+    A SharedState namespace stored in a LocalBroker
+
+    A namespace created with `cache_size` keeps up to that many decoded
+    values it has read, so repeated lookups of users, keys and
+    certificates don't go to the broker. Every write publishes the key on
+    INVALIDATE_CHANNEL and BrokerState drops it from each node's cache.
+    Only read-mostly data should be cached: another node's write is seen
+    as soon as its invalidation arrives, not when the write returns.
+    """
+
+    def __init__(self, client, name, encode=None, decode=None, node=None, cache_size=0):
+        self.client = client
+        self.name = name
+        self.encode = encode or (lambda value: value)
+        self.decode = decode or (lambda value: value)
+        self.node = node or uuid.uuid4().hex
+        self.cache_size = cache_size
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._cache = OrderedDict()
+        # Bumped by every invalidation, so a read that raced one isn't cached
+        self._generation = 0
+        self._cache_lock = threading.Lock()
+        # Members this node added, re-added if the broker expired the node
+        self._members = {}
+        self._members_lock = threading.Lock()
+
+    def _fetch(self, key):
+        """The decoded value of a key, or None; served from the cache when possible"""
+        if not self.cache_size:
+            value = self.client.call('get', self.name, key)
+            return None if value is None else self.decode(value)
+        with self._cache_lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.cache_hits += 1
+                return self._cache[key]
+            self.cache_misses += 1
+            generation = self._generation
+        value = self.client.call('get', self.name, key)
+        if value is None:
+            return None
+        value = self.decode(value)
+        with self._cache_lock:
+            if generation == self._generation:
+                self._cache[key] = value
+                if len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return value
+
+    def invalidate(self, key=None):
+        """Drop one key, or every key, from the read cache"""
+        with self._cache_lock:
+            self._generation += 1
+            if key is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(key, None)
+
+    def _changed(self, key):
+        if self.cache_size:
+            self.invalidate(key)
+            self.client.publish(INVALIDATE_CHANNEL, {'namespace': self.name, 'key': key})
+
+    def __getitem__(self, key):
+        value = self._fetch(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.client.call('set', self.name, key, self.encode(value))
+        self._changed(key)
+
+    def __delitem__(self, key):
+        deleted = self.client.call('delete', self.name, key)
+        self._changed(key)
+        if not deleted:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        if self.cache_size:
+            return self._fetch(key) is not None
+        return self.client.call('contains', self.name, key)
+
+    def __iter__(self):
+        return iter(self.client.call('keys', self.name))
+
+    def __len__(self):
+        return self.client.call('len', self.name)
+
+    def setdefault(self, key, default=None):
+        """Atomically store default unless the key exists, returning the stored value"""
+        value = self.decode(self.client.call('setdefault', self.name, key, self.encode(default)))
+        self._changed(key)
+        return value
+
+    def replace_if(self, key, field, expected, value):
+        """Atomically replace a dict value, or delete it when value is None, if its field still has the expected value"""
+        replaced = self.client.call('replace_if', self.name, key, field, expected,
+                                    None if value is None else self.encode(value))
+        if replaced:
+            self._changed(key)
+        return replaced
+
+    def add_member(self, key, member, value=True, owned=True):
+        """
+        Atomically add a member, returning how many members the key has now
+
+        An owned member belongs to this node and is dropped if the node
+        stops heartbeating; others, e.g. group memberships, stay until
+        removed.
+        """
+        if not owned:
+            return self.client.call('add_member', self.name, key, member, value, None)
+        with self._members_lock:
+            self._members[(key, member)] = value
+        return self.client.call('add_member', self.name, key, member, value, self.node)
+
+    def remove_member(self, key, member):
+        """Atomically remove a member, returning how many members the key has left"""
+        with self._members_lock:
+            self._members.pop((key, member), None)
+        return self.client.call('remove_member', self.name, key, member, self.node)
+
+    def rejoin(self):
+        """Add this node's members again after the broker dropped them"""
+        with self._members_lock:
+            members = list(self._members.items())
+        for (key, member), value in members:
+            self.client.call('add_member', self.name, key, member, value, self.node)
+
+class BrokerState(SharedState):
+    """
+    SharedState kept in a LocalBroker so every node sees the same data
+
+    The node heartbeats every third of `node_ttl` seconds. If the broker
+    had already given up on it, e.g. after a long pause, the node adds
+    its members again. Namespaces listed in `cached` keep a read cache of
+    up to `cache_size` entries, kept current by a subscription to
+    INVALIDATE_CHANNEL.
+    """
+
+    def __init__(self, url, node_ttl=DEFAULT_NODE_TTL, cached=(), cache_size=10000):
+        super().__init__()
+        self.client = BrokerClient(url)
+        self.node = uuid.uuid4().hex
+        self.node_ttl = node_ttl
+        self.cached = set(cached)
+        self.cache_size = cache_size
+        threading.Thread(target=self._heartbeat, name='broker-heartbeat', daemon=True).start()
+        if self.cached:
+            threading.Thread(target=self._invalidations, name='broker-invalidations', daemon=True).start()
+
+    def _invalidate_all(self):
+        for namespace in list(self._namespaces.values()):
+            namespace.invalidate()
+
+    def _invalidations(self):
+        for change in self.client.subscribe(INVALIDATE_CHANNEL, on_connect=self._invalidate_all):
+            namespace = self._namespaces.get(change.get('namespace'))
+            if namespace is not None:
+                namespace.invalidate(change.get('key'))
+
+    def _heartbeat(self):
+        while True:
+            try:
+                if not self.client.call('heartbeat', self.node, self.node_ttl):
+                    for namespace in list(self._namespaces.values()):
+                        namespace.rejoin()
+            except (ConnectionError, OSError) as e:
+                logger.warning(f"Broker heartbeat failed: {e}")
+            time.sleep(self.node_ttl / 3)
+
+    def namespace(self, name, encode=None, decode=None):
+        if name not in self._namespaces:
+            self._namespaces[name] = BrokerNamespace(self.client, name, encode, decode, self.node,
+                                                     self.cache_size if name in self.cached else 0)
+        return self._namespaces[name]
+
+    def get_stats(self):
+        """Read cache hits and misses per cached namespace"""
+        return {
+            name: {'entries': len(namespace._cache), 'hits': namespace.cache_hits, 'misses': namespace.cache_misses}
+            for name, namespace in list(self._namespaces.items()) if namespace.cache_size
+        }
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the cluster broker for multi-node deployments")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5055)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    broker = LocalBroker(args.host, args.port)
+    logger.info(f"Cluster broker listening on {args.host}:{args.port}")
+    broker.serve_forever()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,259 @@
+import logging
+import os
+
+from app.backend.cluster import LocalNamespace
+from app.crypto.group_keys import new_group_key, wrap_group_key, encrypt_group_message
+
+logger = logging.getLogger(__name__)
+
+# Times a membership change is recomputed after losing a race with another change to the group
+MAX_CHANGE_ATTEMPTS = 8
+
+class GroupManager:
+    """
+    Group conversations with a shared symmetric key per group
+
+    Each group key is wrapped once for every member under their RSA public
+    key and replaced (with a new epoch) only when membership changes, so a
+    group message costs one AES-GCM encryption however many members the
+    group has. Groups are stored in a mapping, which can be a SharedState
+    namespace so every node sees them, next to an index of the groups
+    each user belongs to.
+
+    A membership change builds the new member list and wraps the new key
+    without holding any lock, then stores the group with replace_if only if
+    its version is still the one it started from, and otherwise starts
+    over from the current group. The store's replace_if is atomic across
+    nodes, so concurrent changes to a group are never lost, changes to
+    different groups never wait on each other, and a change that fails
+    (an unknown user, a full group) leaves the group as it was.
+    """
+
+    def __init__(self, groups=None, get_public_key=None, run=None, max_members=256, memberships=None):
+        """
+        Args:
+            groups (LocalNamespace): Where groups are stored, by group ID; a SharedState namespace
+            get_public_key (callable): Looks up a user's RSA public key, or returns None
+            run (callable): Runs the RSA key wrapping, e.g. CryptoOffloader.run
+            max_members (int): Largest allowed group
+            memberships (LocalNamespace): user ID -> {group ID: True}; a SharedState namespace
+        """
+        self.groups = groups if groups is not None else LocalNamespace()
+        self.memberships = memberships if memberships is not None else LocalNamespace()
+        self.get_public_key = get_public_key
+        self.run = run or (lambda func, *args: func(*args))
+        self.max_members = max_members
+        self.rekeys = 0
+        self.conflicts = 0
+
+    def _public_keys(self, members):
+        public_keys = {}
+        for member in members:
+            public_key = self.get_public_key(member)
+            if public_key is None:
+                raise ValueError(f"Unknown user: {member}")
+            public_keys[member] = public_key
+        return public_keys
+
+    def _rekeyed(self, group, members):
+        """
+        A copy of a group with new members and a new key wrapped for them
+
+        Raises:
+            ValueError: If the group would be too large or a member is unknown
+        """
+        if len(members) > self.max_members:
+            raise ValueError(f"Groups are limited to {self.max_members} members")
+        key, key_id = new_group_key()
+        wrapped_keys = self.run(wrap_group_key, key, self._public_keys(members))
+        return dict(group, members=members, wrapped_keys=wrapped_keys, key=key, key_id=key_id,
+                    epoch=group['epoch'] + 1)
+
+    def _replace(self, current, group):
+        """
+        Store a new version of a group if nobody changed it since `current` was read
+
+        A group with no members is deleted instead.
+
+        Returns:
+            dict: The stored group, or None if the change lost a race
+        """
+        version = current.get('version')
+        if group['members']:
+            group = dict(group, version=(version or 0) + 1)
+        if not self.groups.replace_if(current['id'], 'version', version, group if group['members'] else None):
+            self.conflicts += 1
+            return None
+        if group['epoch'] != current['epoch']:
+            self.rekeys += 1
+            logger.info(f"Rekeyed group {group['id']} to epoch {group['epoch']} for {len(group['members'])} members")
+        return group
+
+    def _change(self, group_id, change):
+        """
+        Apply change(group) -> (new group or None, result) until it is stored
+
+        Returns:
+            tuple: (group, result); the group is unchanged when change returns None
+
+        Raises:
+            KeyError: If the group doesn't exist
+            ValueError: If the group kept changing under us
+        """
+        for _ in range(MAX_CHANGE_ATTEMPTS):
+            current = self.groups[group_id]
+            group, result = change(current)
+            if group is None:
+                return current, result
+            stored = self._replace(current, group)
+            if stored is not None:
+                return stored, result
+        raise ValueError(f"Group {group_id} is changing too often, try again")
+
+    def create_group(self, name, owner, members):
+        """
+        Create a group and its first key
+
+        Args:
+            name (str): Display name
+            owner (str): Creating user, always a member
+            members (list): Other initial members
+
+        Returns:
+            dict: The group
+        """
+        group = {
+            'id': os.urandom(8).hex(),
+            'name': name,
+            'owner': owner,
+            'epoch': 0
+        }
+        group = dict(self._rekeyed(group, list(dict.fromkeys([owner] + list(members)))), version=1)
+        self.rekeys += 1
+        self.groups[group['id']] = group
+        for member in group['members']:
+            self.memberships.add_member(member, group['id'], owned=False)
+        return group
+
+    def get_group(self, group_id):
+        return self.groups.get(group_id)
+
+    def is_member(self, group_id, user_id):
+        group = self.groups.get(group_id)
+        return group is not None and user_id in group['members']
+
+    def add_members(self, group_id, user_ids):
+        """
+        Add members and rekey if anyone was actually added
+
+        Returns:
+            tuple: (group, list of added user IDs)
+        """
+        def change(group):
+            added = [user_id for user_id in dict.fromkeys(user_ids) if user_id not in group['members']]
+            if not added:
+                return None, added
+            return self._rekeyed(group, group['members'] + added), added
+
+        group, added = self._change(group_id, change)
+        for user_id in added:
+            self.memberships.add_member(user_id, group_id, owned=False)
+        return group, added
+
+    def remove_members(self, group_id, user_ids):
+        """
+        Remove members and rekey so they can't read later messages
+
+        If the owner is removed, ownership passes to the longest-standing
+        remaining member.
+
+        Returns:
+            tuple: (group, list of removed user IDs)
+        """
+        user_ids = set(user_ids)
+
+        def change(group):
+            removed = [member for member in group['members'] if member in user_ids]
+            if not removed:
+                return None, removed
+            members = [member for member in group['members'] if member not in user_ids]
+            if not members:
+                return dict(group, members=[]), removed
+            owner = group['owner'] if group['owner'] in members else members[0]
+            return self._rekeyed(dict(group, owner=owner), members), removed
+
+        group, removed = self._change(group_id, change)
+        for user_id in removed:
+            self.memberships.remove_member(user_id, group_id)
+        return group, removed
+
+    def rewrap_member(self, user_id):
+        """
+        Re-wrap current group keys for a member whose RSA keys changed
+
+        Membership is unchanged, so the group keys themselves are kept.
+
+        Returns:
+            list: The groups that were updated
+        """
+        public_key = self._public_keys([user_id])[user_id]
+
+        def change(group):
+            if user_id not in group['members']:
+                return None, False
+            wrapped_key = self.run(wrap_group_key, group['key'], {user_id: public_key})[user_id]
+            return dict(group, wrapped_keys=dict(group['wrapped_keys'], **{user_id: wrapped_key})), True
+
+        updated = []
+        for group in self._member_groups(user_id):
+            try:
+                group, rewrapped = self._change(group['id'], change)
+            except KeyError:
+                # Deleted since the membership index was read
+                continue
+            except ValueError as e:
+                logger.warning(f"Could not re-wrap the key of group {group['id']} for {user_id}: {e}")
+                continue
+            if rewrapped:
+                updated.append(group)
+        return updated
+
+    def _member_groups(self, user_id):
+        """The groups a user belongs to, found through the membership index"""
+        groups = []
+        for group_id in list(self.memberships.get(user_id) or ()):
+            group = self.groups.get(group_id)
+            if group is not None and user_id in group['members']:
+                groups.append(group)
+        return groups
+
+    def groups_for_user(self, user_id):
+        """Public info of every group a user belongs to"""
+        return [self.public_info(group) for group in self._member_groups(user_id)]
+
+    def encrypt(self, group, sender, message):
+        """Encrypt a message under the group's current key"""
+        return encrypt_group_message(message, group['id'], group['epoch'], group['key_id'], group['key'], sender)
+
+    @staticmethod
+    def public_info(group):
+        """Group fields that are safe to send to any member"""
+        return {name: group[name] for name in ('id', 'name', 'owner', 'members', 'epoch')}
+
+    @staticmethod
+    def key_info(group, user_id):
+        """The group_key event payload for one member"""
+        return {
+            'group_id': group['id'],
+            'epoch': group['epoch'],
+            'key_id': group['key_id'],
+            'wrapped_key': group['wrapped_keys'][user_id]
+        }
+
+    def get_stats(self):
+        """Get group count, rekey and conflict counters"""
+        return {
+            'groups': len(self.groups),
+            'rekeys': self.rekeys,
+            'conflicts': self.conflicts
+        }
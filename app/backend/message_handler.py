@@ -1,13 +1,37 @@
 import time
+import heapq
 import logging
+import os
+import threading
 from datetime import datetime
+from itertools import islice
+
+from app.backend.storage import InMemoryMessageStore, conversation_key, group_conversation_key, \
+    message_conversation_key, GROUP_CONVERSATION
+from app.backend.offline_queue import OfflineQueue
 
 class MessageHandler:
-    def __init__(self):
-        self.users = {} 
-        self.messages = []  
+    def __init__(self, store=None, users=None, offline_queue=None, load_user=None):
+        self.users = users if users is not None else {}
+        # Called with a user ID on a lookup miss; returns the user's public key or None
+        self.load_user = load_user
+        self.store = store if store is not None else InMemoryMessageStore()
+        self.offline_queue = offline_queue if offline_queue is not None else OfflineQueue()
         self.logger = logging.getLogger(__name__)
         self.tampering_active = False  
+        
+        # Direct conversations of each user, so sync only looks at conversations they are in
+        self._user_conversations = {}
+        self._conversations_lock = threading.Lock()
+        for key in self.store.conversation_keys():
+            self._index_conversation(key)
+    
+    def _index_conversation(self, key):
+        if key[0] == GROUP_CONVERSATION:
+            return
+        with self._conversations_lock:
+            for user_id in key:
+                self._user_conversations.setdefault(user_id, set()).add(key)
     
     def add_user(self, user_id, public_key):
         """Add a user to the system with their public key"""
@@ -20,20 +44,154 @@ class MessageHandler:
     
     def get_user_public_key(self, user_id):
         """Get a user's public key"""
-        if user_id in self.users:
-            return self.users[user_id]
+        public_key = self.users.get(user_id)
+        if public_key is not None:
+            return public_key
+        public_key = self.load_user(user_id) if self.load_user is not None else None
+        if public_key is not None:
+            return public_key
         else:
             self.logger.warning(f"Attempted to get public key for unknown user: {user_id}")
             return None
     
     def log_message(self, message):
-        """Store a message for interception simulation"""
-        self.messages.append(message)
-        self.logger.info(f"Logged message from {message.get('sender', 'unknown')} to {message.get('recipient', 'unknown')}")
+        """Store a message for interception simulation and index it by conversation"""
+        self.store.append(message)
+        if not message.get('group_id'):
+            self._index_conversation(message_conversation_key(message))
+        self.logger.info(f"Logged message from {message.get('sender', 'unknown')} to {message.get('recipient') or message.get('group_id', 'unknown')}")
     
     def get_logged_messages(self):
         """Get all logged messages"""
-        return self.messages
+        return self.store.get_messages()
+    
+    def get_conversation(self, user_a, user_b, before=None, after=None, limit=50):
+        """
+        Get a page of the conversation between two users
+        
+        Args:
+            user_a (str): One participant
+            user_b (str): The other participant
+            before (int): Only return messages with a lower seq
+            after (int): Only return messages with a higher seq
+            limit (int): Maximum number of messages to return
+            
+        Returns:
+            tuple: (messages in time order, whether more remain beyond the page)
+        """
+        return self.store.get_conversation(conversation_key(user_a, user_b),
+                                           before=before, after=after, limit=limit)
+    
+    def get_group_conversation(self, group_id, before=None, after=None, limit=50):
+        """
+        Get a page of a group's conversation
+        
+        Args:
+            group_id (str): The group
+            before (int): Only return messages with a lower seq
+            after (int): Only return messages with a higher seq
+            limit (int): Maximum number of messages to return
+            
+        Returns:
+            tuple: (messages in time order, whether more remain beyond the page)
+        """
+        return self.store.get_conversation(group_conversation_key(group_id),
+                                           before=before, after=after, limit=limit)
+    
+    def sync(self, user_id, cursor=0, limit=100, group_ids=()):
+        """
+        Get a user's messages newer than a cursor, across all their conversations
+        
+        The cursor is the seq of the last message the client has; seqs only
+        grow, so it is a monotonically increasing per-user position that
+        survives restarts with a durable store. Conversations are read lazily
+        after the cursor and merged by seq, stopping once the page is full,
+        so a sync reads O(conversations + limit) messages with O(log n)
+        index lookups, however long the history is.
+        
+        Args:
+            user_id (str): The user
+            cursor (int): Seq of the last message already synced, 0 for everything
+            limit (int): Maximum number of messages to return
+            group_ids (iterable): Groups the user belongs to
+            
+        Returns:
+            tuple: (messages in seq order, cursor for the next call, whether more remain)
+        """
+        with self._conversations_lock:
+            keys = list(self._user_conversations.get(user_id, ()))
+        keys.extend(group_conversation_key(group_id) for group_id in group_ids)
+        
+        merged = heapq.merge(*(self._messages_after(key, cursor, limit) for key in keys),
+                             key=lambda message: message['seq'])
+        messages = list(islice(merged, limit + 1))
+        has_more = len(messages) > limit
+        messages = messages[:limit]
+        return messages, (messages[-1]['seq'] if messages else cursor), has_more
+    
+    def _messages_after(self, key, cursor, limit):
+        """
+        Yield a conversation's messages after a cursor in seq order, a page at a time
+        
+        Pages start at one message and double up to limit, so a conversation
+        that contributes k messages to a sync page costs O(k + 1) reads.
+        """
+        page_size = 1
+        while True:
+            page, more = self.store.get_conversation(key, after=cursor, limit=page_size)
+            yield from page
+            if not more or not page:
+                return
+            cursor = page[-1]['seq']
+            page_size = min(page_size * 2, limit)
+    
+    def queue_offline(self, user_id, message):
+        """
+        Hold a message for a recipient with no connected socket until they come back
+
+        Only registered users (or users the keystore can bring back) get a
+        queue, so messages to made-up IDs can't fill the offline queues.
+
+        Returns:
+            int: The message's offline_seq, or None if it wasn't queued
+        """
+        if self.get_user_public_key(user_id) is None:
+            return None
+        offline_seq = self.offline_queue.enqueue(user_id, message)
+        if offline_seq is not None:
+            self.logger.info(f"Queued message for offline user {user_id}")
+        return offline_seq
+    
+    def get_offline_chunk(self, user_id, limit=100):
+        """
+        Get the next chunk of a user's offline messages
+        
+        Messages stay queued until acknowledged with ack_offline.
+        
+        Returns:
+            tuple: (messages with offline_seq set, number still queued after this chunk)
+        """
+        return self.offline_queue.peek(user_id, limit)
+    
+    def ack_offline(self, user_id, up_to):
+        """Drop a user's offline messages up to and including offline_seq up_to"""
+        return self.offline_queue.ack(user_id, up_to)
+    
+    def generate_message_id(self):
+        """
+        Generate a compact, time-sortable 128-bit message ID
+        
+        Like a ULID: 48 bits of millisecond timestamp followed by 80 random bits.
+        """
+        return (int(time.time() * 1000).to_bytes(6, 'big') + os.urandom(10)).hex()
+    
+    def get_stats(self):
+        """Get user count and message store usage"""
+        return {
+            'users': len(self.users),
+            'store': self.store.get_stats(),
+            'offline': self.offline_queue.get_stats()
+        }
     
     def get_timestamp(self):
         """Get a formatted timestamp for messages"""
@@ -41,9 +199,16 @@ class MessageHandler:
     
     def clear_messages(self):
         """Clear all logged messages"""
-        self.messages = []
+        self.store.clear()
+        with self._conversations_lock:
+            self._user_conversations = {}
         self.logger.info("Cleared all logged messages")
         
+    def close(self):
+        """Flush and close the message store and offline queue"""
+        self.store.close()
+        self.offline_queue.close()
+        
     def set_tampering_active(self, active):
         """Set whether tampering is active"""
         self.tampering_active = active
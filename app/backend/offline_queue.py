@@ -0,0 +1,285 @@
+"""
+Store-and-forward queues for messages to users with no connected socket
+
+Each user's queue is bounded by message count and age, and all queues
+together by the number of users and the bytes of queued messages: past
+the byte cap the oldest messages overall are evicted, and a user without
+a queue gets none once the user cap is reached. Queued messages
+are handed out in chunks and removed only when the client acknowledges
+them, so a drain interrupted by a disconnect resumes where it stopped.
+With a journal path, enqueues and acks are appended to a JSON-lines
+journal that is replayed on start and compacted as it grows.
+"""
+from collections import deque
+from itertools import islice
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class OfflineQueue:
+    """
+    Per-user offline message queues
+
+    Entries get a per-user offline_seq; clients acknowledge everything up
+    to an offline_seq once they have stored the chunk that contained it.
+    """
+
+    def __init__(self, max_messages=1000, max_age=7 * 24 * 3600, journal_path=None, compact_ratio=4,
+                 max_users=100000, max_bytes=256 * 1024 * 1024, on_evict=None):
+        """
+        Args:
+            max_messages (int): Most messages kept per user; the oldest are dropped first
+            max_age (int): Seconds a queued message is kept
+            journal_path (str): Journal file for durability, or None to keep queues in memory only
+            compact_ratio (int): Rewrite the journal once it holds this many records per live message
+            max_users (int): Most users with queued messages
+            max_bytes (int): Most bytes of queued messages (as JSON) across all users
+            on_evict (callable): Called with (reason, count) when messages are evicted
+                ('bytes') or refused because the user cap was reached ('users')
+        """
+        self.max_messages = max_messages
+        self.max_age = max_age
+        self.journal_path = journal_path
+        self.compact_ratio = compact_ratio
+        self.max_users = max_users
+        self.max_bytes = max_bytes
+        self.on_evict = on_evict
+        self._queues = {}
+        self._next_seq = {}
+        # (user_id, offline_seq) in enqueue order, to find the oldest message overall
+        self._order = deque()
+        self._lock = threading.Lock()
+        self._journal = None
+        self._journal_records = 0
+        self._size = 0
+        self._bytes = 0
+        self.dropped = 0
+        self.expired = 0
+        self.delivered = 0
+        self.evicted = 0
+        self.refused = 0
+
+        if journal_path:
+            directory = os.path.dirname(journal_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._replay()
+            self._journal = open(journal_path, 'a', encoding='utf-8')
+
+    def _replay(self):
+        """Rebuild the queues from the journal, truncating a torn final record"""
+        if not os.path.exists(self.journal_path):
+            return
+        with open(self.journal_path, 'rb+') as f:
+            data = f.read()
+            end = data.rfind(b'\n') + 1
+            if end < len(data):
+                logger.warning(f"Truncating torn record at the end of {self.journal_path}")
+                f.truncate(end)
+        for line in data[:end].decode('utf-8').splitlines():
+            try:
+                record = json.loads(line)
+            except ValueError:
+                logger.warning(f"Skipping corrupt offline queue journal record in {self.journal_path}")
+                continue
+            self._journal_records += 1
+            user_id = record['user']
+            if record['op'] == 'enqueue':
+                self._append(user_id, record['offline_seq'], record['at'], record['message'])
+                self._next_seq[user_id] = max(self._next_seq.get(user_id, 1), record['offline_seq'] + 1)
+            elif record['op'] == 'ack':
+                self._remove_through(user_id, record['up_to'])
+            elif record['op'] == 'next':
+                self._next_seq[user_id] = max(self._next_seq.get(user_id, 1), record['offline_seq'])
+        for user_id in list(self._queues):
+            self._expire(user_id, time.time())
+        # A compacted journal lists messages by user, not in the order they arrived
+        self._rebuild_order()
+        # Only counted in the stats; on_evict's metrics may not exist yet at startup
+        self._evict_bytes(notify=False)
+        logger.info(f"Recovered {self._size} offline messages for {len(self._queues)} users")
+
+    def _write(self, record):
+        if self._journal is None:
+            return
+        self._journal.write(json.dumps(record, separators=(',', ':')) + '\n')
+        self._journal.flush()
+        self._journal_records += 1
+        if self._journal_records > self.compact_ratio * max(self._size, 256):
+            self._compact()
+
+    def _compact(self):
+        """Rewrite the journal with only the live entries"""
+        temp_path = self.journal_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            # Keep sequence numbers moving forward so late acks can't match new messages
+            for user_id, next_seq in self._next_seq.items():
+                f.write(json.dumps({'op': 'next', 'user': user_id, 'offline_seq': next_seq},
+                                   separators=(',', ':')) + '\n')
+            for user_id, entries in self._queues.items():
+                for offline_seq, enqueued_at, message, _ in entries:
+                    f.write(json.dumps({'op': 'enqueue', 'user': user_id, 'offline_seq': offline_seq,
+                                        'at': enqueued_at, 'message': message}, separators=(',', ':')) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self._journal.close()
+        os.replace(temp_path, self.journal_path)
+        self._journal = open(self.journal_path, 'a', encoding='utf-8')
+        self._journal_records = self._size + len(self._next_seq)
+
+    def _append(self, user_id, offline_seq, enqueued_at, message, size=None):
+        if size is None:
+            size = len(json.dumps(message, separators=(',', ':')))
+        entries = self._queues.setdefault(user_id, deque())
+        entries.append((offline_seq, enqueued_at, message, size))
+        self._order.append((user_id, offline_seq))
+        self._size += 1
+        self._bytes += size
+        while len(entries) > self.max_messages:
+            self._popleft(entries)
+            self.dropped += 1
+
+    def _popleft(self, entries):
+        entry = entries.popleft()
+        self._size -= 1
+        self._bytes -= entry[3]
+        return entry
+
+    def _rebuild_order(self):
+        """Rebuild the enqueue order from the live entries, dropping acked and expired ones"""
+        live = sorted((enqueued_at, offline_seq, user_id)
+                      for user_id, entries in self._queues.items()
+                      for offline_seq, enqueued_at, _, _ in entries)
+        self._order = deque((user_id, offline_seq) for _, offline_seq, user_id in live)
+
+    def _evict_bytes(self, notify=True):
+        """Evict the oldest messages overall until the queues fit in max_bytes"""
+        evicted = 0
+        while self._bytes > self.max_bytes and self._order:
+            user_id, offline_seq = self._order.popleft()
+            entries = self._queues.get(user_id)
+            # Acked, expired and dropped messages leave stale order entries behind
+            if not entries or entries[0][0] != offline_seq:
+                continue
+            self._popleft(entries)
+            if not entries:
+                del self._queues[user_id]
+            evicted += 1
+        if len(self._order) > 2 * self._size + 1024:
+            self._rebuild_order()
+        if evicted:
+            self.evicted += evicted
+            logger.warning(f"Evicted {evicted} offline messages to stay within {self.max_bytes} bytes")
+            if notify and self.on_evict is not None:
+                self.on_evict('bytes', evicted)
+
+    def _remove_through(self, user_id, up_to):
+        entries = self._queues.get(user_id)
+        removed = 0
+        while entries and entries[0][0] <= up_to:
+            self._popleft(entries)
+            removed += 1
+        if entries is not None and not entries:
+            del self._queues[user_id]
+        return removed
+
+    def _expire(self, user_id, now):
+        entries = self._queues.get(user_id)
+        if self.max_age is None or entries is None:
+            return
+        cutoff = now - self.max_age
+        while entries and entries[0][1] < cutoff:
+            self._popleft(entries)
+            self.expired += 1
+        if not entries:
+            del self._queues[user_id]
+
+    def enqueue(self, user_id, message):
+        """
+        Queue a message for a user who is offline
+
+        Returns:
+            int: The message's offline_seq, or None if the user cap was reached
+        """
+        now = time.time()
+        size = len(json.dumps(message, separators=(',', ':')))
+        with self._lock:
+            if user_id not in self._queues and len(self._queues) >= self.max_users:
+                self.refused += 1
+                logger.warning(f"Offline queues are full ({self.max_users} users); not queuing for {user_id}")
+                if self.on_evict is not None:
+                    self.on_evict('users', 1)
+                return None
+            offline_seq = self._next_seq.get(user_id, 1)
+            self._next_seq[user_id] = offline_seq + 1
+            self._append(user_id, offline_seq, now, message, size)
+            self._write({'op': 'enqueue', 'user': user_id, 'offline_seq': offline_seq, 'at': now, 'message': message})
+            self._evict_bytes()
+        return offline_seq
+
+    def peek(self, user_id, limit=100):
+        """
+        Get the oldest queued messages for a user without removing them
+
+        Args:
+            user_id (str): The user
+            limit (int): Chunk size
+
+        Returns:
+            tuple: (messages with their offline_seq set, number still queued after this chunk)
+        """
+        with self._lock:
+            self._expire(user_id, time.time())
+            entries = self._queues.get(user_id, ())
+            chunk = [dict(message, offline_seq=offline_seq)
+                     for offline_seq, _, message, _ in islice(entries, limit)]
+            return chunk, max(0, len(entries) - len(chunk))
+
+    def ack(self, user_id, up_to):
+        """
+        Remove every queued message up to and including an offline_seq
+
+        Returns:
+            int: Number of messages removed
+        """
+        with self._lock:
+            removed = self._remove_through(user_id, up_to)
+            if removed:
+                self.delivered += removed
+                self._write({'op': 'ack', 'user': user_id, 'up_to': up_to})
+        return removed
+
+    def count(self, user_id):
+        with self._lock:
+            return len(self._queues.get(user_id, ()))
+
+    def close(self):
+        with self._lock:
+            if self._journal is not None:
+                self._journal.flush()
+                os.fsync(self._journal.fileno())
+                self._journal.close()
+                self._journal = None
+
+    def get_stats(self):
+        """Get queue sizes and drop/expiry/delivery counters"""
+        with self._lock:
+            return {
+                'users': len(self._queues),
+                'max_users': self.max_users,
+                'messages': self._size,
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'max_messages': self.max_messages,
+                'max_age': self.max_age,
+                'dropped': self.dropped,
+                'expired': self.expired,
+                'evicted': self.evicted,
+                'refused': self.refused,
+                'delivered': self.delivered,
+                'journal': self.journal_path
+            }
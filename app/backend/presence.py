@@ -0,0 +1,220 @@
+import bisect
+import logging
+import threading
+import uuid
+
+from app.backend.cluster import LocalNamespace
+
+logger = logging.getLogger(__name__)
+
+class PresenceTracker:
+    """
+    Which users currently have a connected socket
+
+    Connections are tracked by Socket.IO session ID; a user is online while
+    at least one of their sessions is connected. The per-user session sets
+    live in a SharedState namespace, so every node can tell whether a user
+    is connected anywhere. Sessions are added and removed with the
+    namespace's atomic member operations, so two nodes updating the same
+    user can't overwrite each other.
+    """
+
+    def __init__(self, online=None):
+        self.online = online if online is not None else LocalNamespace()
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def connect(self, user_id, sid):
+        """
+        Record that a session belongs to a user
+
+        Returns:
+            bool: True if the user just came online
+        """
+        with self._lock:
+            previous = self._sessions.get(sid)
+            if previous == user_id:
+                return False
+            if previous is not None:
+                self._remove(previous, sid)
+            self._sessions[sid] = user_id
+            return self.online.add_member(user_id, sid) == 1
+
+    def disconnect(self, sid):
+        """
+        Forget a closed session
+
+        Returns:
+            str: The user who went offline as a result, or None
+        """
+        with self._lock:
+            user_id = self._sessions.pop(sid, None)
+            if user_id is None:
+                return None
+            return user_id if self._remove(user_id, sid) else None
+
+    def _remove(self, user_id, sid):
+        """Remove one session of a user, returning True if it was their last"""
+        return self.online.remove_member(user_id, sid) == 0
+
+    def has_session(self, user_id, sid):
+        """Whether a session is registered as the given user"""
+        return sid in (self.online.get(user_id) or ())
+
+    def session_user(self, sid):
+        """The user a local session registered as, or None"""
+        return self._sessions.get(sid)
+
+    def is_online(self, user_id):
+        return user_id in self.online
+
+    def online_users(self):
+        return list(self.online)
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'online_users': len(self.online),
+                'local_sessions': len(self._sessions)
+            }
+
+class UserDirectory:
+    """
+    Versioned, paginated directory of registered users with coalesced deltas
+
+    Clients fetch the directory once, page by page, and then keep it up to
+    date from user_list_delta events instead of receiving the whole list
+    on every registration. Changes are collected for `window` seconds and
+    published as one delta:
+
+        {'version': 7, 'added': [...], 'joined': [...], 'left': [...]}
+
+    'added' users are new to the directory, 'joined' came online and
+    'left' went offline. Deltas only state facts, so applying one twice
+    is harmless. A client applies every delta newer than the version of
+    the first page it fetched.
+
+    Versions are reserved in `versions`, which can be a SharedState
+    namespace, so deltas from different nodes never share a version.
+    """
+
+    def __init__(self, users, presence, versions=None, window=0.25, publish=None):
+        """
+        Args:
+            users (Mapping): Registered users, keyed by user ID
+            presence (PresenceTracker): Who is online
+            versions (MutableMapping): Where directory versions are reserved
+            window (float): Seconds to coalesce changes over before publishing
+            publish (callable): Called with each delta
+        """
+        self.users = users
+        self.presence = presence
+        self.versions = versions if versions is not None else {}
+        self.window = window
+        self.publish = publish
+        self.published = 0
+        self._pending = {}
+        self._timer = None
+        self._snapshot = (None, [])
+        self._lock = threading.Lock()
+
+    @property
+    def version(self):
+        return self.versions.get('latest') or 0
+
+    def _reserve_version(self):
+        """Claim the next unused version; setdefault is atomic on every SharedState backend"""
+        # A token per reservation, so a node can't mistake a version it claimed earlier for a free one
+        token = uuid.uuid4().hex
+        version = self.version
+        while True:
+            version += 1
+            if self.versions.setdefault(f"v{version}", token) == token:
+                break
+        self.versions['latest'] = version
+        # Older reservations can't be contended any more
+        self.versions.pop(f"v{version - 1024}", None)
+        return version
+
+    def _record(self, user_id, change):
+        with self._lock:
+            self._pending.setdefault(user_id, {}).update(change)
+            if self._timer is None:
+                self._timer = threading.Timer(self.window, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def added(self, user_id):
+        """A user registered for the first time"""
+        self._record(user_id, {'added': True})
+
+    def joined(self, user_id):
+        """A user came online"""
+        self._record(user_id, {'online': True})
+
+    def left(self, user_id):
+        """A user went offline"""
+        self._record(user_id, {'online': False})
+
+    def flush(self):
+        """
+        Publish pending changes as one delta
+
+        Returns:
+            dict: The delta, or None if nothing changed
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._timer = None
+            if not pending:
+                return None
+            delta = {
+                'version': self._reserve_version(),
+                'added': [user_id for user_id, change in pending.items() if change.get('added')],
+                'joined': [user_id for user_id, change in pending.items() if change.get('online') is True],
+                'left': [user_id for user_id, change in pending.items() if change.get('online') is False]
+            }
+            self.published += 1
+        if self.publish is not None:
+            self.publish(delta)
+        return delta
+
+    def page(self, cursor=None, limit=100):
+        """
+        One page of the directory, in user ID order
+
+        The sorted list is rebuilt at most once per version, so paging
+        through the directory doesn't sort it again for every page.
+
+        Args:
+            cursor (str): Last user ID of the previous page, or None for the first page
+            limit (int): Maximum users in the page
+
+        Returns:
+            dict: version, users, the online subset of users, total and
+                next_cursor (None on the last page)
+        """
+        version = self.version
+        with self._lock:
+            snapshot_version, ordered = self._snapshot
+            if snapshot_version != version or len(ordered) != len(self.users):
+                ordered = sorted(self.users)
+                self._snapshot = (version, ordered)
+        start = bisect.bisect_right(ordered, cursor) if cursor is not None else 0
+        users = ordered[start:start + limit]
+        return {
+            'version': version,
+            'users': users,
+            # Only the page's users are looked up, never the whole online set
+            'online': [user_id for user_id in users if self.presence.is_online(user_id)],
+            'total': len(ordered),
+            'next_cursor': users[-1] if start + limit < len(ordered) else None
+        }
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'version': self.versions.get('latest') or 0,
+                'pending_changes': len(self._pending),
+                'deltas_published': self.published
+            }
@@ -0,0 +1,590 @@
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from bisect import bisect_left, bisect_right
+from collections import deque
+
+from app.utils.bounded import approximate_size
+
+logger = logging.getLogger(__name__)
+
+def conversation_key(user_a, user_b):
+    """Order-independent key for the conversation between two users"""
+    return (user_a, user_b) if user_a <= user_b else (user_b, user_a)
+
+# First element of group conversation keys; control characters never appear in user IDs
+GROUP_CONVERSATION = '\x01group'
+
+def group_conversation_key(group_id):
+    """Key for the conversation of a group"""
+    return (GROUP_CONVERSATION, group_id)
+
+def message_conversation_key(message):
+    """Conversation key of a stored message"""
+    if message.get('group_id'):
+        return group_conversation_key(message['group_id'])
+    return conversation_key(message.get('sender', ''), message.get('recipient', ''))
+
+class Conversation:
+    """Append-only, time-ordered entries of one conversation"""
+
+    def __init__(self):
+        self.seqs = []
+        self.entries = []
+
+    def append(self, seq, entry):
+        self.seqs.append(seq)
+        self.entries.append(entry)
+
+    def drop_before(self, seq):
+        """Forget entries with a seq lower than the given one"""
+        cut = bisect_left(self.seqs, seq)
+        del self.seqs[:cut]
+        del self.entries[:cut]
+
+    def page(self, before=None, after=None, limit=50):
+        """
+        Get a page of entries by sequence number cursor
+
+        With `after`, returns the oldest `limit` entries newer than it;
+        otherwise the newest `limit` entries older than `before` (or the
+        newest overall). Cost is O(log n + limit).
+
+        Returns:
+            tuple: (entries in ascending order, whether more remain beyond the page)
+        """
+        if after is not None:
+            start = bisect_right(self.seqs, after)
+            end = len(self.seqs) if before is None else bisect_left(self.seqs, before)
+            stop = min(end, start + limit)
+            return self.entries[start:stop], stop < end
+
+        end = len(self.seqs) if before is None else bisect_left(self.seqs, before)
+        start = max(0, end - limit)
+        return self.entries[start:end], start > 0
+
+class MessageStore:
+    """
+    Storage backend interface for MessageHandler
+
+    Backends assign each appended message a monotonically increasing seq
+    and keep a per-conversation index for paginated history queries.
+    """
+
+    def append(self, message):
+        """Store a message, setting and returning its seq"""
+        raise NotImplementedError
+
+    def get_conversation(self, key, before=None, after=None, limit=50):
+        """Get a page of a conversation; see Conversation.page"""
+        raise NotImplementedError
+
+    def get_messages(self):
+        """Get all retained messages in seq order"""
+        raise NotImplementedError
+
+    def conversation_keys(self):
+        """Get the keys of every conversation with retained messages"""
+        raise NotImplementedError
+
+    def clear(self):
+        """Delete all stored messages"""
+        raise NotImplementedError
+
+    def close(self):
+        """Flush and release any resources held by the backend"""
+
+    def get_stats(self):
+        """Get message counts and memory/disk usage"""
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+class InMemoryMessageStore(MessageStore):
+    """
+    Keeps messages in process memory; the default backend
+
+    Retention works like a ring buffer: once max_messages or max_bytes is
+    exceeded the oldest messages are dropped down to 90% of the limit, so
+    trimming is amortized O(1) per message. Messages older than max_age
+    seconds are dropped as new ones arrive.
+    """
+
+    def __init__(self, max_messages=None, max_bytes=None, max_age=None):
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.messages = deque()
+        self.conversations = {}
+        self.next_seq = 1
+        self.bytes = 0
+        self.evicted = 0
+        self._sizes = deque()
+        self._times = deque()
+        self._lock = threading.Lock()
+
+    def append(self, message):
+        key = message_conversation_key(message)
+        now = time.monotonic()
+        with self._lock:
+            seq = message['seq'] = self.next_seq
+            self.next_seq += 1
+            size = approximate_size(message)
+            self.messages.append(message)
+            self._sizes.append(size)
+            self._times.append(now)
+            self.bytes += size
+            conversation = self.conversations.get(key)
+            if conversation is None:
+                conversation = self.conversations[key] = Conversation()
+            conversation.append(seq, message)
+            self._trim(now)
+        return seq
+
+    def _trim(self, now):
+        """Drop the oldest messages that exceed the retention limits"""
+        count_target = len(self.messages)
+        if self.max_messages is not None and len(self.messages) > self.max_messages:
+            count_target = self.max_messages - self.max_messages // 10
+        bytes_target = self.bytes
+        if self.max_bytes is not None and self.bytes > self.max_bytes:
+            bytes_target = self.max_bytes - self.max_bytes // 10
+
+        dropped = {}
+        while self.messages and (len(self.messages) > count_target or self.bytes > bytes_target or
+                                 (self.max_age is not None and now - self._times[0] > self.max_age)):
+            message = self.messages.popleft()
+            self.bytes -= self._sizes.popleft()
+            self._times.popleft()
+            dropped[message_conversation_key(message)] = message['seq']
+            self.evicted += 1
+
+        for key, seq in dropped.items():
+            conversation = self.conversations[key]
+            conversation.drop_before(seq + 1)
+            if not conversation.seqs:
+                del self.conversations[key]
+
+    def get_conversation(self, key, before=None, after=None, limit=50):
+        # Pages are O(limit) slices, so building them under the lock keeps trims from racing reads
+        with self._lock:
+            conversation = self.conversations.get(key)
+            if conversation is None:
+                return [], False
+            return conversation.page(before=before, after=after, limit=limit)
+
+    def get_messages(self):
+        with self._lock:
+            return list(self.messages)
+
+    def conversation_keys(self):
+        with self._lock:
+            return list(self.conversations)
+
+    def clear(self):
+        with self._lock:
+            self.messages.clear()
+            self._sizes.clear()
+            self._times.clear()
+            self.conversations = {}
+            self.bytes = 0
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'backend': 'memory',
+                'messages': len(self.messages),
+                'conversations': len(self.conversations),
+                'bytes': self.bytes,
+                'max_messages': self.max_messages,
+                'max_bytes': self.max_bytes,
+                'max_age': self.max_age,
+                'evicted': self.evicted
+            }
+
+    def __len__(self):
+        return len(self.messages)
+
+# Segment record: payload length, seq, CRC32 of the payload, then the JSON payload
+RECORD_HEADER = struct.Struct('>IQI')
+# Index record: conversation key length, then seq, segment base seq and offset after the key
+INDEX_KEY_LENGTH = struct.Struct('>H')
+INDEX_ENTRY = struct.Struct('>QQQ')
+SEGMENT_SUFFIX = '.seg'
+INDEX_FILE = 'index.log'
+
+class Segment:
+    """One append-only segment file, named after the first seq it holds"""
+
+    def __init__(self, directory, base_seq):
+        self.base_seq = base_seq
+        self.path = os.path.join(directory, f"{base_seq:020d}{SEGMENT_SUFFIX}")
+        self._mmap = None
+        self._mapped_size = 0
+
+    @property
+    def size(self):
+        return os.path.getsize(self.path) if os.path.exists(self.path) else 0
+
+    def read(self, offset):
+        """Read the record at an offset through a memory map"""
+        end = offset + RECORD_HEADER.size
+        if self._mmap is None or end > self._mapped_size:
+            self._remap()
+        length, seq, crc = RECORD_HEADER.unpack_from(self._mmap, offset)
+        payload = self._mmap[end:end + length]
+        if zlib.crc32(payload) != crc:
+            raise ValueError(f"Corrupt record at {self.path}:{offset}")
+        return json.loads(payload)
+
+    def scan(self, offset=0):
+        """
+        Yield (seq, offset, message) for every complete record from an offset
+
+        Stops at the first truncated or corrupt record, which is where a
+        crash mid-write leaves the tail of the active segment.
+        """
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            while True:
+                header = f.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    return
+                length, seq, crc = RECORD_HEADER.unpack(header)
+                payload = f.read(length)
+                if len(payload) < length or zlib.crc32(payload) != crc:
+                    return
+                yield seq, offset, json.loads(payload)
+                offset += RECORD_HEADER.size + length
+
+    def _remap(self):
+        self.close()
+        size = self.size
+        if size == 0:
+            raise ValueError(f"Empty segment {self.path}")
+        with open(self.path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._mapped_size = size
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+            self._mapped_size = 0
+
+class SegmentLogMessageStore(MessageStore):
+    """
+    Durable message store backed by an append-only segmented log
+
+    Messages are appended to segment files and fsynced in batches, an
+    index file maps each conversation to record offsets, and history
+    queries read records back through memory maps. Only the index is held
+    in memory. Retention limits drop whole segments from the head of the
+    log and compact the index to match.
+    """
+
+    def __init__(self, directory, segment_bytes=64 * 1024 * 1024, fsync_batch=64,
+                 fsync_interval=0.05, max_segments=None, max_bytes=None, max_age=None):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync_batch = fsync_batch
+        self.fsync_interval = fsync_interval
+        self.max_segments = max_segments
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+        self._lock = threading.RLock()
+        self._segments = []
+        self._conversations = {}
+        self._log = None
+        self._index = None
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._count = 0
+        self.next_seq = 1
+
+        os.makedirs(directory, exist_ok=True)
+        self._open()
+
+        self._closed = threading.Event()
+        self._sync_thread = threading.Thread(target=self._sync_loop, name='segment-log-sync', daemon=True)
+        self._sync_thread.start()
+
+    def _open(self):
+        """Load the index and recover any records written after it"""
+        bases = sorted(int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(self.directory)
+                       if name.endswith(SEGMENT_SUFFIX))
+        self._segments = [Segment(self.directory, base) for base in bases]
+
+        index_path = os.path.join(self.directory, INDEX_FILE)
+        last_offsets = self._load_index(index_path)
+
+        self._index = open(index_path, 'ab')
+        if not self._segments:
+            self._segments.append(Segment(self.directory, self.next_seq))
+
+        # The index is written after the segment, so only the active segment can be ahead of it
+        active = self._segments[-1]
+        resume = last_offsets.get(active.base_seq)
+        recovered = 0
+        for seq, offset, message in active.scan(resume or 0):
+            if resume is not None and offset == resume:
+                continue
+            self._index_entry(message_conversation_key(message), seq, active.base_seq, offset)
+            recovered += 1
+
+        # Drop a torn tail left by a crash so new records line up
+        valid_end = self._valid_end(active)
+        if os.path.exists(active.path) and active.size > valid_end:
+            with open(active.path, 'r+b') as f:
+                f.truncate(valid_end)
+
+        self._log = open(active.path, 'ab')
+        if recovered:
+            self._sync()
+            logger.info(f"Recovered {recovered} unindexed records from {active.path}")
+        logger.info(f"Opened segment log at {self.directory}: {self._count} messages, {len(self._segments)} segments")
+
+    def _valid_end(self, segment):
+        end = 0
+        if os.path.exists(segment.path):
+            with open(segment.path, 'rb') as f:
+                while True:
+                    header = f.read(RECORD_HEADER.size)
+                    if len(header) < RECORD_HEADER.size:
+                        break
+                    length, _, crc = RECORD_HEADER.unpack(header)
+                    payload = f.read(length)
+                    if len(payload) < length or zlib.crc32(payload) != crc:
+                        break
+                    end += RECORD_HEADER.size + length
+        return end
+
+    def _load_index(self, index_path):
+        """Read the index file, returning the last indexed offset per segment"""
+        last_offsets = {}
+        if not os.path.exists(index_path):
+            # Without an index, rebuild it from every segment
+            for segment in self._segments[:-1]:
+                for seq, offset, message in segment.scan():
+                    self._remember(message_conversation_key(message), seq, segment.base_seq, offset)
+            self._rewrite_index()
+            return last_offsets
+
+        live = {segment.base_seq for segment in self._segments}
+        with open(index_path, 'rb') as f:
+            data = f.read()
+        pos = 0
+        while pos + INDEX_KEY_LENGTH.size <= len(data):
+            (key_length,) = INDEX_KEY_LENGTH.unpack_from(data, pos)
+            end = pos + INDEX_KEY_LENGTH.size + key_length + INDEX_ENTRY.size
+            if end > len(data):
+                break
+            raw_key = data[pos + INDEX_KEY_LENGTH.size:pos + INDEX_KEY_LENGTH.size + key_length]
+            seq, base_seq, offset = INDEX_ENTRY.unpack_from(data, end - INDEX_ENTRY.size)
+            pos = end
+            if base_seq not in live:
+                continue
+            self._remember(tuple(raw_key.decode('utf-8').split('\x00', 1)), seq, base_seq, offset)
+            last_offsets[base_seq] = offset
+
+        # Drop a torn entry left by a crash so appended entries stay aligned
+        if pos < len(data):
+            with open(index_path, 'r+b') as f:
+                f.truncate(pos)
+            logger.warning(f"Truncated {len(data) - pos} torn bytes from {index_path}")
+        return last_offsets
+
+    def _remember(self, key, seq, base_seq, offset):
+        conversation = self._conversations.get(key)
+        if conversation is None:
+            conversation = self._conversations[key] = Conversation()
+        conversation.append(seq, (base_seq, offset))
+        self.next_seq = max(self.next_seq, seq + 1)
+        self._count += 1
+
+    def _encode_index_entry(self, key, seq, base_seq, offset):
+        raw_key = '\x00'.join(key).encode('utf-8')
+        return INDEX_KEY_LENGTH.pack(len(raw_key)) + raw_key + INDEX_ENTRY.pack(seq, base_seq, offset)
+
+    def _index_entry(self, key, seq, base_seq, offset):
+        self._remember(key, seq, base_seq, offset)
+        self._index.write(self._encode_index_entry(key, seq, base_seq, offset))
+
+    def _rewrite_index(self):
+        """Compact the index file down to the entries still held in memory"""
+        index_path = os.path.join(self.directory, INDEX_FILE)
+        entries = []
+        for key, conversation in self._conversations.items():
+            for seq, (base_seq, offset) in zip(conversation.seqs, conversation.entries):
+                entries.append(self._encode_index_entry(key, seq, base_seq, offset))
+
+        tmp_path = index_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(b''.join(entries))
+            f.flush()
+            os.fsync(f.fileno())
+
+        reopen = self._index is not None
+        if reopen:
+            self._index.close()
+        os.replace(tmp_path, index_path)
+        if reopen:
+            self._index = open(index_path, 'ab')
+
+    def append(self, message):
+        key = message_conversation_key(message)
+        with self._lock:
+            seq = message['seq'] = self.next_seq
+            payload = json.dumps(message, separators=(',', ':')).encode('utf-8')
+
+            active = self._segments[-1]
+            offset = self._log.tell()
+            if offset > 0 and offset + len(payload) > self.segment_bytes:
+                self._roll(seq)
+                active = self._segments[-1]
+                offset = 0
+
+            self._log.write(RECORD_HEADER.pack(len(payload), seq, zlib.crc32(payload)))
+            self._log.write(payload)
+            self._log.flush()
+            self._index_entry(key, seq, active.base_seq, offset)
+            self._index.flush()
+
+            self._unsynced += 1
+            if self._unsynced >= self.fsync_batch or \
+               time.monotonic() - self._last_sync >= self.fsync_interval:
+                self._sync()
+        return seq
+
+    def _sync(self):
+        """fsync the active segment and the index"""
+        self._log.flush()
+        self._index.flush()
+        os.fsync(self._log.fileno())
+        os.fsync(self._index.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def sync(self):
+        """Force any batched writes to disk"""
+        with self._lock:
+            if self._log is not None and self._unsynced:
+                self._sync()
+
+    def _sync_loop(self):
+        """Bound how long a batched write can stay unsynced when traffic stops"""
+        while not self._closed.wait(self.fsync_interval):
+            self.sync()
+
+    def _roll(self, base_seq):
+        """Seal the active segment and start a new one"""
+        self._sync()
+        self._log.close()
+        self._segments.append(Segment(self.directory, base_seq))
+        self._log = open(self._segments[-1].path, 'ab')
+        self._enforce_retention()
+
+    def _enforce_retention(self):
+        """Drop the oldest sealed segments that exceed the retention limits"""
+        dropped = []
+        now = time.time()
+        while len(self._segments) > 1:
+            oldest = self._segments[0]
+            total_bytes = sum(segment.size for segment in self._segments)
+            if (self.max_segments is not None and len(self._segments) > self.max_segments) or \
+               (self.max_bytes is not None and total_bytes > self.max_bytes) or \
+               (self.max_age is not None and now - os.path.getmtime(oldest.path) > self.max_age):
+                oldest.close()
+                os.remove(oldest.path)
+                dropped.append(self._segments.pop(0))
+            else:
+                break
+
+        if not dropped:
+            return
+
+        first_seq = self._segments[0].base_seq
+        for key in list(self._conversations):
+            conversation = self._conversations[key]
+            conversation.drop_before(first_seq)
+            if not conversation.seqs:
+                del self._conversations[key]
+        self._count = sum(len(conversation.seqs) for conversation in self._conversations.values())
+        self._rewrite_index()
+        logger.info(f"Retention dropped {len(dropped)} segments, oldest retained seq is {first_seq}")
+
+    def _read(self, location):
+        base_seq, offset = location
+        for segment in self._segments:
+            if segment.base_seq == base_seq:
+                return segment.read(offset)
+        raise KeyError(f"Segment {base_seq} is no longer retained")
+
+    def get_conversation(self, key, before=None, after=None, limit=50):
+        with self._lock:
+            conversation = self._conversations.get(key)
+            if conversation is None:
+                return [], False
+            locations, has_more = conversation.page(before=before, after=after, limit=limit)
+            self._log.flush()
+            return [self._read(location) for location in locations], has_more
+
+    def get_messages(self):
+        with self._lock:
+            self._log.flush()
+            messages = []
+            for segment in self._segments:
+                messages.extend(message for _, _, message in segment.scan())
+            return messages
+
+    def conversation_keys(self):
+        with self._lock:
+            return list(self._conversations)
+
+    def clear(self):
+        with self._lock:
+            for segment in self._segments:
+                segment.close()
+                if os.path.exists(segment.path):
+                    os.remove(segment.path)
+            self._log.close()
+            self._conversations = {}
+            self._count = 0
+            self._segments = [Segment(self.directory, self.next_seq)]
+            self._log = open(self._segments[-1].path, 'ab')
+            self._rewrite_index()
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'backend': 'segment_log',
+                'messages': self._count,
+                'conversations': len(self._conversations),
+                'segments': len(self._segments),
+                'disk_bytes': sum(segment.size for segment in self._segments),
+                'index_bytes': os.path.getsize(os.path.join(self.directory, INDEX_FILE))
+            }
+
+    def close(self):
+        self._closed.set()
+        with self._lock:
+            if self._log is None:
+                return
+            self._sync()
+            self._log.close()
+            self._index.close()
+            self._log = None
+            for segment in self._segments:
+                segment.close()
+
+    def __len__(self):
+        return self._count
@@ -0,0 +1,273 @@
+"""
+Compact binary encoding for messages sent to clients
+
+A message dict is encoded as a version byte followed by tag-length-value
+records. Known fields have a one-byte tag and a codec that stores them in
+their raw form: hex digests and IDs as bytes, base64 signatures and
+ciphertexts decoded, integers as varints. Nested envelope and session
+dicts use the same table. Any field that doesn't fit its codec, and any
+unknown field, goes into a trailing JSON record, so every dict
+round-trips exactly.
+
+String values at least `compress_min_bytes` long can be zlib-compressed
+when the client negotiated it; the high bit of the tag marks a
+compressed value.
+"""
+import base64
+import binascii
+import json
+import logging
+import threading
+import zlib
+
+from app.backend.cluster import LocalNamespace
+
+logger = logging.getLogger(__name__)
+
+WIRE_VERSION = 1
+EXTRA_TAG = 0
+COMPRESSED = 0x80
+
+# Encodings a client can ask for with set_wire_format
+JSON = 'json'
+BINARY = 'binary'
+BINARY_ZLIB = 'binary+zlib'
+
+# Field name -> (tag, codec); tags are part of the wire format and must never be reused
+FIELDS = {
+    'id': (1, 'hex'),
+    'seq': (2, 'uint'),
+    'sender': (3, 'str'),
+    'recipient': (4, 'str'),
+    'group_id': (5, 'str'),
+    'timestamp': (6, 'str'),
+    'message': (7, 'str'),
+    'hash': (8, 'hex'),
+    'signature': (9, 'b64'),
+    'encrypted_message': (10, 'b64'),
+    'certificate_fingerprint': (11, 'hex'),
+    'envelope': (12, 'map'),
+    'session': (13, 'map'),
+    'session_key': (14, 'map'),
+    'wrapped_key': (15, 'b64'),
+    'nonce': (16, 'b64'),
+    'ciphertext': (17, 'b64'),
+    'tag': (18, 'b64'),
+    'key_id': (19, 'hex'),
+    'batch_id': (20, 'hex'),
+    'offline_seq': (21, 'uint'),
+    'epoch': (22, 'uint'),
+    'encrypted': (23, 'bool'),
+    'tampered': (24, 'bool'),
+    'integrity_failure': (25, 'bool'),
+    'group': (26, 'map'),
+    'original_message': (27, 'str'),
+}
+TAGS = {tag: (name, codec) for name, (tag, codec) in FIELDS.items()}
+
+def _varint(value):
+    out = bytearray()
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+def _read_varint(data, pos):
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+def _pack(codec, value):
+    """Encode a value with a codec, or return None if it doesn't fit and must go to the JSON record"""
+    if codec == 'str':
+        return value.encode('utf-8') if isinstance(value, str) else None
+    if codec == 'hex':
+        if not isinstance(value, str):
+            return None
+        try:
+            raw = bytes.fromhex(value)
+        except ValueError:
+            return None
+        # Upper-case or odd formatting wouldn't round-trip
+        return raw if raw.hex() == value else None
+    if codec == 'b64':
+        if not isinstance(value, str):
+            return None
+        try:
+            raw = base64.b64decode(value, validate=True)
+        except (binascii.Error, ValueError):
+            return None
+        return raw if base64.b64encode(raw).decode('ascii') == value else None
+    if codec == 'uint':
+        return _varint(value) if type(value) is int and value >= 0 else None
+    if codec == 'bool':
+        return (b'\x01' if value else b'\x00') if type(value) is bool else None
+    if codec == 'map':
+        return _encode_fields(value, None, 0) if isinstance(value, dict) else None
+    return None
+
+def _unpack(codec, raw):
+    if codec == 'str':
+        return raw.decode('utf-8')
+    if codec == 'hex':
+        return raw.hex()
+    if codec == 'b64':
+        return base64.b64encode(raw).decode('ascii')
+    if codec == 'uint':
+        return _read_varint(raw, 0)[0]
+    if codec == 'bool':
+        return raw == b'\x01'
+    return _decode_fields(raw)
+
+def _encode_fields(message, compression, compress_min_bytes):
+    out = []
+    extra = {}
+    for name, value in message.items():
+        field = FIELDS.get(name)
+        raw = _pack(field[1], value) if field is not None else None
+        if raw is None:
+            extra[name] = value
+            continue
+        tag = field[0]
+        if compression == 'zlib' and field[1] == 'str' and len(raw) >= compress_min_bytes:
+            compressed = zlib.compress(raw)
+            if len(compressed) < len(raw):
+                raw = compressed
+                tag |= COMPRESSED
+        out.append(bytes((tag,)) + _varint(len(raw)) + raw)
+    if extra:
+        raw = json.dumps(extra, separators=(',', ':')).encode('utf-8')
+        out.append(bytes((EXTRA_TAG,)) + _varint(len(raw)) + raw)
+    return b''.join(out)
+
+def _decode_fields(data):
+    message = {}
+    pos = 0
+    while pos < len(data):
+        tag = data[pos]
+        length, pos = _read_varint(data, pos + 1)
+        raw = data[pos:pos + length]
+        pos += length
+        if pos > len(data):
+            raise ValueError("Truncated wire message")
+        if tag == EXTRA_TAG:
+            message.update(json.loads(raw))
+            continue
+        if tag & COMPRESSED:
+            raw = zlib.decompress(raw)
+        name, codec = TAGS[tag & ~COMPRESSED]
+        message[name] = _unpack(codec, raw)
+    return message
+
+def encode_message(message, compression=None, compress_min_bytes=1024):
+    """
+    Encode a message dict in the binary wire format
+
+    Args:
+        message (dict): The message, as emitted in JSON mode
+        compression (str): 'zlib' to compress long string fields, or None
+        compress_min_bytes (int): Smallest string value worth compressing
+
+    Returns:
+        bytes: The encoded message
+    """
+    return bytes((WIRE_VERSION,)) + _encode_fields(message, compression, compress_min_bytes)
+
+def decode_message(data):
+    """
+    Decode a message produced by encode_message
+
+    Raises:
+        ValueError: For an unsupported wire version or malformed data
+    """
+    if not data or data[0] != WIRE_VERSION:
+        raise ValueError(f"Unsupported wire format version {data[0] if data else None}")
+    try:
+        return _decode_fields(memoryview(data)[1:].tobytes())
+    except (IndexError, KeyError, TypeError, zlib.error) as e:
+        # A cut-off varint, an unknown tag, non-object extra fields or corrupt zlib data
+        raise ValueError(f"Malformed wire message: {e!r}") from e
+
+def negotiate(requested_format, accepted_compressions):
+    """
+    Pick the encoding for a session from what its client supports
+
+    Args:
+        requested_format (str): 'json' or 'binary'
+        accepted_compressions (list): Compression names the client can decode
+
+    Returns:
+        str: One of JSON, BINARY or BINARY_ZLIB
+    """
+    if requested_format != BINARY:
+        return JSON
+    if 'zlib' in (accepted_compressions or ()):
+        return BINARY_ZLIB
+    return BINARY
+
+def message_room(user_id, encoding):
+    """Room of a user's sessions that receive messages in one encoding"""
+    return f"{user_id}\x00{encoding}"
+
+class WireFormats:
+    """
+    The encodings each user's sessions receive messages in
+
+    Every registered session is in exactly one encoding's message room,
+    so a message is encoded once per encoding in use rather than once
+    per session. Like PresenceTracker, the per-user {sid: encoding} maps
+    live in a SharedState namespace so every node knows which encodings
+    to emit, and are updated with its atomic member operations.
+    """
+
+    def __init__(self, encodings=None):
+        self.encodings = encodings if encodings is not None else LocalNamespace()
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def set(self, user_id, sid, encoding):
+        """
+        Record a session's encoding
+
+        Returns:
+            str: The session's previous encoding, or None for a new session
+        """
+        with self._lock:
+            previous = self._sessions.get(sid)
+            if previous is not None and previous[0] != user_id:
+                self._remove(previous[0], sid)
+                previous = None
+            self._sessions[sid] = (user_id, encoding)
+            self.encodings.add_member(user_id, sid, encoding)
+            return previous[1] if previous is not None else None
+
+    def get(self, sid):
+        """The (user_id, encoding) of a local session, or None"""
+        return self._sessions.get(sid)
+
+    def discard(self, sid):
+        """Forget a closed session"""
+        with self._lock:
+            previous = self._sessions.pop(sid, None)
+            if previous is not None:
+                self._remove(previous[0], sid)
+
+    def _remove(self, user_id, sid):
+        self.encodings.remove_member(user_id, sid)
+
+    def in_use(self, user_id):
+        """Encodings used by any of a user's sessions"""
+        return set((self.encodings.get(user_id) or {}).values())
+
+    def get_stats(self):
+        with self._lock:
+            counts = {}
+            for _, encoding in self._sessions.values():
+                counts[encoding] = counts.get(encoding, 0) + 1
+            return {'local_sessions': counts}
@@ -0,0 +1,140 @@
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class CryptoBusy(Exception):
+    """Raised when crypto work can't be admitted; the caller should retry after `retry_after` seconds"""
+
+    def __init__(self, retry_after, reason):
+        super().__init__(f"Crypto work rejected ({reason}), retry after {retry_after}s")
+        self.retry_after = retry_after
+        self.reason = reason
+
+class _Waiter:
+    __slots__ = ('event', 'granted')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.granted = False
+
+class CryptoAdmission:
+    """
+    Bounded, per-user fair admission for crypto-heavy work
+
+    At most `max_active` callers run at once. Further callers wait in a
+    queue of at most `max_queue` entries, at most `max_per_user` of them
+    from any one user, and slots are handed out round-robin across users
+    so one user's flood only delays that user. Callers that find the
+    queue full, or that wait longer than `max_wait` seconds, get
+    CryptoBusy with a retry-after estimate instead of piling up work.
+    """
+
+    def __init__(self, max_active, max_queue=256, max_per_user=16, max_wait=5.0, on_wait=None):
+        """
+        Args:
+            max_active (int): Callers allowed to run at once
+            max_queue (int): Callers allowed to wait in total
+            max_per_user (int): Callers allowed to wait per user
+            max_wait (float): Seconds a caller waits before giving up
+            on_wait (callable): Called with each admitted caller's queue wait in seconds
+        """
+        self.max_active = max_active
+        self.max_queue = max_queue
+        self.max_per_user = max_per_user
+        self.max_wait = max_wait
+        self.on_wait = on_wait
+        self.active = 0
+        self.queued = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self._queues = OrderedDict()
+        self._service_time = 0.05
+        self._lock = threading.Lock()
+
+    def _retry_after(self):
+        """Rough time until a new caller would get a slot; caller holds the lock"""
+        estimate = self._service_time * (self.queued + 1) / self.max_active
+        return round(min(max(estimate, 0.1), self.max_wait), 2)
+
+    def _acquire(self, user_id):
+        with self._lock:
+            if self.active < self.max_active and not self.queued:
+                self.active += 1
+                self.admitted += 1
+                return 0.0
+            queue = self._queues.get(user_id)
+            if self.queued >= self.max_queue or (queue is not None and len(queue) >= self.max_per_user):
+                self.rejected += 1
+                raise CryptoBusy(self._retry_after(), 'queue full' if self.queued >= self.max_queue else 'user queue full')
+            if queue is None:
+                queue = self._queues[user_id] = deque()
+            waiter = _Waiter()
+            queue.append(waiter)
+            self.queued += 1
+
+        start = time.perf_counter()
+        waiter.event.wait(self.max_wait)
+        with self._lock:
+            if not waiter.granted:
+                queue.remove(waiter)
+                if not queue and self._queues.get(user_id) is queue:
+                    del self._queues[user_id]
+                self.queued -= 1
+                self.timed_out += 1
+                raise CryptoBusy(self._retry_after(), 'timed out')
+            self.admitted += 1
+        return time.perf_counter() - start
+
+    def _release(self, elapsed):
+        with self._lock:
+            self._service_time = 0.9 * self._service_time + 0.1 * elapsed
+            # Hand the slot straight to the next user in round-robin order
+            if self._queues:
+                user_id, queue = next(iter(self._queues.items()))
+                waiter = queue.popleft()
+                if queue:
+                    self._queues.move_to_end(user_id)
+                else:
+                    del self._queues[user_id]
+                self.queued -= 1
+                waiter.granted = True
+                waiter.event.set()
+            else:
+                self.active -= 1
+
+    @contextmanager
+    def admit(self, user_id):
+        """
+        Hold a slot for the duration of the block
+
+        Raises:
+            CryptoBusy: If the queue is full or no slot freed up within max_wait
+        """
+        waited = self._acquire(user_id)
+        if self.on_wait is not None:
+            self.on_wait(waited)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._release(time.perf_counter() - start)
+
+    def get_stats(self):
+        """Get slot usage, queue depth and admission counters"""
+        with self._lock:
+            return {
+                'active': self.active,
+                'max_active': self.max_active,
+                'queued': self.queued,
+                'max_queue': self.max_queue,
+                'queued_users': len(self._queues),
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'timed_out': self.timed_out,
+                'avg_service_seconds': round(self._service_time, 4)
+            }
@@ -0,0 +1,252 @@
+from Crypto.Cipher import AES
+from Crypto.Random import get_random_bytes
+import base64
+import logging
+import struct
+
+from app.crypto.rsa_utils import key_context
+
+logger = logging.getLogger(__name__)
+
+AES_KEY_SIZE = 32
+NONCE_SIZE = 12
+TAG_SIZE = 16
+STREAM_CHUNK_SIZE = 64 * 1024
+
+def max_rsa_payload(public_key):
+    """
+    Largest plaintext PKCS1_OAEP (SHA-1) can encrypt directly under a key
+
+    Args:
+        public_key (RSA key): The RSA public key
+
+    Returns:
+        int: Maximum plaintext size in bytes
+    """
+    return public_key.size_in_bytes() - 2 * 20 - 2
+
+def _to_bytes(message):
+    return message.encode('utf-8') if isinstance(message, str) else message
+
+class EnvelopeEncryptor:
+    """
+    Incremental hybrid encryptor
+
+    A fresh AES-256-GCM key encrypts the payload and only that key is
+    RSA-wrapped, so there is one RSA operation per envelope regardless of
+    payload size.
+    """
+
+    def __init__(self, public_key):
+        content_key = get_random_bytes(AES_KEY_SIZE)
+        self.nonce = get_random_bytes(NONCE_SIZE)
+        self.wrapped_key = key_context(public_key).cipher.encrypt(content_key)
+        self._cipher = AES.new(content_key, AES.MODE_GCM, nonce=self.nonce)
+
+    def update(self, chunk):
+        """Encrypt the next chunk of the payload"""
+        return self._cipher.encrypt(_to_bytes(chunk))
+
+    def finalize(self):
+        """Finish encryption and return the authentication tag"""
+        return self._cipher.digest()
+
+class EnvelopeDecryptor:
+    """
+    Incremental hybrid decryptor
+
+    Plaintext returned by `update` is unauthenticated until `finalize`
+    succeeds; callers must discard it if `finalize` raises.
+    """
+
+    def __init__(self, wrapped_key, nonce, private_key):
+        content_key = key_context(private_key).cipher.decrypt(wrapped_key)
+        self._cipher = AES.new(content_key, AES.MODE_GCM, nonce=nonce)
+
+    def update(self, chunk):
+        """Decrypt the next chunk of the payload"""
+        return self._cipher.decrypt(chunk)
+
+    def finalize(self, tag):
+        """Verify the authentication tag, raising ValueError on mismatch"""
+        self._cipher.verify(tag)
+
+def encrypt_envelope(message, public_key):
+    """
+    Encrypt a message of any size using RSA-wrapped AES-GCM
+
+    Args:
+        message (str or bytes): The message to encrypt
+        public_key (RSA key): The recipient's RSA public key
+
+    Returns:
+        dict: The envelope with base64 encoded wrapped_key, nonce,
+            ciphertext and tag
+    """
+    try:
+        encryptor = EnvelopeEncryptor(public_key)
+        ciphertext = encryptor.update(message)
+        tag = encryptor.finalize()
+
+        logger.debug("Message envelope encrypted successfully")
+        return {
+            'wrapped_key': base64.b64encode(encryptor.wrapped_key).decode('utf-8'),
+            'nonce': base64.b64encode(encryptor.nonce).decode('utf-8'),
+            'ciphertext': base64.b64encode(ciphertext).decode('utf-8'),
+            'tag': base64.b64encode(tag).decode('utf-8')
+        }
+
+    except Exception as e:
+        logger.error(f"Error encrypting message envelope: {e}")
+        raise
+
+def decrypt_envelope(envelope, private_key):
+    """
+    Decrypt a message envelope produced by encrypt_envelope
+
+    Args:
+        envelope (dict): The envelope to decrypt
+        private_key (RSA key): The recipient's RSA private key
+
+    Returns:
+        str: The decrypted message
+    """
+    try:
+        decryptor = EnvelopeDecryptor(base64.b64decode(envelope['wrapped_key']),
+                                      base64.b64decode(envelope['nonce']),
+                                      private_key)
+        plaintext = decryptor.update(base64.b64decode(envelope['ciphertext']))
+        decryptor.finalize(base64.b64decode(envelope['tag']))
+
+        logger.debug("Message envelope decrypted successfully")
+        return plaintext.decode('utf-8')
+
+    except Exception as e:
+        logger.error(f"Error decrypting message envelope: {e}")
+        raise
+
+def encrypt_multi_envelope(message, public_keys):
+    """
+    Encrypt a message once for several recipients
+
+    The payload is encrypted once under a fresh AES-256-GCM key and only
+    that key is RSA-wrapped for each recipient.
+
+    Args:
+        message (str or bytes): The message to encrypt
+        public_keys (tuple): The recipients' RSA public keys
+
+    Returns:
+        dict: base64 encoded nonce, ciphertext and tag, plus one wrapped
+            key per public key in 'wrapped_keys', in the same order
+    """
+    try:
+        content_key = get_random_bytes(AES_KEY_SIZE)
+        nonce = get_random_bytes(NONCE_SIZE)
+        ciphertext, tag = AES.new(content_key, AES.MODE_GCM, nonce=nonce).encrypt_and_digest(_to_bytes(message))
+        wrapped_keys = [key_context(public_key).cipher.encrypt(content_key) for public_key in public_keys]
+
+        logger.debug(f"Message envelope encrypted for {len(wrapped_keys)} recipients")
+        return {
+            'wrapped_keys': [base64.b64encode(wrapped_key).decode('utf-8') for wrapped_key in wrapped_keys],
+            'nonce': base64.b64encode(nonce).decode('utf-8'),
+            'ciphertext': base64.b64encode(ciphertext).decode('utf-8'),
+            'tag': base64.b64encode(tag).decode('utf-8')
+        }
+
+    except Exception as e:
+        logger.error(f"Error encrypting multi-recipient envelope: {e}")
+        raise
+
+def split_multi_envelope(multi_envelope):
+    """
+    Split a multi-recipient envelope into per-recipient envelopes
+
+    Args:
+        multi_envelope (dict): Output of encrypt_multi_envelope
+
+    Returns:
+        list: Envelopes that decrypt_envelope accepts, one per recipient
+    """
+    shared = {name: multi_envelope[name] for name in ('nonce', 'ciphertext', 'tag')}
+    return [dict(shared, wrapped_key=wrapped_key) for wrapped_key in multi_envelope['wrapped_keys']]
+
+def encrypt_stream(reader, writer, public_key, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Encrypt a binary stream into a framed envelope
+
+    The output is a 2-byte wrapped key length, the wrapped key, the nonce,
+    the ciphertext and finally the GCM tag.
+
+    Args:
+        reader: Binary file-like object to read plaintext from
+        writer: Binary file-like object to write the envelope to
+        public_key (RSA key): The recipient's RSA public key
+        chunk_size (int): Number of bytes to encrypt at a time
+
+    Returns:
+        int: Number of plaintext bytes encrypted
+    """
+    encryptor = EnvelopeEncryptor(public_key)
+    writer.write(struct.pack('>H', len(encryptor.wrapped_key)))
+    writer.write(encryptor.wrapped_key)
+    writer.write(encryptor.nonce)
+
+    total = 0
+    while True:
+        chunk = reader.read(chunk_size)
+        if not chunk:
+            break
+        writer.write(encryptor.update(chunk))
+        total += len(chunk)
+
+    writer.write(encryptor.finalize())
+    logger.debug(f"Encrypted stream of {total} bytes")
+    return total
+
+def _read_exact(reader, size):
+    data = reader.read(size)
+    if len(data) != size:
+        raise ValueError("Truncated envelope stream")
+    return data
+
+def decrypt_stream(reader, writer, private_key, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Decrypt a framed envelope produced by encrypt_stream
+
+    Plaintext is written as it is decrypted, so the output must be
+    discarded if this raises ValueError.
+
+    Args:
+        reader: Binary file-like object to read the envelope from
+        writer: Binary file-like object to write plaintext to
+        private_key (RSA key): The recipient's RSA private key
+        chunk_size (int): Number of bytes to decrypt at a time
+
+    Returns:
+        int: Number of plaintext bytes decrypted
+    """
+    (wrapped_key_len,) = struct.unpack('>H', _read_exact(reader, 2))
+    wrapped_key = _read_exact(reader, wrapped_key_len)
+    nonce = _read_exact(reader, NONCE_SIZE)
+    decryptor = EnvelopeDecryptor(wrapped_key, nonce, private_key)
+
+    # Hold back the trailing tag until the end of the stream is reached
+    pending = b''
+    total = 0
+    while True:
+        chunk = reader.read(chunk_size)
+        if not chunk:
+            break
+        pending += chunk
+        if len(pending) > TAG_SIZE:
+            writer.write(decryptor.update(pending[:-TAG_SIZE]))
+            total += len(pending) - TAG_SIZE
+            pending = pending[-TAG_SIZE:]
+
+    if len(pending) != TAG_SIZE:
+        raise ValueError("Truncated envelope stream")
+    decryptor.finalize(pending)
+
+    logger.debug(f"Decrypted stream of {total} bytes")
+    return total
@@ -0,0 +1,97 @@
+from Crypto.Cipher import AES
+from Crypto.Random import get_random_bytes
+import base64
+import logging
+
+from app.crypto.rsa_utils import key_context
+
+logger = logging.getLogger(__name__)
+
+GROUP_KEY_SIZE = 32
+NONCE_SIZE = 12
+
+def _b64(data):
+    return base64.b64encode(data).decode('utf-8')
+
+def _associated_data(group_id, epoch, key_id, sender):
+    """Bind each ciphertext to its group, key epoch and sender"""
+    return f"{group_id}|{epoch}|{key_id}|{sender}".encode('utf-8')
+
+def new_group_key():
+    """
+    Generate a fresh symmetric group key
+
+    Returns:
+        tuple: (key bytes, key_id hex string)
+    """
+    return get_random_bytes(GROUP_KEY_SIZE), get_random_bytes(8).hex()
+
+def wrap_group_key(group_key, member_public_keys):
+    """
+    Wrap a group key for each member under their RSA public key
+
+    This is the only RSA work a group needs, and it only happens when the
+    group is created or its membership changes.
+
+    Args:
+        group_key (bytes): The symmetric group key
+        member_public_keys (dict): Member user ID -> RSA public key
+
+    Returns:
+        dict: Member user ID -> base64 wrapped key
+    """
+    return {member: _b64(key_context(public_key).cipher.encrypt(group_key))
+            for member, public_key in member_public_keys.items()}
+
+def unwrap_group_key(wrapped_key, private_key):
+    """
+    Recover a group key on the member side
+
+    Args:
+        wrapped_key (str): The member's base64 wrapped key from a group_key event
+        private_key (RSA key): The member's RSA private key
+
+    Returns:
+        bytes: The group key
+    """
+    return key_context(private_key).cipher.decrypt(base64.b64decode(wrapped_key))
+
+def encrypt_group_message(message, group_id, epoch, key_id, group_key, sender):
+    """
+    Encrypt a message once for every member of a group
+
+    Args:
+        message (str): The message to encrypt
+        group_id (str): The group ID
+        epoch (int): Key epoch, incremented on every rekey
+        key_id (str): ID of the group key
+        group_key (bytes): The symmetric group key
+        sender (str): The sender's user ID
+
+    Returns:
+        dict: epoch, key_id, nonce, ciphertext and tag
+    """
+    nonce = get_random_bytes(NONCE_SIZE)
+    cipher = AES.new(group_key, AES.MODE_GCM, nonce=nonce)
+    cipher.update(_associated_data(group_id, epoch, key_id, sender))
+    ciphertext, tag = cipher.encrypt_and_digest(message.encode('utf-8'))
+    return {
+        'epoch': epoch,
+        'key_id': key_id,
+        'nonce': _b64(nonce),
+        'ciphertext': _b64(ciphertext),
+        'tag': _b64(tag)
+    }
+
+def decrypt_group_message(payload, group_id, sender, group_key):
+    """
+    Decrypt a message produced by encrypt_group_message
+
+    Raises:
+        ValueError: If the message or its associated data was tampered with
+    """
+    cipher = AES.new(group_key, AES.MODE_GCM, nonce=base64.b64decode(payload['nonce']))
+    cipher.update(_associated_data(group_id, payload['epoch'], payload['key_id'], sender))
+    plaintext = cipher.decrypt_and_verify(base64.b64decode(payload['ciphertext']),
+                                          base64.b64decode(payload['tag']))
+    return plaintext.decode('utf-8')
@@ -0,0 +1,204 @@
+from concurrent.futures import wait, FIRST_COMPLETED
+from collections import deque
+from Crypto.PublicKey import RSA
+import logging
+import queue
+import threading
+import time
+
+from app.crypto.offload import start_process_pool
+from app.crypto.rsa_utils import generate_key_pair
+
+logger = logging.getLogger(__name__)
+
+def _generate_key_components(key_size):
+    """
+    Worker process entry point for key generation
+
+    RSA key objects cannot be pickled, so the key is shipped back to the
+    parent process as its integer components.
+    """
+    key = RSA.generate(key_size)
+    return key.n, key.e, key.d, key.p, key.q, key.u
+
+def _key_pair(components):
+    """
+    Rebuild a key pair generated by a worker
+
+    The key comes from our own worker, so its consistency check is
+    skipped. Importing a 2048-bit private key from DER repeats that check
+    and takes well over 100ms, which under gevent or eventlet would stall
+    the event loop, since the refill thread is a greenlet there.
+    """
+    private_key = RSA.construct(components, consistency_check=False)
+    return private_key, private_key.publickey()
+
+class KeyPool:
+    """
+    Bounded queue of pre-generated RSA key pairs
+
+    A background thread keeps the queue topped up by farming key generation
+    out to a pool of worker processes. Registration takes a ready pair in
+    O(1) and only generates a key inline when the pool has run dry.
+
+    Under gevent or eventlet, pass the server's CryptoOffloader so key
+    generation runs in its worker processes. Workers forked for a second
+    process pool inherit the first pool's greenlets, which then run in the
+    worker and take that pool's jobs and results off their shared pipes.
+    """
+
+    def __init__(self, key_size=2048, pool_size=16, workers=2, rate_window=60, offload=None):
+        self.key_size = key_size
+        self.pool_size = pool_size
+        self.workers = workers
+        self.rate_window = rate_window
+        self.offload = offload
+        self._keys = queue.Queue(maxsize=pool_size)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._executor = None
+        self._owns_executor = False
+        self._refill_thread = None
+        self._refill_times = deque()
+        self.hits = 0
+        self.misses = 0
+        self.generated = 0
+        self.errors = 0
+
+    def start(self):
+        """Start the background refill thread and worker processes"""
+        with self._lock:
+            if self._refill_thread is not None or self.workers <= 0 or self.pool_size <= 0:
+                return
+            self._stop.clear()
+            executor = self.offload.executor() if self.offload is not None else None
+            self._owns_executor = executor is None
+            self._executor = executor or start_process_pool(self.workers)
+            self._refill_thread = threading.Thread(target=self._refill_loop, args=(self._executor,),
+                                                   name='key-pool-refill',
+                                                   daemon=True)
+            self._refill_thread.start()
+        logger.info(f"Key pool started: size={self.pool_size}, workers={self.workers}, key_size={self.key_size}")
+
+    def stop(self):
+        """Stop refilling the pool and shut down the worker processes"""
+        with self._lock:
+            thread, executor = self._refill_thread, self._executor if self._owns_executor else None
+            self._refill_thread = None
+            self._executor = None
+        self._stop.set()
+        self._wakeup.set()
+        if thread is not None:
+            thread.join()
+        if executor is not None:
+            # The refill thread has already waited out its jobs; shutting down with jobs
+            # in flight hangs under eventlet
+            executor.shutdown(wait=True, cancel_futures=True)
+        logger.info("Key pool stopped")
+
+    def acquire(self):
+        """
+        Take a key pair from the pool
+
+        Returns:
+            tuple: (private_key, public_key) as RSA key objects
+        """
+        if self._refill_thread is None:
+            self.start()
+
+        try:
+            key_pair = self._keys.get_nowait()
+        except queue.Empty:
+            key_pair = None
+
+        with self._lock:
+            if key_pair is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        self._wakeup.set()
+
+        if key_pair is None:
+            logger.warning("Key pool empty, generating key pair on demand")
+            executor = self._executor
+            if executor is not None:
+                # Generate in a worker so async servers only block the waiting greenlet
+                try:
+                    return _key_pair(executor.submit(_generate_key_components, self.key_size).result())
+                except RuntimeError:
+                    pass
+            return generate_key_pair(self.key_size)
+        return key_pair
+
+    def _refill_loop(self, executor):
+        """Keep up to `workers` generation jobs in flight until the queue is full"""
+        pending = set()
+        while not self._stop.is_set():
+            free = self.pool_size - self._keys.qsize() - len(pending)
+            while free > 0 and len(pending) < self.workers:
+                try:
+                    pending.add(executor.submit(_generate_key_components, self.key_size))
+                except RuntimeError:
+                    # Executor was shut down underneath us
+                    return
+                free -= 1
+
+            if not pending:
+                self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+
+            done, pending = wait(pending, timeout=1, return_when=FIRST_COMPLETED)
+            for future in done:
+                self._store(future)
+        # Let stop() shut the executor down with nothing in flight
+        wait(pending)
+
+    def _store(self, future):
+        """Rebuild a finished key from a worker and queue it"""
+        try:
+            key_pair = _key_pair(future.result())
+        except Exception as e:
+            with self._lock:
+                self.errors += 1
+            logger.error(f"Error generating pooled key pair: {e}")
+            return
+
+        try:
+            self._keys.put_nowait(key_pair)
+        except queue.Full:
+            return
+
+        now = time.monotonic()
+        with self._lock:
+            self.generated += 1
+            self._refill_times.append(now)
+            self._trim_refill_times(now)
+
+    def _trim_refill_times(self, now):
+        while self._refill_times and now - self._refill_times[0] > self.rate_window:
+            self._refill_times.popleft()
+
+    def get_stats(self):
+        """
+        Get pool metrics
+
+        Returns:
+            dict: Pool depth, refill rate (keys per second over the rate
+                window) and hit/miss counters
+        """
+        with self._lock:
+            self._trim_refill_times(time.monotonic())
+            return {
+                'depth': self._keys.qsize(),
+                'capacity': self.pool_size,
+                'workers': self.workers,
+                'key_size': self.key_size,
+                'running': self._refill_thread is not None,
+                'refill_rate': len(self._refill_times) / self.rate_window,
+                'generated': self.generated,
+                'hits': self.hits,
+                'misses': self.misses,
+                'errors': self.errors
+            }
@@ -0,0 +1,237 @@
+"""
+Encrypted on-disk keystore for the CA key pair and users' keys and certificates
+
+Every entry is a separate AES-GCM encrypted file, so a restart reads
+nothing up front and each entry is only decrypted the first time it is
+looked up. The encryption key is derived from a passphrase with scrypt,
+also on first use. File names are keyed hashes of the entry ID, so the
+directory doesn't reveal user IDs. Entries can also be found by the SHA-256
+fingerprint of their public key or by their certificate fingerprint.
+
+Layout:
+    keystore.json            KDF salt and parameters, and a passphrase check
+    entries/<name>.key       nonce | tag | ciphertext of one JSON entry
+    fingerprints/<name>.ref  name of the entry a fingerprint belongs to
+"""
+from Crypto.Cipher import AES
+from Crypto.Hash import HMAC, SHA256
+from Crypto.Protocol.KDF import scrypt
+from Crypto.Random import get_random_bytes
+import base64
+import json
+import logging
+import os
+import threading
+
+from app.crypto.rsa_utils import export_key_der, import_key_der, key_context
+
+logger = logging.getLogger(__name__)
+
+NONCE_SIZE = 12
+TAG_SIZE = 16
+PASSPHRASE_CHECK = b'securechat-keystore'
+CA_ENTRY = 'ca'
+USER_ENTRY = 'user'
+
+def public_key_fingerprint(public_key):
+    """SHA-256 hex digest of a public key's DER encoding"""
+    return key_context(public_key).fingerprint
+
+def _write_atomic(path, data):
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+class KeyStore:
+    """
+    Key pairs and certificates persisted across restarts, encrypted at rest
+    """
+
+    def __init__(self, directory, passphrase, kdf_cost=2 ** 15):
+        """
+        Args:
+            directory (str): Keystore directory, created if missing
+            passphrase (str): Passphrase the encryption key is derived from
+            kdf_cost (int): scrypt N for a new keystore; existing keystores keep theirs
+        """
+        if not passphrase:
+            raise ValueError("A keystore passphrase is required")
+        self.directory = directory
+        self.kdf_cost = kdf_cost
+        self._passphrase = passphrase.encode('utf-8')
+        self._keys = None
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.misses = 0
+        self.writes = 0
+
+        os.makedirs(os.path.join(directory, 'entries'), exist_ok=True)
+        os.makedirs(os.path.join(directory, 'fingerprints'), exist_ok=True)
+
+    def _unlock(self):
+        """Derive the encryption and naming keys, creating the keystore metadata if needed"""
+        if self._keys is not None:
+            return self._keys
+        with self._lock:
+            if self._keys is not None:
+                return self._keys
+            meta_path = os.path.join(self.directory, 'keystore.json')
+            if os.path.exists(meta_path):
+                with open(meta_path, 'r', encoding='utf-8') as f:
+                    meta = json.load(f)
+            else:
+                meta = {'version': 1, 'salt': base64.b64encode(get_random_bytes(16)).decode('utf-8'),
+                        'n': self.kdf_cost, 'r': 8, 'p': 1}
+            derived = scrypt(self._passphrase, base64.b64decode(meta['salt']), 64,
+                             N=meta['n'], r=meta['r'], p=meta['p'])
+            keys = derived[:32], derived[32:]
+
+            if 'check' in meta:
+                try:
+                    self._decrypt(keys[0], base64.b64decode(meta['check']), b'check')
+                except ValueError:
+                    raise ValueError(f"Wrong passphrase for keystore {self.directory}") from None
+            else:
+                meta['check'] = base64.b64encode(self._encrypt(keys[0], PASSPHRASE_CHECK, b'check')).decode('utf-8')
+                _write_atomic(meta_path, json.dumps(meta).encode('utf-8'))
+                logger.info(f"Created keystore in {self.directory}")
+            self._keys = keys
+            return keys
+
+    @staticmethod
+    def _encrypt(key, plaintext, associated_data):
+        nonce = get_random_bytes(NONCE_SIZE)
+        cipher = AES.new(key, AES.MODE_GCM, nonce=nonce)
+        cipher.update(associated_data)
+        ciphertext, tag = cipher.encrypt_and_digest(plaintext)
+        return nonce + tag + ciphertext
+
+    @staticmethod
+    def _decrypt(key, blob, associated_data):
+        cipher = AES.new(key, AES.MODE_GCM, nonce=blob[:NONCE_SIZE])
+        cipher.update(associated_data)
+        return cipher.decrypt_and_verify(blob[NONCE_SIZE + TAG_SIZE:], blob[NONCE_SIZE:NONCE_SIZE + TAG_SIZE])
+
+    def _name(self, *parts):
+        """Keyed hash used as a file name, so IDs and fingerprints aren't visible on disk"""
+        _, name_key = self._unlock()
+        return HMAC.new(name_key, '\x00'.join(parts).encode('utf-8'), digestmod=SHA256).hexdigest()[:40]
+
+    def _entry_path(self, name):
+        return os.path.join(self.directory, 'entries', name + '.key')
+
+    def _fingerprint_path(self, fingerprint):
+        return os.path.join(self.directory, 'fingerprints', self._name('fingerprint', fingerprint) + '.ref')
+
+    def _load(self, name):
+        encryption_key, _ = self._unlock()
+        try:
+            with open(self._entry_path(name), 'rb') as f:
+                blob = f.read()
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        try:
+            entry = json.loads(self._decrypt(encryption_key, blob, name.encode('utf-8')))
+        except ValueError:
+            logger.error(f"Keystore entry {name} failed authentication; ignoring it")
+            self.misses += 1
+            return None
+        self.loads += 1
+        return {
+            'id': entry['id'],
+            'private_key': import_key_der(base64.b64decode(entry['private_key'])),
+            'public_key': import_key_der(base64.b64decode(entry['public_key'])),
+            'certificate': entry.get('certificate'),
+            'fingerprints': entry['fingerprints']
+        }
+
+    def _store(self, kind, entry_id, private_key, public_key, certificate=None):
+        encryption_key, _ = self._unlock()
+        name = self._name(kind, entry_id)
+        fingerprints = [public_key_fingerprint(public_key)]
+        if certificate is not None:
+            fingerprints.append(certificate['fingerprint'])
+        entry = {
+            'id': entry_id,
+            'private_key': base64.b64encode(export_key_der(private_key)).decode('utf-8'),
+            'public_key': base64.b64encode(export_key_der(public_key)).decode('utf-8'),
+            'certificate': certificate,
+            'fingerprints': fingerprints
+        }
+        with self._lock:
+            previous = self._load(name) if os.path.exists(self._entry_path(name)) else None
+            _write_atomic(self._entry_path(name),
+                          self._encrypt(encryption_key, json.dumps(entry).encode('utf-8'), name.encode('utf-8')))
+            # Only user entries are looked up by fingerprint
+            for fingerprint in (fingerprints if kind == USER_ENTRY else ()):
+                _write_atomic(self._fingerprint_path(fingerprint), name.encode('utf-8'))
+            # Fingerprints of replaced keys and certificates no longer resolve
+            for fingerprint in (previous['fingerprints'] if previous else ()):
+                if fingerprint not in fingerprints:
+                    try:
+                        os.remove(self._fingerprint_path(fingerprint))
+                    except FileNotFoundError:
+                        pass
+            self.writes += 1
+
+    def get_ca(self):
+        """
+        Load the CA key pair
+
+        Returns:
+            dict: private_key and public_key, or None if no CA has been stored
+        """
+        entry = self._load(self._name(CA_ENTRY, CA_ENTRY))
+        if entry is None:
+            return None
+        return {'private_key': entry['private_key'], 'public_key': entry['public_key']}
+
+    def put_ca(self, private_key, public_key):
+        """Persist the CA key pair"""
+        self._store(CA_ENTRY, CA_ENTRY, private_key, public_key)
+
+    def get_user(self, user_id):
+        """
+        Load a user's key pair and certificate
+
+        Returns:
+            dict: id, private_key, public_key, certificate and fingerprints, or None if unknown
+        """
+        return self._load(self._name(USER_ENTRY, user_id))
+
+    def get_by_fingerprint(self, fingerprint):
+        """
+        Load a user's entry by public key fingerprint or certificate fingerprint
+
+        Returns:
+            dict: The entry as returned by get_user, or None if no entry has that fingerprint
+        """
+        try:
+            with open(self._fingerprint_path(fingerprint), 'r', encoding='utf-8') as f:
+                name = f.read().strip()
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        entry = self._load(name)
+        # The reference isn't authenticated, so check the entry really has this fingerprint
+        if entry is None or fingerprint not in entry['fingerprints']:
+            return None
+        return entry
+
+    def put_user(self, user_id, private_key, public_key, certificate):
+        """Persist a user's key pair and certificate, replacing any previous entry"""
+        self._store(USER_ENTRY, user_id, private_key, public_key, certificate)
+
+    def get_stats(self):
+        """Get load, miss and write counters"""
+        return {
+            'directory': self.directory,
+            'unlocked': self._keys is not None,
+            'loads': self.loads,
+            'misses': self.misses,
+            'writes': self.writes
+        }
@@ -0,0 +1,126 @@
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from Crypto.PublicKey import RSA
+import logging
+import threading
+import time
+
+from app.crypto.rsa_utils import export_key_der
+from app.utils.timing import timings
+
+logger = logging.getLogger(__name__)
+
+def start_process_pool(workers):
+    """
+    Create a ProcessPoolExecutor and start its manager thread from the calling thread
+
+    The manager thread normally starts on the first submit. Under eventlet,
+    if that submit comes from another green thread (a request handler or
+    the key pool's refill thread), shutting the executor down later never
+    returns, so the pool is primed with one trivial job here. Call this
+    from the main thread at startup.
+    """
+    executor = ProcessPoolExecutor(max_workers=workers)
+    executor.submit(int).result()
+    return executor
+
+class _KeyRef:
+    """Picklable stand-in for an RSA key object crossing the process boundary"""
+
+    __slots__ = ('der',)
+
+    def __init__(self, der):
+        self.der = der
+
+@lru_cache(maxsize=256)
+def _import_key(der):
+    """Parse a key once per worker process"""
+    return RSA.import_key(der)
+
+def _to_worker(value, export):
+    if isinstance(value, RSA.RsaKey):
+        return _KeyRef(export(value))
+    if isinstance(value, tuple):
+        return tuple(_to_worker(v, export) for v in value)
+    return value
+
+def _from_worker(value):
+    if isinstance(value, _KeyRef):
+        return _import_key(value.der)
+    if isinstance(value, tuple):
+        return tuple(_from_worker(v) for v in value)
+    return value
+
+def _run_in_worker(func, args, kwargs):
+    """Worker process entry point: rebuild keys, run the call, ship keys back as DER"""
+    result = func(*(_from_worker(arg) for arg in args),
+                  **{name: _from_worker(value) for name, value in kwargs.items()})
+    return _to_worker(result, export_key_der)
+
+class CryptoOffloader:
+    """
+    Runs CPU-bound crypto calls in a pool of worker processes
+
+    Any module-level function can be offloaded; RSA key arguments and
+    results are converted to DER on the way across, reusing each key's
+    cached export. Waiting on the result only blocks the calling
+    thread, or just the calling greenlet when running under a monkey-patched
+    gevent/eventlet server, so the event loop keeps serving other clients.
+    With workers=0 calls run inline.
+    """
+
+    def __init__(self, workers=0):
+        self.workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start the worker processes"""
+        with self._lock:
+            if self._executor is None and self.workers > 0:
+                self._executor = start_process_pool(self.workers)
+                logger.info(f"Crypto offload started with {self.workers} worker processes")
+
+    def stop(self):
+        """Shut down the worker processes"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def executor(self):
+        """
+        The worker process pool, started if needed, for callers that submit their own jobs
+
+        Returns:
+            ProcessPoolExecutor: None when calls run inline (workers=0)
+        """
+        if self.workers <= 0:
+            return None
+        self.start()
+        return self._executor
+
+    def run(self, func, *args, **kwargs):
+        """
+        Call func(*args, **kwargs) in a worker process and wait for the result
+
+        Args:
+            func (callable): A module-level (picklable) function
+
+        Returns:
+            The function's return value, with RSA keys rebuilt in this process
+        """
+        if self.workers <= 0:
+            return func(*args, **kwargs)
+        if self._executor is None:
+            self.start()
+
+        start = time.perf_counter()
+        future = self._executor.submit(_run_in_worker, func,
+                                       tuple(_to_worker(arg, export_key_der) for arg in args),
+                                       {name: _to_worker(value, export_key_der) for name, value in kwargs.items()})
+        result = _from_worker(future.result())
+        if timings.enabled:
+            # Includes the round trip to the worker; the worker's own timings stay in that process
+            timings.observe(f"offload.{func.__name__}", time.perf_counter() - start)
+        return result
@@ -0,0 +1,318 @@
+"""
+Pluggable public-key crypto providers
+
+Every provider offers the same operations on its own key objects: key
+generation, signing and verification, public-key encryption of short
+messages, and key serialization. Curve providers also do key agreement.
+
+    rsa          RSA through PyCryptodome (the rsa_utils primitives)
+    rsa-openssl  RSA through the `cryptography` package, i.e. OpenSSL
+    ed25519      Ed25519 signatures with X25519 key agreement
+
+The two RSA providers produce the same wire formats (PKCS#1 v1.5 SHA-256
+signatures, OAEP with SHA-1 encryption), so either one can read and
+verify what the other wrote. The OpenSSL provider can also work on
+PyCryptodome keys through native(), which converts each key once and
+caches it; rsa_utils uses this when CRYPTO_PROVIDER=rsa-openssl.
+"""
+from collections import OrderedDict, namedtuple
+from Crypto.Cipher import AES
+from Crypto.Random import get_random_bytes
+import logging
+import threading
+
+from app.crypto import rsa_utils
+
+try:
+    from cryptography.exceptions import InvalidSignature
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ed25519, padding, rsa, x25519
+    from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+except ImportError:  # pragma: no cover - only the PyCryptodome provider is available
+    hashes = None
+
+logger = logging.getLogger(__name__)
+
+NONCE_SIZE = 12
+TAG_SIZE = 16
+
+class CryptoProvider:
+    """
+    Interface shared by all providers
+
+    Messages are bytes or str (encoded as UTF-8); signatures and
+    ciphertexts are bytes.
+    """
+
+    name = None
+    key_size = None
+
+    def generate_key_pair(self):
+        """
+        Returns:
+            tuple: (private_key, public_key) in the provider's key type
+        """
+        raise NotImplementedError
+
+    def sign(self, message, private_key):
+        raise NotImplementedError
+
+    def verify(self, message, signature, public_key):
+        """Return True for a valid signature and False otherwise"""
+        raise NotImplementedError
+
+    def encrypt(self, message, public_key):
+        raise NotImplementedError
+
+    def decrypt(self, ciphertext, private_key):
+        """Returns the plaintext as bytes"""
+        raise NotImplementedError
+
+    def key_agreement(self, private_key, peer_public_key):
+        """
+        Derive a 32-byte shared key with a peer
+
+        Raises:
+            NotImplementedError: For providers without key agreement
+        """
+        raise NotImplementedError(f"{self.name} has no key agreement")
+
+    def export_public_key(self, public_key):
+        raise NotImplementedError
+
+    def import_public_key(self, data):
+        raise NotImplementedError
+
+    def export_private_key(self, private_key):
+        raise NotImplementedError
+
+    def import_private_key(self, data):
+        raise NotImplementedError
+
+def _to_bytes(message):
+    return message.encode('utf-8') if isinstance(message, str) else message
+
+class PyCryptodomeRSAProvider(CryptoProvider):
+    """RSA through PyCryptodome, the primitives the server uses by default"""
+
+    name = 'rsa'
+
+    def __init__(self, key_size=2048):
+        self.key_size = key_size
+
+    def generate_key_pair(self):
+        return rsa_utils.generate_key_pair(self.key_size)
+
+    def sign(self, message, private_key):
+        return rsa_utils.sign_message(_to_bytes(message), private_key)
+
+    def verify(self, message, signature, public_key):
+        return rsa_utils.verify_signature(_to_bytes(message), signature, public_key)
+
+    def encrypt(self, message, public_key):
+        return rsa_utils.encrypt_message(message if isinstance(message, str) else message.decode('utf-8'),
+                                         public_key)
+
+    def decrypt(self, ciphertext, private_key):
+        return rsa_utils.decrypt_message(ciphertext, private_key).encode('utf-8')
+
+    def export_public_key(self, public_key):
+        return rsa_utils.export_key_der(public_key)
+
+    def import_public_key(self, data):
+        return rsa_utils.import_key_der(data)
+
+    export_private_key = export_public_key
+    import_private_key = import_public_key
+
+class OpenSSLRSAProvider(CryptoProvider):
+    """RSA through the `cryptography` package"""
+
+    name = 'rsa-openssl'
+
+    def __init__(self, key_size=2048, max_cached_keys=4096):
+        """
+        Args:
+            key_size (int): Size of generated keys in bits
+            max_cached_keys (int): PyCryptodome keys kept converted by native()
+        """
+        if hashes is None:
+            raise ValueError("The rsa-openssl provider needs the cryptography package")
+        self.key_size = key_size
+        self.max_cached_keys = max_cached_keys
+        self._native = OrderedDict()
+        self._lock = threading.Lock()
+        self._signature_padding = padding.PKCS1v15()
+        self._encryption_padding = padding.OAEP(mgf=padding.MGF1(hashes.SHA1()), algorithm=hashes.SHA1(), label=None)
+
+    def native(self, key):
+        """
+        Convert a PyCryptodome RSA key to an OpenSSL key, caching the result
+
+        Building an OpenSSL private key costs about as much as a few
+        signatures, so each key is converted once.
+        """
+        if not hasattr(key, 'has_private'):
+            return key
+        cache_key = (key.n, key.has_private())
+        with self._lock:
+            converted = self._native.get(cache_key)
+            if converted is not None:
+                self._native.move_to_end(cache_key)
+                return converted
+        public_numbers = rsa.RSAPublicNumbers(key.e, key.n)
+        if key.has_private():
+            converted = rsa.RSAPrivateNumbers(
+                key.p, key.q, key.d,
+                rsa.rsa_crt_dmp1(key.d, key.p), rsa.rsa_crt_dmq1(key.d, key.q), rsa.rsa_crt_iqmp(key.p, key.q),
+                public_numbers
+            ).private_key(unsafe_skip_rsa_key_validation=True)
+        else:
+            converted = public_numbers.public_key()
+        with self._lock:
+            self._native[cache_key] = converted
+            while len(self._native) > self.max_cached_keys:
+                self._native.popitem(last=False)
+        return converted
+
+    def generate_key_pair(self):
+        private_key = rsa.generate_private_key(public_exponent=65537, key_size=self.key_size)
+        return private_key, private_key.public_key()
+
+    def sign(self, message, private_key):
+        return self.native(private_key).sign(_to_bytes(message), self._signature_padding, hashes.SHA256())
+
+    def verify(self, message, signature, public_key):
+        try:
+            self.native(public_key).verify(signature, _to_bytes(message), self._signature_padding, hashes.SHA256())
+            return True
+        except (InvalidSignature, ValueError, TypeError) as e:
+            logger.warning(f"Invalid signature: {e!r}")
+            return False
+
+    def encrypt(self, message, public_key):
+        return self.native(public_key).encrypt(_to_bytes(message), self._encryption_padding)
+
+    def decrypt(self, ciphertext, private_key):
+        return self.native(private_key).decrypt(ciphertext, self._encryption_padding)
+
+    def export_public_key(self, public_key):
+        return public_key.public_bytes(serialization.Encoding.DER, serialization.PublicFormat.SubjectPublicKeyInfo)
+
+    def import_public_key(self, data):
+        return serialization.load_der_public_key(data)
+
+    def export_private_key(self, private_key):
+        return private_key.private_bytes(serialization.Encoding.DER, serialization.PrivateFormat.PKCS8,
+                                         serialization.NoEncryption())
+
+    def import_private_key(self, data):
+        return serialization.load_der_private_key(data, password=None)
+
+# Ed25519 signs, X25519 agrees keys; a curve key pair carries one of each
+CurvePrivateKey = namedtuple('CurvePrivateKey', ['signing', 'agreement'])
+CurvePublicKey = namedtuple('CurvePublicKey', ['verifying', 'agreement'])
+
+class Curve25519Provider(CryptoProvider):
+    """
+    Ed25519 signatures and X25519 key agreement
+
+    encrypt() is ECIES-style: an ephemeral X25519 key agreement with the
+    recipient, HKDF-SHA256, then AES-256-GCM. Ciphertexts are the
+    ephemeral public key, nonce, tag and ciphertext concatenated.
+    """
+
+    name = 'ed25519'
+    key_size = 256
+
+    def __init__(self, key_size=None):
+        if hashes is None:
+            raise ValueError("The ed25519 provider needs the cryptography package")
+
+    def generate_key_pair(self):
+        private_key = CurvePrivateKey(ed25519.Ed25519PrivateKey.generate(), x25519.X25519PrivateKey.generate())
+        return private_key, self.public_key(private_key)
+
+    @staticmethod
+    def public_key(private_key):
+        return CurvePublicKey(private_key.signing.public_key(), private_key.agreement.public_key())
+
+    def sign(self, message, private_key):
+        return private_key.signing.sign(_to_bytes(message))
+
+    def verify(self, message, signature, public_key):
+        try:
+            public_key.verifying.verify(signature, _to_bytes(message))
+            return True
+        except (InvalidSignature, ValueError, TypeError) as e:
+            logger.warning(f"Invalid signature: {e!r}")
+            return False
+
+    @staticmethod
+    def _derive(shared_secret, info):
+        return HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=info).derive(shared_secret)
+
+    def key_agreement(self, private_key, peer_public_key):
+        return self._derive(private_key.agreement.exchange(peer_public_key.agreement), b'securechat key agreement')
+
+    def encrypt(self, message, public_key):
+        ephemeral = x25519.X25519PrivateKey.generate()
+        ephemeral_public = ephemeral.public_key().public_bytes(serialization.Encoding.Raw,
+                                                               serialization.PublicFormat.Raw)
+        key = self._derive(ephemeral.exchange(public_key.agreement), b'securechat encrypt' + ephemeral_public)
+        nonce = get_random_bytes(NONCE_SIZE)
+        cipher = AES.new(key, AES.MODE_GCM, nonce=nonce)
+        ciphertext, tag = cipher.encrypt_and_digest(_to_bytes(message))
+        return ephemeral_public + nonce + tag + ciphertext
+
+    def decrypt(self, ciphertext, private_key):
+        ephemeral_public = ciphertext[:32]
+        nonce = ciphertext[32:32 + NONCE_SIZE]
+        tag = ciphertext[32 + NONCE_SIZE:32 + NONCE_SIZE + TAG_SIZE]
+        shared_secret = private_key.agreement.exchange(x25519.X25519PublicKey.from_public_bytes(ephemeral_public))
+        key = self._derive(shared_secret, b'securechat encrypt' + ephemeral_public)
+        cipher = AES.new(key, AES.MODE_GCM, nonce=nonce)
+        return cipher.decrypt_and_verify(ciphertext[32 + NONCE_SIZE + TAG_SIZE:], tag)
+
+    def export_public_key(self, public_key):
+        """64 bytes: the raw Ed25519 key followed by the raw X25519 key"""
+        return b''.join(key.public_bytes(serialization.Encoding.Raw, serialization.PublicFormat.Raw)
+                        for key in public_key)
+
+    def import_public_key(self, data):
+        return CurvePublicKey(ed25519.Ed25519PublicKey.from_public_bytes(data[:32]),
+                              x25519.X25519PublicKey.from_public_bytes(data[32:64]))
+
+    def export_private_key(self, private_key):
+        """64 bytes: the raw Ed25519 seed followed by the raw X25519 key"""
+        return b''.join(key.private_bytes(serialization.Encoding.Raw, serialization.PrivateFormat.Raw,
+                                          serialization.NoEncryption())
+                        for key in private_key)
+
+    def import_private_key(self, data):
+        return CurvePrivateKey(ed25519.Ed25519PrivateKey.from_private_bytes(data[:32]),
+                               x25519.X25519PrivateKey.from_private_bytes(data[32:64]))
+
+PROVIDERS = {
+    PyCryptodomeRSAProvider.name: PyCryptodomeRSAProvider,
+    OpenSSLRSAProvider.name: OpenSSLRSAProvider,
+    Curve25519Provider.name: Curve25519Provider,
+}
+
+def get_provider(name='rsa', key_size=2048):
+    """
+    Create a provider by name
+
+    Args:
+        name (str): One of PROVIDERS
+        key_size (int): RSA key size in bits; ignored by the curve provider
+
+    Returns:
+        CryptoProvider: The provider
+
+    Raises:
+        ValueError: For an unknown provider or one whose dependency is missing
+    """
+    if name not in PROVIDERS:
+        raise ValueError(f"Unknown crypto provider {name!r}; choose from {', '.join(PROVIDERS)}")
+    return PROVIDERS[name](key_size=key_size)
@@ -2,11 +2,48 @@ from Crypto.PublicKey import RSA
 from Crypto.Cipher import PKCS1_OAEP
 from Crypto.Signature import pkcs1_15
 from Crypto.Hash import SHA256
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 import base64
+import hashlib
 import logging
+import struct
+import threading
+import weakref
+
+from app.utils.timing import timed
 
 logger = logging.getLogger(__name__)
 
+# Canonical certificate encoding: magic, then each field as a 4-byte
+# big-endian length followed by its bytes, in this order
+CERTIFICATE_MAGIC = b'SMC1'
+CERTIFICATE_FIELDS = ('user_id', 'public_key', 'issued_by', 'valid_until')
+
+# OpenSSL provider for signing, verification and encryption, when enabled with use_openssl()
+_openssl = None
+
+def use_openssl(enabled=True, max_cached_keys=4096):
+    """
+    Run sign/verify/encrypt/decrypt through OpenSSL (the cryptography package)
+    
+    Callers keep passing PyCryptodome keys and the wire formats don't
+    change; each key is converted to an OpenSSL key once and cached.
+    
+    Args:
+        enabled (bool): False switches back to PyCryptodome
+        max_cached_keys (int): Converted keys to keep
+    """
+    global _openssl
+    if enabled:
+        from app.crypto.providers import OpenSSLRSAProvider
+        _openssl = OpenSSLRSAProvider(max_cached_keys=max_cached_keys)
+    else:
+        _openssl = None
+    logger.info(f"RSA primitives use {'OpenSSL' if enabled else 'PyCryptodome'}")
+
+@timed('generate_key_pair')
 def generate_key_pair(key_size=2048):
     """
     Generate an RSA key pair with the specified key size
@@ -30,23 +67,172 @@ def generate_key_pair(key_size=2048):
         logger.error(f"Error generating RSA key pair: {e}")
         raise
 
+def export_key_der(key):
+    """
+    Serialize an RSA key to DER bytes, e.g. for shared or persisted state
+    
+    Args:
+        key (RSA key): A public or private RSA key
+        
+    Returns:
+        bytes: The DER encoded key
+    """
+    return key_context(key).der
+
+def import_key_der(der):
+    """
+    Load an RSA key serialized with export_key_der
+    
+    Args:
+        der (bytes): The DER encoded key
+        
+    Returns:
+        RSA key: The key object
+    """
+    return RSA.import_key(der)
+
+class KeyContext:
+    """
+    Ready-to-use cipher and signature objects and cached encodings for one RSA key
+    
+    PyCryptodome's OAEP and PKCS#1 v1.5 objects keep no per-call state, so
+    one of each is shared by every thread using the key. The DER and PEM
+    exports and the fingerprint are computed on first use.
+    """
+    
+    __slots__ = ('key', 'cipher', 'signer', '_der', '_pem', '_fingerprint')
+    
+    def __init__(self, key):
+        self.key = key
+        self.cipher = PKCS1_OAEP.new(key)
+        self.signer = pkcs1_15.new(key)
+        self._der = None
+        self._pem = None
+        self._fingerprint = None
+    
+    @property
+    def der(self):
+        """DER export of the key (the private key for a private key context)"""
+        if self._der is None:
+            self._der = self.key.export_key(format='DER')
+        return self._der
+    
+    @property
+    def pem(self):
+        """PEM export of the key as a str"""
+        if self._pem is None:
+            self._pem = self.key.export_key().decode('utf-8')
+        return self._pem
+    
+    @property
+    def fingerprint(self):
+        """SHA-256 hex digest of the public key's DER encoding"""
+        if self._fingerprint is None:
+            public_der = key_context(self.key.publickey()).der if self.key.has_private() else self.der
+            self._fingerprint = hashlib.sha256(public_der).hexdigest()
+        return self._fingerprint
+
+class KeyContextCache:
+    """
+    Thread-safe LRU cache of KeyContexts
+    
+    Entries are keyed by modulus and key type, so equal keys share a context
+    even when they are separate objects, e.g. after a round trip through DER.
+    Reading a key's modulus converts a big integer, so lookups go by object
+    identity first and only fall back to the modulus for a new key object.
+    """
+    
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self._contexts = OrderedDict()
+        self._by_object = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def _remember(self, key, cache_key):
+        key_id = id(key)
+        # dict.pop is atomic, so the callback needs no lock (it may run while the lock is held)
+        self._by_object[key_id] = (weakref.ref(key, lambda _: self._by_object.pop(key_id, None)), cache_key)
+    
+    def get(self, key):
+        """Get the context for a key, creating it on first use"""
+        entry = self._by_object.get(id(key))
+        if entry is not None and entry[0]() is key:
+            cache_key = entry[1]
+        else:
+            cache_key = (key.n, key.has_private())
+        with self._lock:
+            context = self._contexts.get(cache_key)
+            if context is not None:
+                self._contexts.move_to_end(cache_key)
+                self.hits += 1
+                if entry is None or entry[0]() is not key:
+                    self._remember(key, cache_key)
+                return context
+            self.misses += 1
+        context = KeyContext(key)
+        with self._lock:
+            context = self._contexts.setdefault(cache_key, context)
+            self._remember(key, cache_key)
+            while len(self._contexts) > self.max_entries:
+                self._contexts.popitem(last=False)
+                self.evictions += 1
+        return context
+    
+    def clear(self):
+        with self._lock:
+            self._contexts.clear()
+            self._by_object.clear()
+    
+    def get_stats(self):
+        """Get cache size and hit/miss/eviction counters"""
+        with self._lock:
+            return {
+                'entries': len(self._contexts),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+# One context per user key (and the CA's), shared by every caller in the process
+key_contexts = KeyContextCache()
+
+def key_context(key):
+    """
+    Get the cached KeyContext for an RSA key
+    
+    Args:
+        key (RSA key): A public or private RSA key
+        
+    Returns:
+        KeyContext: The key's cipher, signer and cached encodings
+    """
+    return key_contexts.get(key)
+
+@timed('sign_message')
 def sign_message(message, private_key):
     """
     Sign a message using RSA private key
     
     Args:
-        message (str): The message to sign
+        message (str or bytes): The message to sign
         private_key (RSA key): The RSA private key
         
     Returns:
         bytes: The signature
     """
     try:
-        # Create a hash of the message
-        h = SHA256.new(message.encode('utf-8'))
-        
-        # Sign the hash with the private key
-        signature = pkcs1_15.new(private_key).sign(h)
+        if _openssl is not None:
+            signature = _openssl.sign(message, private_key)
+        else:
+            # Create a hash of the message
+            h = SHA256.new(message.encode('utf-8') if isinstance(message, str) else message)
+            
+            # Sign the hash with the private key
+            signature = key_context(private_key).signer.sign(h)
         
         logger.info("Message signed successfully")
         return signature
@@ -55,12 +241,13 @@ def sign_message(message, private_key):
         logger.error(f"Error signing message: {e}")
         raise
 
+@timed('verify_signature')
 def verify_signature(message, signature, public_key):
     """
     Verify a signature using RSA public key
     
     Args:
-        message (str): The message that was signed
+        message (str or bytes): The message that was signed
         signature (bytes): The signature to verify
         public_key (RSA key): The RSA public key
         
@@ -68,11 +255,15 @@ def verify_signature(message, signature, public_key):
         bool: True if signature is valid, False otherwise
     """
     try:
-        # Create a hash of the message
-        h = SHA256.new(message.encode('utf-8'))
-        
-        # Verify the signature
-        pkcs1_15.new(public_key).verify(h, signature)
+        if _openssl is not None:
+            if not _openssl.verify(message, signature, public_key):
+                return False
+        else:
+            # Create a hash of the message
+            h = SHA256.new(message.encode('utf-8') if isinstance(message, str) else message)
+            
+            # Verify the signature
+            key_context(public_key).signer.verify(h, signature)
         
         logger.info("Signature verified successfully")
         return True
@@ -85,6 +276,28 @@ def verify_signature(message, signature, public_key):
         logger.error(f"Error verifying signature: {e}")
         raise
 
+def verify_many(items, max_workers=None):
+    """
+    Verify a batch of signatures in parallel
+    
+    PyCryptodome drops the GIL for modular exponentiation, so a thread pool
+    spreads the verifications across cores.
+    
+    Args:
+        items (iterable): (message, signature, public_key) tuples
+        max_workers (int): Size of the thread pool, defaults to the executor's default
+        
+    Returns:
+        list: One bool per item, in input order
+    """
+    items = list(items)
+    if len(items) <= 1:
+        return [verify_signature(*item) for item in items]
+    
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(lambda item: verify_signature(*item), items))
+
+@timed('encrypt_message')
 def encrypt_message(message, public_key):
     """
     Encrypt a message using RSA public key
@@ -97,11 +310,11 @@ def encrypt_message(message, public_key):
         bytes: The encrypted message
     """
     try:
-        # Create a cipher object using the public key
-        cipher = PKCS1_OAEP.new(public_key)
-        
-        # Encrypt the message
-        encrypted = cipher.encrypt(message.encode('utf-8'))
+        if _openssl is not None:
+            encrypted = _openssl.encrypt(message, public_key)
+        else:
+            # Encrypt the message with the key's cached cipher object
+            encrypted = key_context(public_key).cipher.encrypt(message.encode('utf-8'))
         
         logger.info("Message encrypted successfully")
         return encrypted
@@ -110,6 +323,7 @@ def encrypt_message(message, public_key):
         logger.error(f"Error encrypting message: {e}")
         raise
 
+@timed('decrypt_message')
 def decrypt_message(encrypted_message, private_key):
     """
     Decrypt a message using RSA private key
@@ -122,11 +336,11 @@ def decrypt_message(encrypted_message, private_key):
         str: The decrypted message
     """
     try:
-        # Create a cipher object using the private key
-        cipher = PKCS1_OAEP.new(private_key)
-        
-        # Decrypt the message
-        decrypted = cipher.decrypt(encrypted_message)
+        if _openssl is not None:
+            decrypted = _openssl.decrypt(encrypted_message, private_key)
+        else:
+            # Decrypt the message with the key's cached cipher object
+            decrypted = key_context(private_key).cipher.decrypt(encrypted_message)
         
         logger.info("Message decrypted successfully")
         return decrypted.decode('utf-8')
@@ -135,7 +349,55 @@ def decrypt_message(encrypted_message, private_key):
         logger.error(f"Error decrypting message: {e}")
         raise
 
-def generate_certificate(user_id, public_key, issuer_private_key):
+def encode_certificate_data(certificate_data):
+    """
+    Encode certificate data into its canonical binary form
+    
+    The public key is encoded as raw DER, so the encoding is independent of
+    dict ordering, quoting and base64 formatting.
+    
+    Args:
+        certificate_data (dict): The certificate data, with a base64 DER public key
+        
+    Returns:
+        bytes: The canonical encoding that is signed and fingerprinted
+    """
+    parts = [CERTIFICATE_MAGIC]
+    for field in CERTIFICATE_FIELDS:
+        if field == 'public_key':
+            value = base64.b64decode(certificate_data[field])
+        else:
+            value = certificate_data[field].encode('utf-8')
+        parts.append(struct.pack('>I', len(value)))
+        parts.append(value)
+    return b''.join(parts)
+
+def certificate_fingerprint(encoded_data):
+    """
+    Compute the 128-bit fingerprint ID of an encoded certificate
+    
+    Args:
+        encoded_data (bytes): Output of encode_certificate_data
+        
+    Returns:
+        str: Hex fingerprint
+    """
+    return hashlib.sha256(encoded_data).hexdigest()[:32]
+
+def certificate_public_key(certificate):
+    """
+    Load the public key embedded in a certificate
+    
+    Args:
+        certificate (dict): The certificate
+        
+    Returns:
+        RSA key: The certificate holder's public key
+    """
+    return RSA.import_key(base64.b64decode(certificate["data"]["public_key"]))
+
+@timed('generate_certificate')
+def generate_certificate(user_id, public_key, issuer_private_key, valid_days=365):
     """
     Generate a simple certificate for a user
     
@@ -143,6 +405,7 @@ def generate_certificate(user_id, public_key, issuer_private_key):
         user_id (str): The user ID
         public_key (RSA key): The user's public key
         issuer_private_key (RSA key): The issuer's private key
+        valid_days (int): Number of days the certificate stays valid
         
     Returns:
         dict: The certificate as a dictionary
@@ -151,20 +414,21 @@ def generate_certificate(user_id, public_key, issuer_private_key):
         # Create a certificate with user information and public key
         certificate_data = {
             "user_id": user_id,
-            "public_key": public_key.export_key().decode('utf-8'),
+            "public_key": base64.b64encode(export_key_der(public_key)).decode('utf-8'),
             "issued_by": "Secure Messaging App",
-            "valid_until": "2025-12-31"  # dummy timestamp
+            "valid_until": (datetime.now() + timedelta(days=valid_days)).strftime("%Y-%m-%d")
         }
         
         # Serialize the certificate data
-        certificate_str = str(certificate_data)
+        encoded_data = encode_certificate_data(certificate_data)
         
         # Sign the certificate
-        signature = sign_message(certificate_str, issuer_private_key)
+        signature = sign_message(encoded_data, issuer_private_key)
         
         # Create the complete certificate
         certificate = {
             "data": certificate_data,
+            "fingerprint": certificate_fingerprint(encoded_data),
             "signature": base64.b64encode(signature).decode('utf-8')
         }
         
@@ -175,6 +439,7 @@ def generate_certificate(user_id, public_key, issuer_private_key):
         logger.error(f"Error generating certificate: {e}")
         raise
 
+@timed('verify_certificate')
 def verify_certificate(certificate, issuer_public_key):
     """
     Verify a certificate using the issuer's public key
@@ -190,9 +455,15 @@ def verify_certificate(certificate, issuer_public_key):
         # Extract certificate data and signature
         certificate_data = certificate["data"]
         signature = base64.b64decode(certificate["signature"])
+        encoded_data = encode_certificate_data(certificate_data)
+        
+        # The fingerprint must match the data it identifies
+        if certificate.get("fingerprint") != certificate_fingerprint(encoded_data):
+            logger.warning(f"Fingerprint mismatch for user {certificate_data['user_id']}")
+            return False
         
         # Verify the signature
-        is_valid = verify_signature(str(certificate_data), signature, issuer_public_key)
+        is_valid = verify_signature(encoded_data, signature, issuer_public_key)
         
         if is_valid:
             logger.info(f"Certificate verified for user {certificate_data['user_id']}")
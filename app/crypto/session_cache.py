@@ -0,0 +1,215 @@
+from Crypto.Cipher import AES
+from Crypto.Random import get_random_bytes
+from collections import OrderedDict
+import base64
+import logging
+import threading
+import time
+
+from app.crypto.rsa_utils import sign_message, verify_signature, key_context
+
+logger = logging.getLogger(__name__)
+
+SESSION_KEY_SIZE = 32
+NONCE_SIZE = 12
+
+def _b64(data):
+    return base64.b64encode(data).decode('utf-8')
+
+def _run_inline(func, *args):
+    return func(*args)
+
+def _associated_data(sender, recipient, key_id, seq):
+    """Bind each ciphertext to its conversation direction, key and position"""
+    return f"{sender}|{recipient}|{key_id}|{seq}".encode('utf-8')
+
+def wrap_session_key(key, key_id, sender_private_key, recipient_public_key):
+    """
+    Wrap a session key for the recipient and sign the wrapped key
+
+    This is the only RSA work for the lifetime of a session; the signature
+    tells the recipient who set the session up.
+
+    Returns:
+        tuple: (wrapped_key, signature) as bytes
+    """
+    wrapped_key = key_context(recipient_public_key).cipher.encrypt(key)
+    return wrapped_key, sign_message(key_id + _b64(wrapped_key), sender_private_key)
+
+class Session:
+    """A symmetric session key for one (sender, recipient) direction"""
+
+    def __init__(self, sender, recipient, sender_private_key, recipient_public_key, run=None):
+        self.key = get_random_bytes(SESSION_KEY_SIZE)
+        self.key_id = get_random_bytes(8).hex()
+        self.created_at = time.monotonic()
+        self.message_count = 0
+        self.wrapped_key, self.signature = (run or _run_inline)(
+            wrap_session_key, self.key, self.key_id, sender_private_key, recipient_public_key)
+
+    def setup_info(self):
+        """Key material the recipient needs to open messages in this session"""
+        return {
+            'key_id': self.key_id,
+            'wrapped_key': _b64(self.wrapped_key),
+            'signature': _b64(self.signature)
+        }
+
+class SessionKeyCache:
+    """
+    LRU cache of per-conversation session keys
+
+    Sessions are keyed by (sender, recipient) and rotated once they are
+    older than `ttl` seconds or have protected `max_messages` messages.
+    """
+
+    def __init__(self, max_sessions=1024, ttl=3600, max_messages=1000, run=None):
+        """
+        Args:
+            max_sessions (int): Sessions kept before the least recently used is evicted
+            ttl (float): Seconds before a session is rotated
+            max_messages (int): Messages protected by one session before it is rotated
+            run (callable): Runs the RSA key wrap and signature, e.g. CryptoOffloader.run
+        """
+        self.max_sessions = max_sessions
+        self.run = run
+        self.ttl = ttl
+        self.max_messages = max_messages
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.rotations = 0
+        self.evictions = 0
+
+    def _is_expired(self, session):
+        return (time.monotonic() - session.created_at > self.ttl or
+                session.message_count >= self.max_messages)
+
+    def get_session(self, sender, recipient, sender_private_key, recipient_public_key):
+        """
+        Get the current session for a conversation, establishing or rotating it if needed
+
+        Returns:
+            tuple: (Session, bool) where the flag is True if the session is new
+        """
+        key = (sender, recipient)
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is not None and not self._is_expired(session):
+                self._sessions.move_to_end(key)
+                self.hits += 1
+                return session, False
+
+            if session is None:
+                self.misses += 1
+            else:
+                self.rotations += 1
+
+        # Build the new session outside the lock so RSA work doesn't serialize other conversations
+        session = Session(sender, recipient, sender_private_key, recipient_public_key, self.run)
+        logger.info(f"Established session {session.key_id} for {sender} -> {recipient}")
+
+        with self._lock:
+            self._sessions[key] = session
+            self._sessions.move_to_end(key)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self.evictions += 1
+        return session, True
+
+    def get_setup_info(self, sender, recipient):
+        """Get the key setup info for an existing session, or None"""
+        with self._lock:
+            session = self._sessions.get((sender, recipient))
+            return session.setup_info() if session is not None else None
+
+    def encrypt(self, sender, recipient, message, sender_private_key, recipient_public_key):
+        """
+        Encrypt a message under the conversation's session key
+
+        Args:
+            sender (str): The sender's user ID
+            recipient (str): The recipient's user ID
+            message (str): The message to encrypt
+            sender_private_key (RSA key): Used only when a session is set up
+            recipient_public_key (RSA key): Used only when a session is set up
+
+        Returns:
+            dict: key_id, seq, nonce, ciphertext and tag, plus session_key
+                setup info when the session was just established or rotated
+        """
+        session, is_new = self.get_session(sender, recipient, sender_private_key, recipient_public_key)
+        with self._lock:
+            seq = session.message_count
+            session.message_count += 1
+
+        nonce = get_random_bytes(NONCE_SIZE)
+        cipher = AES.new(session.key, AES.MODE_GCM, nonce=nonce)
+        cipher.update(_associated_data(sender, recipient, session.key_id, seq))
+        ciphertext, tag = cipher.encrypt_and_digest(message.encode('utf-8'))
+
+        payload = {
+            'key_id': session.key_id,
+            'seq': seq,
+            'nonce': _b64(nonce),
+            'ciphertext': _b64(ciphertext),
+            'tag': _b64(tag)
+        }
+        if is_new:
+            payload['session_key'] = session.setup_info()
+        return payload
+
+    def invalidate_user(self, user_id):
+        """Drop every session involving a user, e.g. after their keys change"""
+        with self._lock:
+            stale = [key for key in self._sessions if user_id in key]
+            for key in stale:
+                del self._sessions[key]
+        if stale:
+            logger.info(f"Invalidated {len(stale)} sessions for user {user_id}")
+
+    def get_stats(self):
+        """Get cache size and hit/miss/rotation/eviction counters"""
+        with self._lock:
+            return {
+                'size': len(self._sessions),
+                'capacity': self.max_sessions,
+                'hits': self.hits,
+                'misses': self.misses,
+                'rotations': self.rotations,
+                'evictions': self.evictions
+            }
+
+def unwrap_session_key(setup_info, recipient_private_key, sender_public_key):
+    """
+    Recover a session key on the recipient side
+
+    Args:
+        setup_info (dict): The session_key info sent with the first message
+        recipient_private_key (RSA key): The recipient's RSA private key
+        sender_public_key (RSA key): The sender's RSA public key
+
+    Returns:
+        bytes: The session key
+
+    Raises:
+        ValueError: If the sender's signature over the wrapped key is invalid
+    """
+    signature = base64.b64decode(setup_info['signature'])
+    if not verify_signature(setup_info['key_id'] + setup_info['wrapped_key'], signature, sender_public_key):
+        raise ValueError("Invalid session key signature")
+    return key_context(recipient_private_key).cipher.decrypt(base64.b64decode(setup_info['wrapped_key']))
+
+def decrypt_session_message(payload, sender, recipient, session_key):
+    """
+    Decrypt a message produced by SessionKeyCache.encrypt
+
+    Raises:
+        ValueError: If the message or its associated data was tampered with
+    """
+    cipher = AES.new(session_key, AES.MODE_GCM, nonce=base64.b64decode(payload['nonce']))
+    cipher.update(_associated_data(sender, recipient, payload['key_id'], payload['seq']))
+    plaintext = cipher.decrypt_and_verify(base64.b64decode(payload['ciphertext']),
+                                          base64.b64decode(payload['tag']))
+    return plaintext.decode('utf-8')
@@ -0,0 +1,153 @@
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import base64
+import hashlib
+import heapq
+import logging
+import threading
+import time
+
+from app.crypto.rsa_utils import verify_certificate, encode_certificate_data
+
+logger = logging.getLogger(__name__)
+
+class RevocationListFull(Exception):
+    """Raised when a revocation would push out revocations of unexpired certificates"""
+
+def certificate_digest(certificate):
+    """
+    Compute a stable SHA-256 digest identifying a certificate
+
+    Args:
+        certificate (dict): The certificate
+
+    Returns:
+        str: Hex digest over the certificate data and signature
+    """
+    h = hashlib.sha256(encode_certificate_data(certificate['data']))
+    h.update(base64.b64decode(certificate['signature']))
+    return h.hexdigest()
+
+def is_expired(certificate_data, now=None):
+    """Check a certificate's valid_until date (inclusive)"""
+    valid_until = datetime.strptime(certificate_data['valid_until'], "%Y-%m-%d").date()
+    return (now or datetime.now()).date() > valid_until
+
+def expiry_timestamp(certificate_data):
+    """The Unix time at which a certificate stops being valid: the end of its valid_until day"""
+    valid_until = datetime.strptime(certificate_data['valid_until'], "%Y-%m-%d")
+    return (valid_until + timedelta(days=1)).timestamp()
+
+class CertificateVerificationCache:
+    """
+    Bounded LRU cache of certificate verification results
+
+    Hot paths pay for at most one RSA verify per certificate. Entries are
+    dropped when the certificate is revoked or has expired.
+    """
+
+    def __init__(self, max_entries=4096, max_revoked=65536):
+        """
+        Args:
+            max_entries (int): Verification results kept
+            max_revoked (int): Revocations of unexpired certificates kept;
+                past this, revoke raises RevocationListFull
+        """
+        self.max_entries = max_entries
+        self.max_revoked = max_revoked
+        self._results = OrderedDict()
+        # digest -> expiry timestamp, plus a heap of (expiry, digest) to prune from the front
+        self._revoked = {}
+        self._revoked_expiry = []
+        self.revocations_refused = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def verify(self, certificate, issuer_public_key):
+        """
+        Verify a certificate, using the cached result when available
+
+        Args:
+            certificate (dict): The certificate to verify
+            issuer_public_key (RSA key): The issuer's public key
+
+        Returns:
+            bool: True if the certificate is valid, unrevoked and unexpired
+        """
+        try:
+            digest = certificate_digest(certificate)
+            key = (digest, issuer_public_key.n, issuer_public_key.e)
+            expired = is_expired(certificate['data'])
+        except Exception as e:
+            logger.error(f"Error reading certificate: {e}")
+            return False
+
+        with self._lock:
+            if digest in self._revoked:
+                return False
+            if expired:
+                self._results.pop(key, None)
+                return False
+            if key in self._results:
+                self._results.move_to_end(key)
+                self.hits += 1
+                return self._results[key]
+            self.misses += 1
+
+        is_valid = verify_certificate(certificate, issuer_public_key)
+
+        with self._lock:
+            if digest not in self._revoked:
+                self._results[key] = is_valid
+                while len(self._results) > self.max_entries:
+                    self._results.popitem(last=False)
+                    self.evictions += 1
+        return is_valid
+
+    def revoke(self, certificate):
+        """
+        Revoke a certificate so it no longer verifies
+
+        Revocations are only ever dropped once their certificate has
+        expired, so a revoked certificate never verifies again.
+
+        Raises:
+            RevocationListFull: If max_revoked unexpired certificates are
+                already revoked; the certificate is left unrevoked
+        """
+        digest = certificate_digest(certificate)
+        expires_at = expiry_timestamp(certificate['data'])
+        with self._lock:
+            self._prune_revoked(time.time())
+            if digest not in self._revoked and len(self._revoked) >= self.max_revoked:
+                self.revocations_refused += 1
+                raise RevocationListFull(f"{len(self._revoked)} unexpired certificates already revoked")
+            self._revoked[digest] = expires_at
+            heapq.heappush(self._revoked_expiry, (expires_at, digest))
+            for key in [key for key in self._results if key[0] == digest]:
+                del self._results[key]
+        logger.info(f"Revoked certificate for user {certificate['data']['user_id']}")
+
+    def _prune_revoked(self, now):
+        """Drop revocations of expired certificates; caller holds the lock"""
+        heap = self._revoked_expiry
+        while heap and heap[0][0] <= now:
+            expires_at, digest = heapq.heappop(heap)
+            # Skip heap entries superseded by a later revoke of the same certificate
+            if self._revoked.get(digest) == expires_at:
+                del self._revoked[digest]
+
+    def get_stats(self):
+        """Get cache size and hit/miss/eviction counters"""
+        with self._lock:
+            return {
+                'size': len(self._results),
+                'capacity': self.max_entries,
+                'revoked': len(self._revoked),
+                'revocations_refused': self.revocations_refused,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
@@ -0,0 +1,133 @@
+from collections import OrderedDict
+import sys
+import threading
+import time
+
+def approximate_size(obj):
+    """
+    Cheap estimate of the memory held by a JSON-like value
+
+    Args:
+        obj: A str, bytes, number, or a dict/list/tuple of those
+
+    Returns:
+        int: Approximate size in bytes
+    """
+    if isinstance(obj, (str, bytes)):
+        return sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(approximate_size(k) + approximate_size(v) for k, v in obj.items())
+    if isinstance(obj, (list, tuple, set)):
+        return sys.getsizeof(obj) + sum(approximate_size(v) for v in obj)
+    return sys.getsizeof(obj)
+
+class BoundedCache:
+    """
+    Thread-safe LRU mapping bounded by entry count, total bytes and age
+
+    Any limit left as None is not enforced. Expired entries are dropped
+    lazily on access and when new entries are inserted.
+    """
+
+    def __init__(self, max_entries=None, max_bytes=None, ttl=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _expired(self, inserted_at, now):
+        return self.ttl is not None and now - inserted_at > self.ttl
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self.bytes -= size
+
+    def _enforce_limits(self, now):
+        while self._entries:
+            key, (_, _, inserted_at) = next(iter(self._entries.items()))
+            if self._expired(inserted_at, now):
+                self._remove(key)
+                self.expirations += 1
+            elif (self.max_entries is not None and len(self._entries) > self.max_entries) or \
+                 (self.max_bytes is not None and self.bytes > self.max_bytes):
+                self._remove(key)
+                self.evictions += 1
+            else:
+                break
+
+    def __setitem__(self, key, value):
+        now = time.monotonic()
+        size = approximate_size(key) + approximate_size(value)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, now)
+            self.bytes += size
+            self._enforce_limits(now)
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            if self._expired(entry[2], now):
+                self._remove(key)
+                self.expirations += 1
+                return default
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def __getitem__(self, key):
+        sentinel = object()
+        value = self.get(key, sentinel)
+        if value is sentinel:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        sentinel = object()
+        return self.get(key, sentinel) is not sentinel
+
+    def pop(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                return default
+            value = self._entries[key][0]
+            self._remove(key)
+            return value
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def get_stats(self):
+        """Get current size, byte usage and eviction counters"""
+        with self._lock:
+            self._enforce_limits(time.monotonic())
+            return {
+                'entries': len(self._entries),
+                'bytes': self.bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'evictions': self.evictions,
+                'expirations': self.expirations
+            }
+
+class BoundedSet(BoundedCache):
+    """Set-like view of BoundedCache"""
+
+    def add(self, key):
+        self[key] = True
+
+    def discard(self, key):
+        self.pop(key)
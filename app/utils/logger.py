@@ -1,49 +1,256 @@
+import atexit
+import json
 import logging
+import logging.handlers
 import os
+import queue
+import random
 import sys
+import threading
+import time
 from datetime import datetime
 
-def setup_logger(name='app', level=logging.INFO, log_to_file=True):
+class JsonFormatter(logging.Formatter):
+    """Format records as one JSON object per line"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'thread': record.threadName
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep only a fraction of the records from chosen loggers
+
+    Rates apply to a logger and its children, e.g. {'app.crypto': 0.01}
+    keeps about 1% of the records from every crypto module. Warnings and
+    errors are always kept.
+    """
+
+    def __init__(self, rates):
+        super().__init__()
+        # Longest prefix first so the most specific rate wins
+        self.rates = sorted(rates.items(), key=lambda item: len(item[0]), reverse=True)
+
+    def _rate(self, name):
+        for prefix, rate in self.rates:
+            if name == prefix or name.startswith(prefix + '.'):
+                return rate
+        return None
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self._rate(record.name)
+        return rate is None or random.random() < rate
+
+class RateLimitFilter(logging.Filter):
+    """
+    Allow at most `per_second` records per logger, with bursts up to `burst`
+
+    A token bucket per logger name; warnings and errors are never limited.
+    The number of suppressed records is kept in `suppressed`.
+    """
+
+    def __init__(self, per_second, burst=None):
+        super().__init__()
+        self.per_second = per_second
+        self.burst = burst if burst is not None else per_second
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self.suppressed = 0
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(record.name, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.per_second)
+            if tokens < 1:
+                self._buckets[record.name] = (tokens, now)
+                self.suppressed += 1
+                return False
+            self._buckets[record.name] = (tokens - 1, now)
+            return True
+
+class SizedTimedRotatingFileHandler(logging.handlers.TimedRotatingFileHandler):
+    """Rotate on a time schedule and also whenever the file grows past max_bytes"""
+
+    def __init__(self, filename, when='midnight', max_bytes=0, backup_count=5, encoding='utf-8'):
+        super().__init__(filename, when=when, backupCount=backup_count, encoding=encoding, delay=True)
+        self.max_bytes = max_bytes
+
+    def shouldRollover(self, record):
+        if super().shouldRollover(record):
+            return True
+        if self.max_bytes > 0:
+            if self.stream is None:
+                self.stream = self._open()
+            self.stream.seek(0, 2)
+            return self.stream.tell() + len(self.format(record)) + 1 >= self.max_bytes
+        return False
+
+class LocalQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler for an in-process listener
+
+    Records never leave the process, so only the message is merged on the
+    caller's thread; formatting and I/O happen on the listener thread. When
+    the queue is full the record is dropped and counted instead of blocking.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+# Background listeners by logger name, so setup_logger can be called again safely
+_listeners = {}
+
+def stop_logger(name='app'):
+    """Flush and stop the background writer for a logger set up with use_queue=True"""
+    listener = _listeners.pop(name, None)
+    if listener is not None:
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+
+@atexit.register
+def _stop_all_loggers():
+    for name in list(_listeners):
+        stop_logger(name)
+
+def _file_handler(name, log_file, max_bytes, rotate_when, backup_count):
+    # Create logs directory if it doesn't exist
+    directory = os.path.dirname(log_file) if log_file else 'logs'
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+
+    if log_file is None:
+        if not (max_bytes or rotate_when):
+            # One file per run
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            return logging.FileHandler(f"logs/{name}_{timestamp}.log")
+        log_file = f"logs/{name}.log"
+
+    if rotate_when:
+        return SizedTimedRotatingFileHandler(log_file, when=rotate_when, max_bytes=max_bytes or 0,
+                                             backup_count=backup_count)
+    if max_bytes:
+        return logging.handlers.RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_count,
+                                                    encoding='utf-8', delay=True)
+    return logging.FileHandler(log_file, encoding='utf-8')
+
+def setup_logger(name='app', level=logging.INFO, log_to_file=True, use_queue=False, log_file=None,
+                 max_bytes=None, rotate_when=None, backup_count=5, json_lines=False,
+                 sample_rates=None, rate_limit=None, queue_size=10000):
     """
     Set up a logger with console and optionally file output
-    
+
     Args:
         name (str): Logger name
         level (int): Logging level
         log_to_file (bool): Whether to log to a file
-        
+        use_queue (bool): Hand records to a background writer thread instead of
+            writing them on the caller's thread
+        log_file (str): Log file path; defaults to a new timestamped file per run,
+            or logs/<name>.log when rotation is enabled
+        max_bytes (int): Rotate the file when it grows past this size
+        rotate_when (str): Also rotate on a schedule, e.g. 'midnight' or 'H'
+        backup_count (int): Number of rotated files to keep
+        json_lines (bool): Write one JSON object per record instead of plain text
+        sample_rates (dict): Logger name prefix -> fraction of INFO/DEBUG records to keep
+        rate_limit (float): Maximum INFO/DEBUG records per second from each logger
+        queue_size (int): Records buffered for the background writer before new ones are dropped
+
     Returns:
         logging.Logger: Configured logger
     """
     # Create logger
     logger = logging.getLogger(name)
     logger.setLevel(level)
-    
+
     # Remove existing handlers to avoid duplicates during reloads
+    stop_logger(name)
     for handler in logger.handlers[:]:
         logger.removeHandler(handler)
-    
+
     # Create formatter
-    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    
+    if json_lines:
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
     # Console handler
     console_handler = logging.StreamHandler(sys.stdout)
     console_handler.setLevel(level)
     console_handler.setFormatter(formatter)
-    logger.addHandler(console_handler)
-    
+    handlers = [console_handler]
+
     # File handler
     if log_to_file:
-        # Create logs directory if it doesn't exist
-        if not os.path.exists('logs'):
-            os.makedirs('logs')
-        
-        # Create a file handler
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        log_file = f"logs/{name}_{timestamp}.log"
-        file_handler = logging.FileHandler(log_file)
+        file_handler = _file_handler(name, log_file, max_bytes, rotate_when, backup_count)
         file_handler.setLevel(level)
         file_handler.setFormatter(formatter)
-        logger.addHandler(file_handler)
-    
-    return logger 
\ No newline at end of file
+        handlers.append(file_handler)
+
+    # Sampling and rate limiting run before anything is queued or written
+    filters = []
+    if sample_rates:
+        filters.append(SamplingFilter(sample_rates))
+    if rate_limit:
+        filters.append(RateLimitFilter(rate_limit))
+
+    if use_queue:
+        queue_handler = LocalQueueHandler(queue.Queue(maxsize=queue_size))
+        for log_filter in filters:
+            queue_handler.addFilter(log_filter)
+        logger.addHandler(queue_handler)
+
+        listener = logging.handlers.QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+        listener.start()
+        _listeners[name] = listener
+    else:
+        for handler in handlers:
+            for log_filter in filters:
+                handler.addFilter(log_filter)
+            logger.addHandler(handler)
+
+    return logger
+
+def parse_sample_rates(value):
+    """
+    Parse 'app.crypto=0.01,app.backend.message_handler=0.1' into a dict
+
+    Args:
+        value (str): Comma-separated logger=rate pairs
+
+    Returns:
+        dict: Logger name prefix -> rate
+    """
+    rates = {}
+    for item in (value or '').split(','):
+        if '=' in item:
+            prefix, rate = item.split('=', 1)
+            rates[prefix.strip()] = float(rate)
+    return rates
@@ -0,0 +1,274 @@
+"""
+Prometheus-style metrics for the Socket.IO server
+
+Handlers never take a lock to record a metric: each observation is
+appended to a deque (atomic under the GIL) and folded into the counters
+and histograms in batches, either by whichever thread crosses the flush
+threshold or at scrape time. Recording therefore never serializes the
+threading workers, and it costs the same under gevent/eventlet.
+
+Payload byte counters take the length of payloads that are already
+encoded (bytes, e.g. binary wire-format messages) as is. Dict payloads
+would have to be serialized just to be measured, so only one in
+`payload_sample_every` of them is, and its size is scaled up.
+"""
+from collections import deque
+from functools import wraps
+import itertools
+import json
+import threading
+import time
+
+from app.utils.timing import DEFAULT_BUCKETS, Histogram
+
+def payload_size(data):
+    """Approximate wire size of an event payload, in bytes"""
+    if data is None:
+        return 0
+    if isinstance(data, (bytes, bytearray)):
+        return len(data)
+    try:
+        return len(json.dumps(data, separators=(',', ':'), default=str))
+    except (TypeError, ValueError):
+        return 0
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(labels, extra=()):
+    pairs = tuple(labels) + tuple(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+def render_histogram(lines, name, labels, buckets, counts, total, count):
+    """Append the _bucket/_sum/_count lines for one histogram, with cumulative buckets"""
+    cumulative = 0
+    for bound, bucket_count in zip(tuple(buckets) + (float('inf'),), counts):
+        cumulative += bucket_count
+        lines.append(f"{name}_bucket{_format_labels(labels, (('le', _format_value(bound)),))} {cumulative}")
+    lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(total)}")
+    lines.append(f"{name}_count{_format_labels(labels)} {count}")
+
+class Metrics:
+    """
+    Counters, gauges and histograms rendered in the Prometheus text exposition format
+
+    Metrics are identified by name plus a tuple of (label, value) pairs.
+    Gauges can also be backed by a callback that is read at scrape time.
+    """
+
+    def __init__(self, prefix='securechat', buckets=DEFAULT_BUCKETS, flush_threshold=1024, payload_sample_every=1):
+        self.prefix = prefix
+        self.buckets = buckets
+        self.flush_threshold = flush_threshold
+        self.payload_sample_every = max(1, payload_sample_every)
+        # next() on a count is atomic under the GIL, like the deque appends
+        self._payload_calls = itertools.count()
+        self._pending = deque()
+        self._lock = threading.Lock()
+        self._meta = {}
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._callbacks = {}
+        self._collectors = []
+
+    def describe(self, name, metric_type, help_text):
+        """Register the TYPE and HELP lines for a metric"""
+        self._meta[f"{self.prefix}_{name}"] = (metric_type, help_text)
+
+    def inc(self, name, value=1, labels=()):
+        self._record('counter', name, labels, value)
+
+    def gauge_add(self, name, value, labels=()):
+        self._record('gauge', name, labels, value)
+
+    def observe(self, name, value, labels=()):
+        self._record('histogram', name, labels, value)
+
+    def gauge_callback(self, name, func, help_text):
+        """Expose func() as a gauge, evaluated on every scrape"""
+        self.describe(name, 'gauge', help_text)
+        self._callbacks[f"{self.prefix}_{name}"] = func
+
+    def add_collector(self, func):
+        """Register func(lines) to append extra exposition lines on every scrape"""
+        self._collectors.append(func)
+
+    def _record(self, kind, name, labels, value):
+        self._pending.append((kind, name, labels, value))
+        if len(self._pending) >= self.flush_threshold and self._lock.acquire(blocking=False):
+            try:
+                self._drain()
+            finally:
+                self._lock.release()
+
+    def _drain(self):
+        """Fold pending observations into the aggregates; caller holds the lock"""
+        pending = self._pending
+        while True:
+            try:
+                kind, name, labels, value = pending.popleft()
+            except IndexError:
+                return
+            key = (f"{self.prefix}_{name}", labels)
+            if kind == 'counter':
+                self._counters[key] = self._counters.get(key, 0) + value
+            elif kind == 'gauge':
+                self._gauges[key] = self._gauges.get(key, 0) + value
+            else:
+                histogram = self._histograms.get(key)
+                if histogram is None:
+                    histogram = self._histograms[key] = Histogram(self.buckets)
+                histogram.observe(value)
+
+    def payload_bytes(self, args):
+        """
+        Estimated bytes of an event's payloads
+
+        Encoded payloads are measured exactly; others are serialized for
+        one call in `payload_sample_every` and count that many times over.
+        """
+        total = 0
+        for arg in args:
+            if arg is None:
+                continue
+            if isinstance(arg, (bytes, bytearray)):
+                total += len(arg)
+            elif next(self._payload_calls) % self.payload_sample_every == 0:
+                total += payload_size(arg) * self.payload_sample_every
+        return total
+
+    def track_event(self, event):
+        """
+        Decorator for a Socket.IO handler: times each call and counts errors and inbound bytes
+
+        Args:
+            event (str): Event name used as the metric label
+        """
+        labels = (('event', event),)
+
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                self.inc('socketio_event_bytes_in_total', self.payload_bytes(args), labels)
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                except Exception:
+                    self.inc('socketio_event_errors_total', 1, labels)
+                    raise
+                finally:
+                    self.observe('socketio_event_duration_seconds', time.perf_counter() - start, labels)
+            return wrapper
+        return decorator
+
+    def count_emits(self, emit):
+        """Wrap an emit function to count outbound events and bytes"""
+        @wraps(emit)
+        def wrapper(event, *args, **kwargs):
+            labels = (('event', event),)
+            self.inc('socketio_emits_total', 1, labels)
+            self.inc('socketio_event_bytes_out_total', self.payload_bytes(args), labels)
+            return emit(event, *args, **kwargs)
+        return wrapper
+
+    def render(self):
+        """
+        Render every metric in the Prometheus text exposition format
+
+        Returns:
+            str: The exposition document
+        """
+        with self._lock:
+            self._drain()
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            histograms = {key: histogram.state() for key, histogram in self._histograms.items()}
+
+        for name, func in self._callbacks.items():
+            try:
+                gauges[(name, ())] = func()
+            except Exception:
+                continue
+
+        families = {}
+        for (name, labels), value in counters.items():
+            families.setdefault(name, []).append(('value', labels, value))
+        for (name, labels), value in gauges.items():
+            families.setdefault(name, []).append(('value', labels, value))
+        for (name, labels), value in histograms.items():
+            families.setdefault(name, []).append(('histogram', labels, value))
+            # Event counts come for free from the histogram
+            if name == f"{self.prefix}_socketio_event_duration_seconds":
+                families.setdefault(f"{self.prefix}_socketio_events_total", []).append(
+                    ('value', labels, value[2]))
+
+        lines = []
+        for name in sorted(families):
+            metric_type, help_text = self._meta.get(name, ('untyped', ''))
+            if help_text:
+                lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for kind, labels, value in sorted(families[name], key=lambda item: item[1]):
+                if kind == 'histogram':
+                    counts, total, count = value
+                    render_histogram(lines, name, labels, self.buckets, counts, total, count)
+                else:
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        for collector in self._collectors:
+            collector(lines)
+        return '\n'.join(lines) + '\n'
+
+def operation_timings_collector(name, registry, help_text):
+    """
+    Collector that renders an OperationTimings registry as one histogram family
+
+    Args:
+        name (str): Full metric name
+        registry (OperationTimings): Per-operation histograms, labelled by operation
+        help_text (str): HELP line text
+    """
+    def collect(lines):
+        if not registry.enabled:
+            return
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} histogram")
+        for operation in sorted(registry.operations()):
+            histogram = registry.histogram(operation)
+            counts, total, count = histogram.state()
+            render_histogram(lines, name, (('operation', operation),), histogram.buckets, counts, total, count)
+    return collect
+
+def process_collector(get_process_stats):
+    """Collector for the standard process CPU and memory metrics"""
+    def collect(lines):
+        stats = get_process_stats()
+        lines.append("# HELP process_cpu_seconds_total Total user and system CPU time spent in seconds.")
+        lines.append("# TYPE process_cpu_seconds_total counter")
+        lines.append(f"process_cpu_seconds_total {_format_value(stats['cpu_seconds'])}")
+        if stats['rss_bytes'] is not None:
+            lines.append("# HELP process_resident_memory_bytes Resident memory size in bytes.")
+            lines.append("# TYPE process_resident_memory_bytes gauge")
+            lines.append(f"process_resident_memory_bytes {stats['rss_bytes']}")
+    return collect
+
+def create_socketio_metrics(prefix='securechat', payload_sample_every=16):
+    """Create a Metrics instance with the Socket.IO event metrics described"""
+    metrics = Metrics(prefix, payload_sample_every=payload_sample_every)
+    metrics.describe('socketio_events_total', 'counter', "Socket.IO events handled")
+    metrics.describe('socketio_event_errors_total', 'counter', "Socket.IO handlers that raised")
+    metrics.describe('socketio_event_duration_seconds', 'histogram', "Socket.IO handler latency")
+    metrics.describe('socketio_event_bytes_in_total', 'counter', "Approximate inbound payload bytes")
+    metrics.describe('socketio_event_bytes_out_total', 'counter', "Approximate outbound payload bytes")
+    metrics.describe('socketio_emits_total', 'counter', "Socket.IO events emitted")
+    metrics.describe('socketio_connected_clients', 'gauge', "Currently connected Socket.IO clients")
+    return metrics
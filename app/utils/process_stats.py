@@ -0,0 +1,40 @@
+import os
+import sys
+import time
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+def _current_rss():
+    """Resident set size in bytes, or None if it can't be determined"""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        # Peak rather than current RSS; reported in KiB on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+    except ImportError:
+        return None
+
+def get_process_stats():
+    """
+    Get CPU time and memory usage of the server process
+
+    Returns:
+        dict: cpu_seconds (user + system), rss_bytes and the wall clock
+            time of the sample, so callers can derive CPU utilization
+    """
+    return {
+        'pid': os.getpid(),
+        'cpu_seconds': time.process_time(),
+        'rss_bytes': _current_rss(),
+        'sampled_at': time.time()
+    }
@@ -0,0 +1,145 @@
+from collections import OrderedDict
+import threading
+import time
+
+class TokenBucketLimiter:
+    """
+    Token buckets keyed by an arbitrary ID, e.g. a user or a connection
+
+    Each key's bucket holds up to `burst` tokens and refills at `rate`
+    tokens per second. A key costs one small list while active. Buckets
+    are kept in least-recently-used order and those idle for `idle_ttl`
+    seconds are evicted as new calls arrive. An idle bucket would be full
+    again by then anyway, so evicting it changes nothing. At most
+    `max_keys` buckets are kept.
+    """
+
+    def __init__(self, rate, burst, idle_ttl=None, max_keys=100000):
+        self.rate = rate
+        self.burst = burst
+        # Long enough for an empty bucket to refill completely
+        self.idle_ttl = idle_ttl if idle_ttl is not None else max(burst / rate, 1.0)
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.rejected = 0
+        self.evictions = 0
+
+    def _evict(self, now):
+        buckets = self._buckets
+        while buckets:
+            key, (_, last) = next(iter(buckets.items()))
+            if now - last > self.idle_ttl or len(buckets) > self.max_keys:
+                del buckets[key]
+                self.evictions += 1
+            else:
+                break
+
+    def acquire(self, key, cost=1):
+        """
+        Take `cost` tokens from a key's bucket
+
+        Returns:
+            float: 0 if the call is allowed, otherwise seconds until it would be
+        """
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [self.burst, now]
+            else:
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+                self._buckets.move_to_end(key)
+            self._evict(now)
+
+            if bucket[0] >= cost:
+                bucket[0] -= cost
+                self.allowed += 1
+                return 0.0
+            self.rejected += 1
+            return (cost - bucket[0]) / self.rate
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'rate': self.rate,
+                'burst': self.burst,
+                'keys': len(self._buckets),
+                'allowed': self.allowed,
+                'rejected': self.rejected,
+                'evictions': self.evictions
+            }
+
+class RateLimits:
+    """
+    Per-event token-bucket quotas, per user, per connection and per address
+
+    A call has to get a token from the bucket of each scope it is charged
+    to. The per-connection bucket stops a single socket from cycling
+    through user IDs, and the per-user bucket stops a user from spreading
+    a flood across many sockets. Events that run before the caller has
+    proven who they are (registration) are charged to the remote address
+    instead of a user. Events without a configured limit are not limited.
+    """
+
+    SCOPES = ('user', 'connection', 'address')
+
+    def __init__(self, limits, idle_ttl=None, max_keys=100000):
+        """
+        Args:
+            limits (dict): event -> (rate per second, burst)
+            idle_ttl (float): Seconds before an idle bucket is evicted;
+                by default, the time an empty bucket takes to refill
+            max_keys (int): Buckets kept per event and scope
+        """
+        self.limiters = {
+            (event, scope): TokenBucketLimiter(rate, burst, idle_ttl, max_keys)
+            for event, (rate, burst) in limits.items()
+            for scope in self.SCOPES
+        }
+
+    def check(self, event, user_id, connection_id, address=None):
+        """
+        Charge one call of an event to a user, a connection and an address
+
+        Scopes whose key is None are skipped. Each scope is only charged
+        if the ones before it had a token, so a rejected call doesn't also
+        use up the later scopes' quotas.
+
+        Returns:
+            tuple: (None, 0) if allowed, otherwise (scope, retry_after seconds)
+        """
+        for scope, key in (('user', user_id), ('connection', connection_id), ('address', address)):
+            limiter = self.limiters.get((event, scope))
+            if limiter is None or key is None:
+                continue
+            retry_after = limiter.acquire(key)
+            if retry_after:
+                return scope, retry_after
+        return None, 0
+
+    def get_stats(self):
+        stats = {}
+        for (event, scope), limiter in self.limiters.items():
+            stats.setdefault(event, {})[scope] = limiter.get_stats()
+        return stats
+
+def parse_rate_limits(value):
+    """
+    Parse 'send_message=20/40,register_user=0.2/3' into a dict
+
+    Args:
+        value (str): Comma-separated event=rate/burst items; rate is per second
+
+    Returns:
+        dict: event -> (rate, burst)
+    """
+    limits = {}
+    for item in (value or '').split(','):
+        if '=' in item:
+            event, limit = item.split('=', 1)
+            rate, _, burst = limit.partition('/')
+            limits[event.strip()] = (float(rate), float(burst) if burst else max(float(rate), 1.0))
+    return limits
@@ -0,0 +1,131 @@
+from bisect import bisect_left
+from functools import wraps
+import threading
+import time
+
+# Upper bounds in seconds, from 50us to 10s; a final overflow bucket catches the rest
+DEFAULT_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Histogram:
+    """Fixed-bucket latency histogram with count, sum, min and max"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        index = bisect_left(self.buckets, seconds)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total += seconds
+            if self.min is None or seconds < self.min:
+                self.min = seconds
+            if self.max is None or seconds > self.max:
+                self.max = seconds
+
+    def quantile(self, q):
+        """Estimate a quantile as the upper bound of the bucket it falls in"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def state(self):
+        """Get (bucket counts, sum, count) as one consistent copy"""
+        with self._lock:
+            return list(self.counts), self.total, self.count
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'count': self.count,
+                'sum': self.total,
+                'mean': self.total / self.count if self.count else None,
+                'min': self.min,
+                'max': self.max,
+                'p50': self.quantile(0.5),
+                'p90': self.quantile(0.9),
+                'p99': self.quantile(0.99),
+                'buckets': {('+Inf' if i == len(self.buckets) else str(self.buckets[i])): count
+                            for i, count in enumerate(self.counts)}
+            }
+
+class OperationTimings:
+    """
+    Per-operation latency histograms that can be switched on at runtime
+
+    Disabled by default; while disabled, timed functions cost one attribute
+    check per call.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.enabled = False
+        self.buckets = buckets
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def histogram(self, name):
+        histogram = self._histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(name, Histogram(self.buckets))
+        return histogram
+
+    def observe(self, name, seconds):
+        self.histogram(name).observe(seconds)
+
+    def operations(self):
+        return list(self._histograms)
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+
+    def get_stats(self):
+        """Get a snapshot of every operation's histogram, keyed by operation name"""
+        return {
+            'enabled': self.enabled,
+            'operations': {name: histogram.snapshot() for name, histogram in sorted(self._histograms.items())}
+        }
+
+# Shared instance used by the crypto primitives
+timings = OperationTimings()
+
+def timed(name, registry=timings):
+    """
+    Decorator that records each call's duration under `name` while the registry is enabled
+
+    Args:
+        name (str): Operation name, e.g. 'sign_message'
+        registry (OperationTimings): Where to record, defaults to the shared instance
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not registry.enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                registry.observe(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
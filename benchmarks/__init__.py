@@ -0,0 +1,2 @@
+# Benchmarks
+# Performance measurements for the messaging server. Run from the repository root, e.g. python -m benchmarks.bench_envelope
\ No newline at end of file
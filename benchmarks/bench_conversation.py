@@ -0,0 +1,69 @@
+"""
+History fetch cost with millions of stored messages: linear scan versus the conversation index
+
+Usage: python -m benchmarks.bench_conversation [--messages 2000000] [--users 1000]
+"""
+import argparse
+import logging
+import random
+import time
+
+from app.backend.message_handler import MessageHandler
+
+def linear_scan(handler, user_id, recipient_id):
+    """The original get_conversation implementation"""
+    conversation_messages = []
+    for msg in handler.get_logged_messages():
+        if (msg['sender'] == user_id and msg['recipient'] == recipient_id) or \
+           (msg['sender'] == recipient_id and msg['recipient'] == user_id):
+            conversation_messages.append(msg)
+    conversation_messages.sort(key=lambda x: x.get('timestamp', ''))
+    return conversation_messages
+
+def populate(handler, messages, users):
+    rng = random.Random(0)
+    timestamp = handler.get_timestamp()
+    start = time.perf_counter()
+    for i in range(messages):
+        sender, recipient = rng.sample(range(users), 2)
+        handler.log_message({
+            'sender': f"user{sender}",
+            'recipient': f"user{recipient}",
+            'timestamp': timestamp,
+            'message': f"message {i}"
+        })
+    return time.perf_counter() - start
+
+def timed(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    return (time.perf_counter() - start) / repeat * 1000, result
+
+def run(messages, users, page_size, repeat):
+    logging.getLogger('app').setLevel(logging.WARNING)
+    handler = MessageHandler()
+    elapsed = populate(handler, messages, users)
+    print(f"Stored {messages} messages across {users} users in {elapsed:.1f}s")
+
+    scan_ms, scanned = timed(lambda: linear_scan(handler, 'user0', 'user1'), 1)
+    page_ms, (page, has_more) = timed(lambda: handler.get_conversation('user0', 'user1', limit=page_size), repeat)
+    before = page[0]['seq'] if page else None
+    older_ms, _ = timed(lambda: handler.get_conversation('user0', 'user1', before=before, limit=page_size), repeat)
+
+    print(f"Conversation length: {len(scanned)} messages")
+    print(f"Linear scan:              {scan_ms:10.3f} ms")
+    print(f"Indexed latest page:      {page_ms:10.3f} ms ({len(page)} messages, has_more={has_more})")
+    print(f"Indexed page before seq:  {older_ms:10.3f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--messages', type=int, default=2000000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--page-size', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=1000)
+    args = parser.parse_args()
+    run(args.messages, args.users, args.page_size, args.repeat)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""
+Throughput of pure RSA-OAEP encryption versus the hybrid RSA+AES envelope
+
+Usage: python -m benchmarks.bench_envelope [--key-size 2048] [--iterations 200]
+"""
+import argparse
+import time
+
+from app.crypto.rsa_utils import generate_key_pair, encrypt_message, decrypt_message
+from app.crypto.envelope import encrypt_envelope, decrypt_envelope, max_rsa_payload
+
+def measure(func, iterations):
+    """Return operations per second for calling func repeatedly"""
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    elapsed = time.perf_counter() - start
+    return iterations / elapsed
+
+def run(key_size, iterations, sizes):
+    private_key, public_key = generate_key_pair(key_size)
+    limit = max_rsa_payload(public_key)
+
+    print(f"RSA-{key_size}, {iterations} iterations, pure RSA limit {limit} bytes")
+    print(f"{'size':>10} {'rsa enc/s':>12} {'rsa dec/s':>12} {'env enc/s':>12} {'env dec/s':>12} {'env MB/s':>10}")
+
+    for size in sizes:
+        message = 'x' * size
+        if size <= limit:
+            ciphertext = encrypt_message(message, public_key)
+            rsa_enc = f"{measure(lambda: encrypt_message(message, public_key), iterations):12.1f}"
+            rsa_dec = f"{measure(lambda: decrypt_message(ciphertext, private_key), iterations):12.1f}"
+        else:
+            rsa_enc = rsa_dec = f"{'n/a':>12}"
+
+        envelope = encrypt_envelope(message, public_key)
+        env_enc = measure(lambda: encrypt_envelope(message, public_key), iterations)
+        env_dec = measure(lambda: decrypt_envelope(envelope, private_key), iterations)
+
+        print(f"{size:>10} {rsa_enc} {rsa_dec} {env_enc:12.1f} {env_dec:12.1f} {env_enc * size / 1e6:10.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--key-size', type=int, default=2048)
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[32, 128, 190, 1024, 64 * 1024, 1024 * 1024])
+    args = parser.parse_args()
+    run(args.key_size, args.iterations, args.sizes)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+Message-path latency with logging off, synchronous, and queued through a background writer
+
+Runs the server's per-message work (sign, encrypt, store) with each
+logging configuration and reports per-message latency percentiles. Logs
+go to a temporary directory and console output to /dev/null, so the
+numbers reflect the cost of writing logs rather than of a terminal.
+
+Usage: python -m benchmarks.bench_logging [--messages 2000] [--key-size 2048]
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+from app.backend.message_handler import MessageHandler
+from app.crypto.rsa_utils import generate_key_pair, sign_message, encrypt_message
+from app.utils.logger import setup_logger, stop_logger
+from benchmarks.connection_load import percentile
+
+# name -> setup_logger options, or None for logging disabled
+CONFIGURATIONS = [
+    ('off', None),
+    ('sync', {}),
+    ('sync+json', {'json_lines': True}),
+    ('queue', {'use_queue': True}),
+    ('queue+json', {'use_queue': True, 'json_lines': True}),
+    ('queue+sampled', {'use_queue': True, 'sample_rates': {'app.crypto': 0.01, 'app.backend': 0.01}}),
+]
+
+def message_path(handler, private_key, public_key, text):
+    """The logging-relevant part of handle_message for an encrypted message"""
+    message = {'sender': 'alice', 'recipient': 'bob', 'message': text, 'encrypted': True}
+    message['signature'] = sign_message(text, private_key)
+    message['encrypted_message'] = encrypt_message(text, public_key)
+    handler.log_message(message)
+
+def run_configuration(options, messages, private_key, public_key, directory):
+    logging.disable(logging.NOTSET)
+    if options is None:
+        logging.disable(logging.CRITICAL)
+    else:
+        setup_logger('app', log_file=os.path.join(directory, 'bench.log'), **options)
+
+    handler = MessageHandler()
+    latencies = []
+    start = time.perf_counter()
+    for i in range(messages):
+        begin = time.perf_counter()
+        message_path(handler, private_key, public_key, f"message {i}")
+        latencies.append((time.perf_counter() - begin) * 1e6)
+    elapsed = time.perf_counter() - start
+
+    # Include the time to drain anything still queued
+    drain_start = time.perf_counter()
+    stop_logger('app')
+    drain = time.perf_counter() - drain_start
+    for existing in logging.getLogger('app').handlers[:]:
+        logging.getLogger('app').removeHandler(existing)
+        existing.close()
+
+    return {
+        'messages_per_sec': messages / elapsed,
+        'p50_us': percentile(latencies, 50),
+        'p99_us': percentile(latencies, 99),
+        'max_us': max(latencies),
+        'drain_ms': drain * 1000
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--key-size', type=int, default=2048)
+    parser.add_argument('--output', help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    private_key, public_key = generate_key_pair(args.key_size)
+    out = sys.stdout
+    results = {}
+    with tempfile.TemporaryDirectory() as directory, open(os.devnull, 'w') as devnull:
+        for name, options in CONFIGURATIONS:
+            # The console handler binds sys.stdout when it is created
+            sys.stdout = devnull
+            try:
+                results[name] = run_configuration(options, args.messages, private_key, public_key, directory)
+            finally:
+                sys.stdout = out
+            result = results[name]
+            print(f"{name:<14} {result['messages_per_sec']:>10.1f} msg/s  p50 {result['p50_us']:>9.1f} us  "
+                  f"p99 {result['p99_us']:>9.1f} us  max {result['max_us']:>10.1f} us  drain {result['drain_ms']:.1f} ms")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
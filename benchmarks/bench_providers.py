@@ -0,0 +1,97 @@
+"""
+Benchmark matrix across crypto providers and key sizes
+
+Times key generation, signing, verification, encryption, decryption and
+(for the curve provider) key agreement for every provider in
+app.crypto.providers. The RSA providers run at each key size; Ed25519/X25519
+has a single size and runs once. Statistics are computed as in bench_rsa.
+
+Usage:
+    python -m benchmarks.bench_providers --output providers.json
+    python -m benchmarks.bench_providers --providers rsa rsa-openssl --key-sizes 2048 3072
+"""
+import argparse
+import json
+import logging
+import platform
+
+import Crypto
+
+from app.crypto.providers import PROVIDERS, get_provider
+from benchmarks.bench_rsa import bench
+
+def operations(provider, message, iterations, warmup, keygen_iterations):
+    """(name, func, calls per repeat, warmup calls) for each operation the provider supports"""
+    private_key, public_key = provider.generate_key_pair()
+    peer_private_key, peer_public_key = provider.generate_key_pair()
+    signature = provider.sign(message, private_key)
+    ciphertext = provider.encrypt(message, public_key)
+
+    result = [
+        ('generate_key_pair', provider.generate_key_pair, keygen_iterations, 0),
+        ('sign', lambda: provider.sign(message, private_key), iterations, warmup),
+        ('verify', lambda: provider.verify(message, signature, public_key), iterations, warmup),
+        ('encrypt', lambda: provider.encrypt(message, public_key), iterations, warmup),
+        ('decrypt', lambda: provider.decrypt(ciphertext, private_key), iterations, warmup),
+    ]
+    try:
+        provider.key_agreement(private_key, peer_public_key)
+    except NotImplementedError:
+        pass
+    else:
+        result.append(('key_agreement', lambda: provider.key_agreement(private_key, peer_public_key),
+                       iterations, warmup))
+    return result
+
+def run(provider_names, key_sizes, iterations, repeats, warmup, keygen_iterations, message_size):
+    message = b'x' * message_size
+    results = []
+    for name in provider_names:
+        for key_size in (key_sizes if name.startswith('rsa') else [None]):
+            provider = get_provider(name, key_size)
+            label = f"{name}-{key_size}" if key_size else name
+            # Key generation for large RSA keys is slow enough to need its own call count
+            for operation, func, count, warm in operations(provider, message, iterations, warmup,
+                                                           keygen_iterations if key_size else iterations):
+                result = bench(func, count, repeats, warm)
+                result.update(provider=name, key_size=provider.key_size, operation=operation)
+                results.append(result)
+                print(f"{label:<17} {operation:<18} {result['median_us']:>12.1f} us "
+                      f"(min {result['min_us']:.1f}, stdev {result['stdev_us']:.1f}) {result['ops_per_sec']:>10.1f} ops/s")
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--providers', nargs='+', choices=list(PROVIDERS), default=list(PROVIDERS))
+    parser.add_argument('--key-sizes', type=int, nargs='+', default=[2048, 3072, 4096],
+                        help="RSA key sizes; the curve provider has a fixed size")
+    parser.add_argument('--iterations', type=int, default=50, help="Calls per repeat")
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--keygen-iterations', type=int, default=3,
+                        help="Calls per repeat for RSA key generation, which is much slower")
+    parser.add_argument('--message-size', type=int, default=64)
+    parser.add_argument('--output', help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    results = run(args.providers, args.key_sizes, args.iterations, args.repeats, args.warmup,
+                  args.keygen_iterations, args.message_size)
+    if args.output:
+        try:
+            import cryptography
+            cryptography_version = cryptography.__version__
+        except ImportError:
+            cryptography_version = None
+        with open(args.output, 'w') as f:
+            json.dump({
+                'python': platform.python_version(),
+                'pycryptodome': Crypto.__version__,
+                'cryptography': cryptography_version,
+                'machine': platform.machine(),
+                'message_size': args.message_size,
+                'results': results
+            }, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+Microbenchmarks for the rsa_utils primitives
+
+Times key generation at each key size plus signing, verification,
+encryption, decryption and certificate generation/verification. Each
+operation gets warmup calls and then several repeats of a batch of calls;
+the reported per-call times come from the per-repeat means, so one noisy
+repeat doesn't skew the result. Logging is silenced unless --with-logging
+is given, so the numbers show the cryptography on its own.
+
+Usage:
+    python -m benchmarks.bench_rsa --output rsa.json
+    python -m benchmarks.bench_rsa --key-sizes 2048 --repeats 7 --iterations 100
+"""
+import argparse
+import json
+import logging
+import platform
+import statistics
+import time
+
+import Crypto
+
+from app.crypto.rsa_utils import (generate_key_pair, sign_message, verify_signature, encrypt_message,
+                                  decrypt_message, generate_certificate, verify_certificate)
+
+def bench(func, iterations, repeats, warmup):
+    """
+    Time func over `repeats` batches of `iterations` calls
+
+    Returns:
+        dict: Per-call statistics in microseconds plus operations per second
+    """
+    for _ in range(warmup):
+        func()
+    per_call = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            func()
+        per_call.append((time.perf_counter() - start) / iterations * 1e6)
+    median = statistics.median(per_call)
+    return {
+        'iterations': iterations,
+        'repeats': repeats,
+        'median_us': median,
+        'min_us': min(per_call),
+        'max_us': max(per_call),
+        'stdev_us': statistics.stdev(per_call) if len(per_call) > 1 else 0.0,
+        'ops_per_sec': 1e6 / median
+    }
+
+def run(key_sizes, iterations, repeats, warmup, keygen_iterations, message_size):
+    message = 'x' * message_size
+    results = []
+    for key_size in key_sizes:
+        private_key, public_key = generate_key_pair(key_size)
+        ca_private_key, ca_public_key = generate_key_pair(key_size)
+        signature = sign_message(message, private_key)
+        ciphertext = encrypt_message(message, public_key)
+        certificate = generate_certificate('bench_user', public_key, ca_private_key)
+
+        operations = [
+            ('generate_key_pair', lambda: generate_key_pair(key_size), keygen_iterations, 0),
+            ('sign_message', lambda: sign_message(message, private_key), iterations, warmup),
+            ('verify_signature', lambda: verify_signature(message, signature, public_key), iterations, warmup),
+            ('encrypt_message', lambda: encrypt_message(message, public_key), iterations, warmup),
+            ('decrypt_message', lambda: decrypt_message(ciphertext, private_key), iterations, warmup),
+            ('generate_certificate', lambda: generate_certificate('bench_user', public_key, ca_private_key),
+             iterations, warmup),
+            ('verify_certificate', lambda: verify_certificate(certificate, ca_public_key), iterations, warmup),
+        ]
+        for name, func, count, warm in operations:
+            result = bench(func, count, repeats, warm)
+            result.update(operation=name, key_size=key_size)
+            results.append(result)
+            print(f"RSA-{key_size:<5} {name:<22} {result['median_us']:>12.1f} us "
+                  f"(min {result['min_us']:.1f}, stdev {result['stdev_us']:.1f}) {result['ops_per_sec']:>10.1f} ops/s")
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--key-sizes', type=int, nargs='+', default=[1024, 2048, 3072, 4096])
+    parser.add_argument('--iterations', type=int, default=50, help="Calls per repeat")
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--keygen-iterations', type=int, default=3,
+                        help="Calls per repeat for key generation, which is much slower")
+    parser.add_argument('--message-size', type=int, default=64)
+    parser.add_argument('--with-logging', action='store_true', help="Keep the per-call INFO logging enabled")
+    parser.add_argument('--output', help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    if args.with_logging:
+        logging.basicConfig(level=logging.INFO, handlers=[logging.NullHandler()])
+    else:
+        logging.disable(logging.CRITICAL)
+
+    results = run(args.key_sizes, args.iterations, args.repeats, args.warmup,
+                  args.keygen_iterations, args.message_size)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'python': platform.python_version(),
+                'pycryptodome': Crypto.__version__,
+                'machine': platform.machine(),
+                'message_size': args.message_size,
+                'with_logging': args.with_logging,
+                'results': results
+            }, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""
+Bytes per message and serialization time of JSON dicts versus the binary wire format
+
+Builds the new_message payloads the server sends (plain, RSA-encrypted,
+envelope, session and group messages) and measures each one as a JSON
+dict, in the binary format, and in the binary format with zlib. Sizes
+are of the Socket.IO packets that go on the wire, including the
+placeholder packet that precedes a binary attachment. Times are for
+json.dumps/json.loads against encode_message/decode_message.
+
+Usage:
+    python -m benchmarks.bench_wire
+    python -m benchmarks.bench_wire --text-size 4096 --output wire.json
+"""
+import argparse
+import base64
+import hashlib
+import json
+import logging
+
+from socketio import packet
+
+from app.backend.message_handler import MessageHandler
+from app.backend.wire import encode_message, decode_message
+from app.crypto.envelope import encrypt_envelope
+from app.crypto.group_keys import encrypt_group_message
+from app.crypto.rsa_utils import generate_key_pair, sign_message, encrypt_message
+from app.crypto.session_cache import SessionKeyCache
+from benchmarks.bench_rsa import bench
+
+def packet_size(payload):
+    """Bytes of the Socket.IO packet(s) that carry a new_message event"""
+    encoded = packet.Packet(packet.EVENT, data=['new_message', payload]).encode()
+    parts = encoded if isinstance(encoded, list) else [encoded]
+    return sum(len(part.encode('utf-8') if isinstance(part, str) else part) for part in parts)
+
+def build_messages(text_size):
+    """(name, message dict) for each kind of message the server emits"""
+    handler = MessageHandler()
+    sender_private, sender_public = generate_key_pair()
+    recipient_private, recipient_public = generate_key_pair()
+    short_text = 'Meet at the usual place at 7pm'
+    long_text = ('The quarterly numbers are in and they look good. ' * (text_size // 50 + 1))[:text_size]
+
+    def base(text, **fields):
+        message = {
+            'sender': 'alice',
+            'recipient': 'bob',
+            'timestamp': handler.get_timestamp(),
+            'message': text,
+            'encrypted': bool(fields),
+            'certificate_fingerprint': hashlib.sha256(b'certificate').hexdigest(),
+            'hash': hashlib.sha256(text.encode()).hexdigest(),
+            'id': handler.generate_message_id(),
+            'seq': 123456
+        }
+        message.update(fields)
+        return message
+
+    def signature(text):
+        return base64.b64encode(sign_message(text, sender_private)).decode('utf-8')
+
+    sessions = SessionKeyCache()
+    first_session = sessions.encrypt('alice', 'bob', short_text, sender_private, recipient_public)
+    session = sessions.encrypt('alice', 'bob', short_text, sender_private, recipient_public)
+    group = encrypt_group_message(short_text, 'g1', 3, 'ab' * 8, b'k' * 32, 'alice')
+
+    return [
+        ('plain', base(short_text)),
+        ('plain-long', base(long_text)),
+        ('rsa', base(short_text, signature=signature(short_text),
+                     encrypted_message=base64.b64encode(encrypt_message(short_text, recipient_public)).decode('utf-8'))),
+        ('envelope-long', base(long_text, signature=signature(long_text),
+                               envelope=encrypt_envelope(long_text, recipient_public))),
+        ('session-setup', base(short_text, session=first_session)),
+        ('session', base(short_text, session=session)),
+        ('group', dict(base(short_text, signature=signature(short_text), group=group), recipient=None)),
+    ]
+
+def run(text_size, iterations, repeats, warmup, min_bytes):
+    results = []
+    print(f"{'message':<14} {'json B':>8} {'bin B':>8} {'bin+z B':>8} {'saved':>7} "
+          f"{'json enc':>9} {'bin enc':>9} {'json dec':>9} {'bin dec':>9}  (us)")
+    for name, message in build_messages(text_size):
+        binary = encode_message(message)
+        compressed = encode_message(message, 'zlib', min_bytes)
+        assert decode_message(binary) == message and decode_message(compressed) == message
+        encoded_json = json.dumps(message)
+
+        sizes = {
+            'json': packet_size(message),
+            'binary': packet_size(binary),
+            'binary+zlib': packet_size(compressed)
+        }
+        timings = {
+            'json_encode': bench(lambda: json.dumps(message), iterations, repeats, warmup),
+            'json_decode': bench(lambda: json.loads(encoded_json), iterations, repeats, warmup),
+            'binary_encode': bench(lambda: encode_message(message), iterations, repeats, warmup),
+            'binary_decode': bench(lambda: decode_message(binary), iterations, repeats, warmup),
+            'binary_zlib_encode': bench(lambda: encode_message(message, 'zlib', min_bytes), iterations, repeats, warmup),
+            'binary_zlib_decode': bench(lambda: decode_message(compressed), iterations, repeats, warmup),
+        }
+        saved = 1 - min(sizes['binary'], sizes['binary+zlib']) / sizes['json']
+        print(f"{name:<14} {sizes['json']:>8} {sizes['binary']:>8} {sizes['binary+zlib']:>8} {saved:>7.1%} "
+              f"{timings['json_encode']['median_us']:>9.1f} {timings['binary_encode']['median_us']:>9.1f} "
+              f"{timings['json_decode']['median_us']:>9.1f} {timings['binary_decode']['median_us']:>9.1f}")
+        results.append({
+            'message': name,
+            'bytes': sizes,
+            'timings_us': {operation: result['median_us'] for operation, result in timings.items()}
+        })
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--text-size', type=int, default=2048, help="Plaintext size of the long messages")
+    parser.add_argument('--iterations', type=int, default=2000, help="Calls per repeat")
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--warmup', type=int, default=100)
+    parser.add_argument('--compress-min-bytes', type=int, default=1024)
+    parser.add_argument('--output', help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    results = run(args.text_size, args.iterations, args.repeats, args.warmup, args.compress_min_bytes)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'text_size': args.text_size, 'results': results}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
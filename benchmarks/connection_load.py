@@ -0,0 +1,217 @@
+"""
+Connection-count and latency load test for each server concurrency mode
+
+Opens many mostly idle Socket.IO connections, keeps a few users sending
+encrypted messages so the server has RSA work to do, and samples
+round-trip latency of the ping_server event across the idle connections.
+
+Usage:
+    python -m benchmarks.connection_load --modes threading gevent --connections 2000
+    python -m benchmarks.connection_load --url http://localhost:5000 --connections 500
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.request
+
+import socketio
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+def sum_counts(counts):
+    total = {}
+    for count in counts:
+        for key, value in count.items():
+            total[key] = total.get(key, 0) + value
+    return total
+
+def idle_worker(url, count, duration, ping_rate, results):
+    """Hold `count` connections open and ping through them round-robin"""
+    clients = []
+    failed = 0
+    for _ in range(count):
+        client = socketio.Client(reconnection=False)
+        try:
+            client.connect(url, transports=['websocket'])
+            clients.append(client)
+        except Exception:
+            failed += 1
+
+    latencies = []
+    errors = 0
+    interval = 1.0 / ping_rate if ping_rate > 0 else 0
+    deadline = time.monotonic() + duration
+    i = 0
+    while clients and time.monotonic() < deadline:
+        client = clients[i % len(clients)]
+        i += 1
+        start = time.perf_counter()
+        try:
+            client.call('ping_server', {'sent': start}, timeout=10)
+            latencies.append((time.perf_counter() - start) * 1000)
+        except Exception:
+            errors += 1
+        if interval:
+            time.sleep(max(0, interval - (time.perf_counter() - start)))
+
+    connected = sum(1 for client in clients if client.connected)
+    for client in clients:
+        try:
+            client.disconnect()
+        except Exception:
+            pass
+    results.put({'connected': connected, 'failed': failed, 'errors': errors, 'latencies': latencies})
+
+def sender_worker(url, senders, duration, results):
+    """
+    Register a few users and keep them sending encrypted messages
+
+    Registrations and sends whose ack carries an error (rate_limited or
+    busy) are counted as failed rather than done, so a limited server
+    can't look fast.
+    """
+    clients = []
+    registration_failures = 0
+    for n in range(senders):
+        client = socketio.Client(reconnection=False)
+        client.connect(url, transports=['websocket'])
+        result = client.call('register_user', {'user_id': f"load_sender_{os.getpid()}_{n}"}, timeout=60)
+        if isinstance(result, dict) and 'error' in result:
+            registration_failures += 1
+        clients.append(client)
+
+    acks = {'ok': 0}
+
+    def on_ack(result=None):
+        outcome = result['error'] if isinstance(result, dict) and 'error' in result else 'ok'
+        acks[outcome] = acks.get(outcome, 0) + 1
+
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        for n, client in enumerate(clients):
+            client.emit('send_message', {
+                'sender': f"load_sender_{os.getpid()}_{n}",
+                'recipient': f"load_sender_{os.getpid()}_{(n + 1) % senders}",
+                'message': 'load test message',
+                'encrypted': True
+            }, callback=on_ack)
+        time.sleep(0.01)
+
+    # Give the last acks a moment to arrive
+    time.sleep(1)
+    for client in clients:
+        client.disconnect()
+    sent = acks.pop('ok')
+    results.put({'sent': sent, 'send_failures': acks, 'registration_failures': registration_failures})
+
+def wait_for_server(url, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f"{url}/api/users", timeout=1)
+            return True
+        except Exception:
+            time.sleep(0.5)
+    return False
+
+def run_load(url, connections, processes, duration, ping_rate, senders):
+    results = multiprocessing.Queue()
+    per_process = [connections // processes + (1 if i < connections % processes else 0)
+                   for i in range(processes)]
+    workers = [multiprocessing.Process(target=idle_worker,
+                                       args=(url, count, duration, ping_rate / processes, results))
+               for count in per_process if count]
+    if senders:
+        workers.append(multiprocessing.Process(target=sender_worker, args=(url, senders, duration, results)))
+    for worker in workers:
+        worker.start()
+
+    collected = [results.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+
+    latencies = [latency for result in collected for latency in result.get('latencies', [])]
+    return {
+        'connections_requested': connections,
+        'connections_established': sum(result.get('connected', 0) for result in collected),
+        'connection_failures': sum(result.get('failed', 0) for result in collected),
+        'ping_errors': sum(result.get('errors', 0) for result in collected),
+        'messages_sent': sum(result.get('sent', 0) for result in collected),
+        'message_failures': sum_counts(result.get('send_failures', {}) for result in collected),
+        'registration_failures': sum(result.get('registration_failures', 0) for result in collected),
+        'pings': len(latencies),
+        'latency_ms': {
+            'p50': percentile(latencies, 50),
+            'p90': percentile(latencies, 90),
+            'p99': percentile(latencies, 99),
+            'max': max(latencies) if latencies else None
+        }
+    }
+
+def start_server(**env):
+    """Start app.py with extra environment variables"""
+    return subprocess.Popen([sys.executable, 'app.py'], env=dict(os.environ, FLASK_DEBUG='0', **env),
+                            start_new_session=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+def stop_server(server):
+    # SIGINT lets the server shut its worker pools down; then clear out anything left in its group
+    server.send_signal(signal.SIGINT)
+    try:
+        server.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        pass
+    try:
+        os.killpg(server.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    server.wait()
+
+def run_mode(mode, args):
+    """Start app.py in the given mode, load it, then stop it"""
+    # Rate limiting would cap the senders at their quota instead of at what the server can do
+    server = start_server(ASYNC_MODE=mode, RATE_LIMIT='0')
+    try:
+        if not wait_for_server(args.url):
+            return {'mode': mode, 'error': 'server did not start'}
+        result = run_load(args.url, args.connections, args.processes, args.duration, args.ping_rate, args.senders)
+        result['mode'] = mode
+        return result
+    finally:
+        stop_server(server)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--url', default='http://localhost:5000')
+    parser.add_argument('--modes', nargs='*', default=[],
+                        help="Start app.py in each of these ASYNC_MODEs in turn; otherwise load --url as is")
+    parser.add_argument('--connections', type=int, default=1000)
+    parser.add_argument('--processes', type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--ping-rate', type=float, default=200, help="Total pings per second")
+    parser.add_argument('--senders', type=int, default=4, help="Users sending encrypted messages")
+    parser.add_argument('--output', help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    if args.modes:
+        results = [run_mode(mode, args) for mode in args.modes]
+    else:
+        results = [run_load(args.url, args.connections, args.processes, args.duration, args.ping_rate, args.senders)]
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    print(output)
+
+if __name__ == '__main__':
+    main()
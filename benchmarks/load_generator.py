@@ -0,0 +1,303 @@
+"""
+End-to-end load generator and latency benchmark for the Socket.IO server
+
+Spawns simulated users that register and then exchange encrypted and
+unencrypted messages at a target rate. Records registration latency,
+delivery latency percentiles, throughput, and server CPU/RSS sampled from
+/api/stats. Results are written as JSON so runs can be compared.
+
+Every simulated user registers from this machine's address, and the
+server allows a burst of 10 registrations per address, so start the
+server with RATE_LIMIT=0 (or a register_user burst of at least --users).
+Calls refused with rate_limited or busy are counted as failures by reason.
+
+Usage:
+    RATE_LIMIT=0 python app.py &
+    python -m benchmarks.load_generator --users 50 --rate 100 --duration 30 --output run.json
+    python -m benchmarks.load_generator --users 50 --rate 100 --baseline run.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import threading
+import time
+import urllib.request
+import uuid
+
+import socketio
+
+from benchmarks.connection_load import percentile, sum_counts
+
+def summarize(values):
+    """Percentile summary of a list of millisecond latencies"""
+    return {
+        'count': len(values),
+        'mean': sum(values) / len(values) if values else None,
+        'p50': percentile(values, 50),
+        'p90': percentile(values, 90),
+        'p99': percentile(values, 99),
+        'max': max(values) if values else None
+    }
+
+class SimulatedUser:
+    """One socketio.Client that registers and records messages delivered to it"""
+
+    def __init__(self, url, user_id):
+        self.user_id = user_id
+        self.client = socketio.Client(reconnection=False)
+        self.delivery_latencies = {'encrypted': [], 'plain': []}
+        self.send_failures = {}
+        self.client.on('new_message', self.on_new_message)
+        self.client.connect(url, transports=['websocket'])
+
+    def register(self, timeout=60):
+        """
+        Register and return (latency in ms, error)
+
+        The ack comes after the keys have been sent, so its round trip is
+        the registration latency. A refused registration returns the error
+        from its ack, such as rate_limited or busy, and no latency.
+        """
+        start = time.perf_counter()
+        result = self.client.call('register_user', {'user_id': self.user_id}, timeout=timeout)
+        if isinstance(result, dict) and 'error' in result:
+            return None, result['error']
+        return (time.perf_counter() - start) * 1000, None
+
+    def on_new_message(self, data):
+        # Ignore the sender's own confirmation copy
+        if data.get('recipient') != self.user_id or data.get('sender') == self.user_id:
+            return
+        try:
+            sent_at = float(data['message'].split('|', 1)[0])
+        except (KeyError, ValueError):
+            return
+        kind = 'encrypted' if data.get('encrypted') else 'plain'
+        self.delivery_latencies[kind].append((time.time() - sent_at) * 1000)
+
+    def send(self, recipient, encrypted, size):
+        text = f"{time.time():.6f}|"
+        self.client.emit('send_message', {
+            'sender': self.user_id,
+            'recipient': recipient,
+            'message': text + 'x' * max(0, size - len(text)),
+            'encrypted': encrypted
+        }, callback=self.on_send_ack)
+
+    def on_send_ack(self, result=None):
+        if isinstance(result, dict) and 'error' in result:
+            self.send_failures[result['error']] = self.send_failures.get(result['error'], 0) + 1
+
+def user_worker(url, user_ids, all_user_ids, start_barrier, rate, duration, encrypted_ratio,
+                message_size, results):
+    """Run a share of the simulated users in one process"""
+    users = []
+    registration = []
+    registration_failures = {}
+    failures = 0
+    for user_id in user_ids:
+        try:
+            user = SimulatedUser(url, user_id)
+            latency, error = user.register()
+            if error is not None:
+                failures += 1
+                registration_failures[error] = registration_failures.get(error, 0) + 1
+                user.client.disconnect()
+            else:
+                registration.append(latency)
+                users.append(user)
+        except Exception:
+            failures += 1
+
+    # Everyone must be registered before messages start flowing
+    start_barrier.wait()
+
+    rng = random.Random(os.getpid())
+    sent = {'encrypted': 0, 'plain': 0}
+    interval = 1.0 / rate if rate > 0 else 0
+    next_send = time.perf_counter()
+    deadline = time.monotonic() + duration
+    while users and time.monotonic() < deadline:
+        sender = rng.choice(users)
+        recipient = rng.choice(all_user_ids)
+        if recipient == sender.user_id:
+            continue
+        encrypted = rng.random() < encrypted_ratio
+        try:
+            sender.send(recipient, encrypted, message_size)
+            sent['encrypted' if encrypted else 'plain'] += 1
+        except Exception:
+            failures += 1
+        next_send += interval
+        time.sleep(max(0, next_send - time.perf_counter()))
+
+    # Give in-flight deliveries time to arrive
+    time.sleep(2)
+    delivery = {'encrypted': [], 'plain': []}
+    for user in users:
+        for kind in delivery:
+            delivery[kind].extend(user.delivery_latencies[kind])
+        try:
+            user.client.disconnect()
+        except Exception:
+            pass
+
+    results.put({'registration': registration, 'delivery': delivery, 'sent': sent, 'failures': failures,
+                 'registration_failures': registration_failures,
+                 'send_failures': sum_counts(user.send_failures for user in users)})
+
+def fetch_server_stats(url):
+    try:
+        with urllib.request.urlopen(f"{url}/api/stats", timeout=5) as response:
+            return json.loads(response.read())['process']
+    except Exception:
+        return None
+
+class ServerSampler(threading.Thread):
+    """Polls the server's process stats to derive CPU utilization and RSS"""
+
+    def __init__(self, url, interval=1.0):
+        super().__init__(daemon=True)
+        self.url = url
+        self.interval = interval
+        self.samples = []
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            sample = fetch_server_stats(self.url)
+            if sample is not None:
+                self.samples.append(sample)
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def summary(self):
+        if len(self.samples) < 2:
+            return None
+        first, last = self.samples[0], self.samples[-1]
+        wall = last['sampled_at'] - first['sampled_at']
+        rss = [sample['rss_bytes'] for sample in self.samples if sample['rss_bytes'] is not None]
+        return {
+            'cpu_percent': (last['cpu_seconds'] - first['cpu_seconds']) / wall * 100 if wall > 0 else None,
+            'rss_bytes_max': max(rss) if rss else None,
+            'rss_bytes_mean': sum(rss) / len(rss) if rss else None,
+            'samples': len(self.samples)
+        }
+
+def run(args):
+    run_id = uuid.uuid4().hex[:8]
+    user_ids = [f"bench_{run_id}_{i}" for i in range(args.users)]
+    processes = max(1, min(args.processes, args.users))
+    shares = [user_ids[i::processes] for i in range(processes)]
+
+    results = multiprocessing.Queue()
+    barrier = multiprocessing.Barrier(processes)
+    workers = [multiprocessing.Process(target=user_worker,
+                                       args=(args.url, share, user_ids, barrier, args.rate / processes,
+                                             args.duration, args.encrypted_ratio, args.message_size, results))
+               for share in shares]
+
+    started = time.time()
+    for worker in workers:
+        worker.start()
+    # Start sampling only after forking so no child inherits a thread mid-request
+    sampler = ServerSampler(args.url)
+    sampler.start()
+    collected = [results.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+    sampler.stop()
+
+    registration = [latency for result in collected for latency in result['registration']]
+    delivery = {kind: [latency for result in collected for latency in result['delivery'][kind]]
+                for kind in ('encrypted', 'plain')}
+    sent = {kind: sum(result['sent'][kind] for result in collected) for kind in ('encrypted', 'plain')}
+    delivered = sum(len(latencies) for latencies in delivery.values())
+
+    return {
+        'run_id': run_id,
+        'started_at': started,
+        'config': {
+            'url': args.url,
+            'users': args.users,
+            'processes': processes,
+            'rate': args.rate,
+            'duration': args.duration,
+            'encrypted_ratio': args.encrypted_ratio,
+            'message_size': args.message_size
+        },
+        'registration_ms': summarize(registration),
+        'delivery_ms': {kind: summarize(latencies) for kind, latencies in delivery.items()},
+        'messages_sent': sent,
+        'messages_delivered': delivered,
+        'throughput_msgs_per_sec': delivered / args.duration,
+        'failures': sum(result['failures'] for result in collected),
+        'registration_failures': sum_counts(result['registration_failures'] for result in collected),
+        'message_failures': sum_counts(result['send_failures'] for result in collected),
+        'server': sampler.summary()
+    }
+
+# Metrics compared against a baseline run: (path, True if higher is better)
+COMPARED_METRICS = [
+    (('registration_ms', 'p99'), False),
+    (('delivery_ms', 'encrypted', 'p50'), False),
+    (('delivery_ms', 'encrypted', 'p99'), False),
+    (('delivery_ms', 'plain', 'p50'), False),
+    (('delivery_ms', 'plain', 'p99'), False),
+    (('throughput_msgs_per_sec',), True),
+    (('server', 'cpu_percent'), False),
+    (('server', 'rss_bytes_max'), False),
+]
+
+def _lookup(result, path):
+    for key in path:
+        if not isinstance(result, dict):
+            return None
+        result = result.get(key)
+    return result
+
+def compare(result, baseline):
+    """Print how each key metric moved relative to a baseline run"""
+    print(f"{'metric':<32} {'baseline':>14} {'current':>14} {'change':>9}")
+    for path, higher_is_better in COMPARED_METRICS:
+        old, new = _lookup(baseline, path), _lookup(result, path)
+        name = '.'.join(path)
+        if old is None or new is None:
+            print(f"{name:<32} {'n/a':>14} {'n/a':>14}")
+            continue
+        change = (new - old) / old * 100 if old else 0.0
+        regressed = change < 0 if higher_is_better else change > 0
+        flag = ' (regression)' if regressed and abs(change) >= 10 else ''
+        print(f"{name:<32} {old:>14.2f} {new:>14.2f} {change:>8.1f}%{flag}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--url', default='http://localhost:5000')
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--processes', type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    parser.add_argument('--rate', type=float, default=50, help="Total messages per second")
+    parser.add_argument('--duration', type=float, default=30, help="Seconds of message traffic")
+    parser.add_argument('--encrypted-ratio', type=float, default=0.5)
+    parser.add_argument('--message-size', type=int, default=64)
+    parser.add_argument('--output', help="Write results as JSON to this file")
+    parser.add_argument('--baseline', help="Compare against a previous JSON result")
+    args = parser.parse_args()
+
+    result = run(args)
+    output = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    print(output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(result, json.load(f))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+"""
+Stress test for per-user rate limiting: fair sharing while one client abuses the server
+
+Honest users each send encrypted messages at a modest rate over their own
+connection. Meanwhile an abuser floods send_message from several
+connections as fast as the server answers, and a second abuser
+connection floods register_user with fresh user IDs, each of which
+costs an RSA key generation. The same run is done with rate limiting off
+(RATE_LIMIT=0) and on, so the honest users' acceptance and latency can
+be compared between the two.
+
+Usage:
+    python -m benchmarks.rate_limit_stress
+    python -m benchmarks.rate_limit_stress --honest 10 --abuser-connections 8 --duration 20 --output stress.json
+"""
+import argparse
+import json
+import threading
+import time
+import uuid
+
+import socketio
+
+from benchmarks.connection_load import start_server, stop_server, wait_for_server
+from benchmarks.load_generator import summarize
+
+class Tally:
+    """Outcome counts and accepted-call latencies for one kind of client"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.accepted = 0
+        self.rejected = {}
+        self.failed = 0
+        self.latencies = []
+
+    def record(self, result, latency_ms):
+        with self.lock:
+            if isinstance(result, dict) and 'error' in result:
+                self.rejected[result['error']] = self.rejected.get(result['error'], 0) + 1
+            else:
+                self.accepted += 1
+                self.latencies.append(latency_ms)
+
+    def summary(self, duration):
+        attempted = self.accepted + sum(self.rejected.values()) + self.failed
+        return {
+            'attempted': attempted,
+            'accepted': self.accepted,
+            'accepted_per_sec': round(self.accepted / duration, 1),
+            'acceptance': round(self.accepted / attempted, 3) if attempted else None,
+            'rejected': self.rejected,
+            'failed': self.failed,
+            'latency_ms': summarize(self.latencies)
+        }
+
+def connect(url):
+    client = socketio.Client(reconnection=False)
+    client.connect(url, transports=['websocket'])
+    return client
+
+def register(client, user_id):
+    result = client.call('register_user', {'user_id': user_id}, timeout=60)
+    if isinstance(result, dict) and 'error' in result:
+        raise RuntimeError(f"Could not register {user_id} before the run: {result}")
+
+def call_loop(client, event, make_payload, tally, deadline, interval=0):
+    """Call an event until the deadline, pacing calls `interval` seconds apart"""
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        try:
+            result = client.call(event, make_payload(), timeout=30)
+            tally.record(result, (time.perf_counter() - start) * 1000)
+        except Exception:
+            with tally.lock:
+                tally.failed += 1
+        if interval:
+            time.sleep(max(0, interval - (time.perf_counter() - start)))
+
+def run_scenario(url, honest, honest_rate, abuser_connections, duration):
+    tallies = {'honest': Tally(), 'abuser_messages': Tally(), 'abuser_registrations': Tally()}
+    clients = []
+    threads = []
+    deadline = time.monotonic() + 2 + duration
+
+    # Honest users, one connection each, registered before the abuse starts
+    honest_ids = [f"honest_{n}_{uuid.uuid4().hex[:6]}" for n in range(honest)]
+    for n, user_id in enumerate(honest_ids):
+        client = connect(url)
+        register(client, user_id)
+        clients.append(client)
+        payload = {'sender': user_id, 'recipient': honest_ids[(n + 1) % honest],
+                   'message': 'hello from an honest user', 'encrypted': True}
+        threads.append(threading.Thread(target=call_loop, args=(client, 'send_message', lambda p=payload: p,
+                                                                 tallies['honest'], deadline, 1 / honest_rate)))
+
+    # The abuser: one registered user flooding messages from several sockets...
+    abuser_id = f"abuser_{uuid.uuid4().hex[:6]}"
+    abuser_payload = {'sender': abuser_id, 'recipient': honest_ids[0], 'message': 'spam', 'encrypted': True}
+    for _ in range(abuser_connections):
+        client = connect(url)
+        register(client, abuser_id)
+        clients.append(client)
+        threads.append(threading.Thread(target=call_loop, args=(client, 'send_message', lambda: abuser_payload,
+                                                                 tallies['abuser_messages'], deadline)))
+
+    # ...and one socket asking for a new key pair under a new name on every call
+    client = connect(url)
+    clients.append(client)
+    threads.append(threading.Thread(target=call_loop, args=(
+        client, 'register_user', lambda: {'user_id': f"sybil_{uuid.uuid4().hex[:8]}"},
+        tallies['abuser_registrations'], deadline)))
+
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for client in clients:
+        try:
+            client.disconnect()
+        except Exception:
+            pass
+    return {name: tally.summary(duration + 2) for name, tally in tallies.items()}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--url', default='http://localhost:5000')
+    parser.add_argument('--honest', type=int, default=5, help="Honest users")
+    parser.add_argument('--honest-rate', type=float, default=2, help="Messages per second per honest user")
+    parser.add_argument('--abuser-connections', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=15)
+    parser.add_argument('--output', help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    # Every client registers from this host's address, so the address bucket must fit the setup
+    setup_registrations = args.honest + args.abuser_connections
+    results = {}
+    for label, rate_limit in (('unlimited', '0'), ('rate_limited', '1')):
+        server = start_server(RATE_LIMIT=rate_limit, KEY_POOL_WORKERS='1',
+                              RATE_LIMITS=f"register_user=0.5/{setup_registrations + 10}")
+        try:
+            if not wait_for_server(args.url):
+                results[label] = {'error': 'server did not start'}
+                continue
+            results[label] = run_scenario(args.url, args.honest, args.honest_rate, args.abuser_connections,
+                                          args.duration)
+        finally:
+            stop_server(server)
+        for name, summary in results[label].items():
+            latency = summary['latency_ms']
+            print(f"{label:<13} {name:<21} accepted {summary['accepted']:>6} of {summary['attempted']:>6} "
+                  f"({summary['accepted_per_sec']:>7.1f}/s)  p50 {latency['p50'] or 0:>8.1f} ms  "
+                  f"p99 {latency['p99'] or 0:>8.1f} ms")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
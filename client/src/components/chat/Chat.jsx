@@ -1,11 +1,18 @@
-import { useState, useEffect, useRef } from 'react';
-import socket from '../../services/socket';
+import { useState, useEffect, useRef, useMemo } from 'react';
+import socket, { onOfflineMessages } from '../../services/socket';
 import { checkMessageIntegrity, processMessageForDisplay } from '../../utils/crypto';
 import { RiLockLine, RiLockUnlockLine, RiAlertLine, RiSendPlane2Fill } from 'react-icons/ri';
 import './Chat.css'; // Import the new CSS file
 
+// History is fetched newest page first, then older pages until none remain; this is the
+// server's largest page (MAX_HISTORY_PAGE_SIZE), so long conversations take few round trips
+const HISTORY_PAGE_SIZE = 500;
+
 const Chat = ({ currentUser, selectedUser, userKeys }) => {
   const [messages, setMessages] = useState([]);
+  // Messages delivered while we were offline, for every conversation; kept so they show up
+  // whichever conversation is opened, even after the server has dropped them from its queue
+  const [offlineMessages, setOfflineMessages] = useState([]);
   const [messageInput, setMessageInput] = useState('');
   const [isEncrypted, setIsEncrypted] = useState(true);
   const [isTyping, setIsTyping] = useState(false);
@@ -16,12 +23,30 @@ const Chat = ({ currentUser, selectedUser, userKeys }) => {
   // Animation state for user change
   const [fadeIn, setFadeIn] = useState(false);
 
+  useEffect(() => {
+    // Offline chunks are acknowledged once they are in our state
+    return onOfflineMessages((chunk) => {
+      setOfflineMessages(prev => [...prev, ...chunk.map(processMessageForDisplay)]);
+    });
+  }, [currentUser]);
+
+  // The open conversation plus any offline messages of it that history didn't include
+  const displayedMessages = useMemo(() => {
+    const shown = new Set(messages.map(msg => msg.id).filter(Boolean));
+    const missing = offlineMessages.filter(msg =>
+      ((msg.sender === selectedUser && msg.recipient === currentUser) ||
+       (msg.sender === currentUser && msg.recipient === selectedUser)) &&
+      !shown.has(msg.id));
+    if (!missing.length) return messages;
+    return [...messages, ...missing].sort((a, b) => (a.seq ?? Infinity) - (b.seq ?? Infinity));
+  }, [messages, offlineMessages, selectedUser, currentUser]);
+
   useEffect(() => {
     // Scroll to bottom when messages change
     if (messagesContainerRef.current) {
       messagesContainerRef.current.scrollTop = messagesContainerRef.current.scrollHeight;
     }
-  }, [messages]);
+  }, [displayedMessages]);
   useEffect(() => {
     // Reset messages when selected user changes
     setMessages([]);
@@ -35,7 +60,8 @@ const Chat = ({ currentUser, selectedUser, userKeys }) => {
     // Fetch conversation history
     socket.emit('get_conversation', {
       user_id: currentUser,
-      recipient_id: selectedUser
+      recipient_id: selectedUser,
+      limit: HISTORY_PAGE_SIZE
     });
     
     return () => clearTimeout(timer);
@@ -55,21 +81,33 @@ const Chat = ({ currentUser, selectedUser, userKeys }) => {
       if (data.conversation_with === selectedUser) {
         // Convert backend message format to frontend format
         const messagesForDisplay = (data.messages || []).map(msg => ({
+          id: msg.id,
+          seq: msg.seq,
           sender: msg.sender,
           recipient: msg.recipient,
           content: msg.message || msg.encrypted_message,
           timestamp: msg.timestamp,
           encrypted: msg.encrypted
         }));
-        setMessages(messagesForDisplay);
+        if (data.before == null) {
+          setMessages(messagesForDisplay);
+        } else {
+          // An older page goes in front of what we already have
+          setMessages(prevMessages => {
+            const shown = new Set(prevMessages.map(msg => msg.id));
+            return [...messagesForDisplay.filter(msg => !shown.has(msg.id)), ...prevMessages];
+          });
+        }
+        if (data.has_more && messagesForDisplay.length) {
+          socket.emit('get_conversation', {
+            user_id: currentUser,
+            recipient_id: selectedUser,
+            before: messagesForDisplay[0].seq,
+            limit: HISTORY_PAGE_SIZE
+          });
+        }
       }
-    };    // Request conversation history when changing selected user
-    if (selectedUser) {
-      socket.emit('get_conversation', {
-        user_id: currentUser,
-        recipient_id: selectedUser
-      });
-    }
+    };
 
     socket.on('new_message', handleIncomingMessage);
     socket.on('conversation_history', handleConversationHistory);
@@ -169,9 +207,9 @@ const Chat = ({ currentUser, selectedUser, userKeys }) => {
             ref={messagesContainerRef}
         >
             {selectedUser ? (
-                messages.length > 0 ? (
+                displayedMessages.length > 0 ? (
                     <div className="space-y-2">
-                        {messages.map((msg, index) => {
+                        {displayedMessages.map((msg, index) => {
                             const isOwnMessage = msg.sender === currentUser;
                             const isIntegrityValid = checkMessageIntegrity(msg);
                             
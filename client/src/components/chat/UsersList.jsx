@@ -4,24 +4,85 @@ import { RiCheckLine, RiUserLine, RiSearchLine } from 'react-icons/ri';
 
 
 const UsersList = ({ currentUser, selectedUser, onSelectUser, verifiedUsers }) => {
-    const [users, setUsers] = useState([]);    useEffect(() => {
-        // Listen for user list updates
-        const handleUserListUpdate = (data) => {
-            setUsers(data.users);
+    const [users, setUsers] = useState([]);
+    const [onlineUsers, setOnlineUsers] = useState(new Set());
+
+    useEffect(() => {
+        // Directory version the current list reflects; null while a full fetch is in flight
+        let version = null;
+        let queued = [];
+        // Bumped by every fetch (and on unmount) so an outdated fetch drops its result
+        let fetchId = 0;
+
+        const applyDelta = (delta) => {
+            if (delta.added.length) {
+                setUsers(prev => [...new Set([...prev, ...delta.added])].sort());
+            }
+            setOnlineUsers(prev => {
+                const next = new Set(prev);
+                delta.joined.forEach(user => next.add(user));
+                delta.left.forEach(user => next.delete(user));
+                return next;
+            });
+        };
+
+        // Deltas are applied in version order; a skipped version means one was missed, so start over
+        const handleUserListDelta = (delta) => {
+            if (version === null) {
+                queued.push(delta);
+            } else if (delta.version === version + 1) {
+                applyDelta(delta);
+                version = delta.version;
+            } else if (delta.version > version + 1) {
+                queued.push(delta);
+                refetch();
+            }
         };
 
-        socket.on('user_list_updated', handleUserListUpdate);
+        // Fetch the whole directory page by page, then apply the deltas that arrived meanwhile
+        const fetchDirectory = async () => {
+            const id = ++fetchId;
+            version = null;
+            let cursor = null;
+            let firstVersion = null;
+            const allUsers = [];
+            const online = new Set();
+            do {
+                const page = await socket.emitWithAck('get_user_directory', { cursor, limit: 500 });
+                if (id !== fetchId) return;
+                if (page.error) throw new Error(page.error);
+                if (firstVersion === null) firstVersion = page.version;
+                allUsers.push(...page.users);
+                page.online.forEach(user => online.add(user));
+                cursor = page.next_cursor;
+            } while (cursor);
+            version = firstVersion;
+            setUsers(allUsers);
+            setOnlineUsers(online);
+            const pending = queued.sort((a, b) => a.version - b.version);
+            queued = [];
+            pending.forEach(handleUserListDelta);
+        };
+
+        const refetch = () => {
+            fetchDirectory().catch(error => console.error('Error fetching users:', error));
+        };
 
-        // Fetch initial user list
-        fetch('http://localhost:5000/api/users')
-            .then(response => response.json())
-            .then(data => setUsers(data.users))
-            .catch(error => console.error('Error fetching users:', error));
+        socket.on('user_list_delta', handleUserListDelta);
+        // Deltas sent while the socket was down are lost, so every (re)connect starts over
+        socket.on('connect', refetch);
+        if (socket.connected) {
+            refetch();
+        }
 
         return () => {
-            socket.off('user_list_updated', handleUserListUpdate);
+            fetchId++;
+            socket.off('user_list_delta', handleUserListDelta);
+            socket.off('connect', refetch);
         };
-    }, []);return (
+    }, []);
+
+    return (
         <div className="h-full flex flex-col">
             <div className="p-2 md:p-3 border-b border-[#232E3C]">
                 <div className="relative">
@@ -60,7 +121,7 @@ const UsersList = ({ currentUser, selectedUser, onSelectUser, verifiedUsers }) =
                                         </span>
                                     )}
                                 </div>
-                                <p className="text-xs md:text-sm text-[#6C7883] truncate">Online</p>
+                                <p className="text-xs md:text-sm text-[#6C7883] truncate">{onlineUsers.has(user) ? 'Online' : 'Offline'}</p>
                             </div>
                         </div>
                     ))}
@@ -25,4 +25,36 @@ socket.on('disconnect', () => {
   console.log('Disconnected from Flask backend');
 });
 
+// Messages that arrived while we were offline come in chunks right after registering,
+// possibly before the chat is mounted. Chunks wait here until a handler takes them,
+// and each chunk is acknowledged (dropping it from the server) only after that.
+const pendingOfflineChunks = [];
+let offlineHandler = null;
+
+const deliverOfflineChunk = (data) => {
+  offlineHandler(data.messages || []);
+  socket.emit('ack_offline', { user_id: data.user_id, up_to: data.up_to });
+};
+
+socket.on('offline_messages', (data) => {
+  if (offlineHandler) {
+    deliverOfflineChunk(data);
+  } else {
+    pendingOfflineChunks.push(data);
+  }
+});
+
+// Set the handler for offline messages; returns a function that removes it
+export const onOfflineMessages = (handler) => {
+  offlineHandler = handler;
+  while (pendingOfflineChunks.length) {
+    deliverOfflineChunk(pendingOfflineChunks.shift());
+  }
+  return () => {
+    if (offlineHandler === handler) {
+      offlineHandler = null;
+    }
+  };
+};
+
 export default socket;
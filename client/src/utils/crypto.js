@@ -29,6 +29,8 @@ export const processMessageForDisplay = (message) => {
     // For now, we're just returning the message content without decryption
     // In a real app, you would decrypt the encrypted_message using the private key
     const displayMessage = {
+        id: message.id,
+        seq: message.seq,
         sender: message.sender,
         recipient: message.recipient,
         content: message.message || message.encrypted_message || '',
@@ -0,0 +1,100 @@
+import threading
+import time
+
+import pytest
+
+from app.crypto.admission import CryptoAdmission, CryptoBusy
+
+def hold(admission, user_id='holder'):
+    """Take a slot outside a with block; release it with block.__exit__(None, None, None)"""
+    block = admission.admit(user_id)
+    block.__enter__()
+    return block
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out waiting"
+        time.sleep(0.001)
+
+def queue_caller(admission, user_id, order):
+    """Start a thread that waits for a slot, and return once it is queued"""
+    def run():
+        with admission.admit(user_id):
+            order.append(user_id)
+
+    queued = admission.queued
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    wait_until(lambda: admission.queued == queued + 1)
+    return thread
+
+def test_free_slot_is_taken_without_queueing():
+    admission = CryptoAdmission(max_active=2)
+    with admission.admit('alice'), admission.admit('bob'):
+        assert admission.get_stats()['active'] == 2
+    stats = admission.get_stats()
+    assert stats['active'] == 0
+    assert stats['admitted'] == 2
+
+def test_slots_go_round_robin_across_users():
+    admission = CryptoAdmission(max_active=1)
+    block = hold(admission)
+    order = []
+    threads = [queue_caller(admission, user_id, order) for user_id in ('alice', 'alice', 'alice', 'bob', 'carol')]
+    block.__exit__(None, None, None)
+    for thread in threads:
+        thread.join(5)
+    assert order == ['alice', 'bob', 'carol', 'alice', 'alice']
+    assert admission.get_stats()['active'] == 0
+
+def test_full_queue_rejects_with_retry_after():
+    admission = CryptoAdmission(max_active=1, max_queue=1, max_wait=2)
+    block = hold(admission)
+    thread = queue_caller(admission, 'alice', [])
+    with pytest.raises(CryptoBusy) as busy:
+        with admission.admit('bob'):
+            pass
+    assert busy.value.reason == 'queue full'
+    assert 0 < busy.value.retry_after <= 2
+    block.__exit__(None, None, None)
+    thread.join(5)
+    assert admission.get_stats()['rejected'] == 1
+
+def test_full_user_queue_only_rejects_that_user():
+    admission = CryptoAdmission(max_active=1, max_per_user=1)
+    block = hold(admission)
+    order = []
+    threads = [queue_caller(admission, 'alice', order)]
+    with pytest.raises(CryptoBusy) as busy:
+        with admission.admit('alice'):
+            pass
+    assert busy.value.reason == 'user queue full'
+    threads.append(queue_caller(admission, 'bob', order))
+    block.__exit__(None, None, None)
+    for thread in threads:
+        thread.join(5)
+    assert order == ['alice', 'bob']
+
+def test_wait_times_out():
+    admission = CryptoAdmission(max_active=1, max_wait=0.05)
+    block = hold(admission)
+    with pytest.raises(CryptoBusy) as busy:
+        with admission.admit('alice'):
+            pass
+    assert busy.value.reason == 'timed out'
+    stats = admission.get_stats()
+    assert stats['timed_out'] == 1
+    assert stats['queued'] == 0
+    assert stats['queued_users'] == 0
+    block.__exit__(None, None, None)
+    assert admission.get_stats()['active'] == 0
+
+def test_slot_is_released_when_the_block_raises():
+    admission = CryptoAdmission(max_active=1)
+    with pytest.raises(RuntimeError):
+        with admission.admit('alice'):
+            raise RuntimeError('boom')
+    assert admission.get_stats()['active'] == 0
+    with admission.admit('bob'):
+        pass
@@ -0,0 +1,78 @@
+import base64
+import io
+import os
+
+import pytest
+
+from app.crypto.envelope import (decrypt_envelope, decrypt_stream, encrypt_envelope, encrypt_multi_envelope,
+                                 encrypt_stream, max_rsa_payload, split_multi_envelope)
+from app.crypto.rsa_utils import generate_key_pair
+
+@pytest.fixture(scope='module')
+def key_pairs():
+    return [generate_key_pair(1024) for _ in range(2)]
+
+def flip_last_byte(value):
+    data = bytearray(base64.b64decode(value))
+    data[-1] ^= 1
+    return base64.b64encode(bytes(data)).decode('utf-8')
+
+@pytest.mark.parametrize('message', ['', 'hello', 'päivää ✓', 'x' * 5000])
+def test_envelope_round_trip(key_pairs, message):
+    private_key, public_key = key_pairs[0]
+    assert decrypt_envelope(encrypt_envelope(message, public_key), private_key) == message
+
+def test_envelope_holds_more_than_rsa_can(key_pairs):
+    private_key, public_key = key_pairs[0]
+    message = 'y' * (max_rsa_payload(public_key) * 10)
+    assert decrypt_envelope(encrypt_envelope(message, public_key), private_key) == message
+
+@pytest.mark.parametrize('field', ['ciphertext', 'tag', 'nonce'])
+def test_tampered_envelope_is_rejected(key_pairs, field):
+    private_key, public_key = key_pairs[0]
+    envelope = encrypt_envelope('hello', public_key)
+    envelope[field] = flip_last_byte(envelope[field])
+    with pytest.raises(ValueError):
+        decrypt_envelope(envelope, private_key)
+
+def test_envelope_for_another_key_is_rejected(key_pairs):
+    envelope = encrypt_envelope('hello', key_pairs[0][1])
+    with pytest.raises(ValueError):
+        decrypt_envelope(envelope, key_pairs[1][0])
+
+def test_multi_envelope_splits_per_recipient(key_pairs):
+    multi_envelope = encrypt_multi_envelope('to everyone', [public_key for _, public_key in key_pairs])
+    envelopes = split_multi_envelope(multi_envelope)
+    assert len(envelopes) == 2
+    for envelope, (private_key, _) in zip(envelopes, key_pairs):
+        assert decrypt_envelope(envelope, private_key) == 'to everyone'
+
+def encrypted_stream(public_key, data, chunk_size):
+    output = io.BytesIO()
+    assert encrypt_stream(io.BytesIO(data), output, public_key, chunk_size=chunk_size) == len(data)
+    return output.getvalue()
+
+@pytest.mark.parametrize('size', [0, 1, 15, 16, 17, 64, 1000])
+@pytest.mark.parametrize('chunk_size', [7, 64])
+def test_stream_round_trip(key_pairs, size, chunk_size):
+    private_key, public_key = key_pairs[0]
+    data = os.urandom(size)
+    # Decrypt with a different chunk size so the held-back tag straddles reads
+    output = io.BytesIO()
+    assert decrypt_stream(io.BytesIO(encrypted_stream(public_key, data, chunk_size)), output,
+                          private_key, chunk_size=chunk_size + 3) == size
+    assert output.getvalue() == data
+
+@pytest.mark.parametrize('cut', [1, 16, 200])
+def test_truncated_stream_is_rejected(key_pairs, cut):
+    private_key, public_key = key_pairs[0]
+    envelope = encrypted_stream(public_key, os.urandom(100), 64)
+    with pytest.raises(ValueError):
+        decrypt_stream(io.BytesIO(envelope[:-cut]), io.BytesIO(), private_key)
+
+def test_tampered_stream_is_rejected(key_pairs):
+    private_key, public_key = key_pairs[0]
+    envelope = bytearray(encrypted_stream(public_key, os.urandom(100), 64))
+    envelope[-20] ^= 1
+    with pytest.raises(ValueError):
+        decrypt_stream(io.BytesIO(bytes(envelope)), io.BytesIO(), private_key)
@@ -0,0 +1,90 @@
+import copy
+
+import pytest
+
+from app.backend.groups import GroupManager
+from app.crypto.rsa_utils import generate_key_pair
+
+@pytest.fixture(scope='module')
+def public_keys():
+    return {user_id: generate_key_pair(1024)[1] for user_id in ('alice', 'bob', 'carol', 'dave')}
+
+@pytest.fixture
+def manager(public_keys):
+    return GroupManager(get_public_key=public_keys.get, max_members=3)
+
+def snapshot(manager):
+    return copy.deepcopy(dict(manager.groups)), copy.deepcopy(dict(manager.memberships)), manager.rekeys
+
+def test_add_members_rekeys_and_indexes(manager):
+    group = manager.create_group('team', 'alice', ['bob'])
+    group, added = manager.add_members(group['id'], ['carol', 'bob'])
+    assert added == ['carol']
+    assert group['members'] == ['alice', 'bob', 'carol']
+    assert group['epoch'] == 2
+    assert set(group['wrapped_keys']) == {'alice', 'bob', 'carol'}
+    assert [info['id'] for info in manager.groups_for_user('carol')] == [group['id']]
+
+def test_failed_add_leaves_group_unchanged(manager):
+    group = manager.create_group('team', 'alice', ['bob'])
+    before = snapshot(manager)
+    with pytest.raises(ValueError):
+        manager.add_members(group['id'], ['carol', 'mallory'])
+    with pytest.raises(ValueError):
+        manager.add_members(group['id'], ['carol', 'dave'])
+    assert snapshot(manager) == before
+    assert manager.groups_for_user('carol') == []
+
+def test_failed_remove_leaves_group_unchanged(manager):
+    group = manager.create_group('team', 'alice', ['bob', 'carol'])
+    before = snapshot(manager)
+
+    def failing_run(func, *args):
+        raise RuntimeError("crypto worker died")
+    manager.run = failing_run
+    with pytest.raises(RuntimeError):
+        manager.remove_members(group['id'], ['carol'])
+    assert snapshot(manager) == before
+    assert [info['id'] for info in manager.groups_for_user('carol')] == [group['id']]
+
+def test_remove_last_members_deletes_group(manager):
+    group = manager.create_group('solo', 'alice', [])
+    group, removed = manager.remove_members(group['id'], ['alice'])
+    assert removed == ['alice'] and group['members'] == []
+    assert manager.get_group(group['id']) is None
+    assert manager.groups_for_user('alice') == []
+
+def test_rewrap_member_only_touches_their_groups(manager, public_keys):
+    shared = manager.create_group('shared', 'alice', ['bob'])
+    other = manager.create_group('other', 'carol', [])
+    other_keys = dict(other['wrapped_keys'])
+    updated = manager.rewrap_member('bob')
+    assert [group['id'] for group in updated] == [shared['id']]
+    assert updated[0]['wrapped_keys']['bob'] != shared['wrapped_keys']['bob']
+    assert updated[0]['key'] == shared['key'] and updated[0]['epoch'] == shared['epoch']
+    assert manager.get_group(other['id'])['wrapped_keys'] == other_keys
+
+def test_owner_leaving_hands_over_ownership(manager):
+    group = manager.create_group('team', 'alice', ['bob', 'carol'])
+    group, removed = manager.remove_members(group['id'], ['alice'])
+    assert removed == ['alice']
+    assert group['owner'] == 'bob'
+    assert manager.get_group(group['id'])['owner'] == 'bob'
+
+def test_change_racing_another_is_recomputed(manager):
+    group = manager.create_group('team', 'alice', ['bob', 'carol'])
+    wrap = manager.run
+
+    def racing_run(func, *args):
+        # Another node adds dave while this change is wrapping its key
+        if 'dave' not in manager.groups[group['id']]['members']:
+            current = manager.groups[group['id']]
+            manager.groups[group['id']] = dict(current, members=current['members'] + ['dave'],
+                                               version=current['version'] + 1)
+        return wrap(func, *args)
+    manager.run = racing_run
+    group, removed = manager.remove_members(group['id'], ['carol'])
+    assert removed == ['carol']
+    assert group['members'] == ['alice', 'bob', 'dave']
+    assert set(group['wrapped_keys']) == {'alice', 'bob', 'dave'}
+    assert manager.get_stats()['conflicts'] == 1
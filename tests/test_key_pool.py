@@ -0,0 +1,66 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from app.crypto.key_pool import KeyPool
+from app.crypto.rsa_utils import sign_message, verify_signature
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in a fresh interpreter, since monkey patching can't be undone
+ASYNC_SCRIPT = """
+import sys
+if sys.argv[1] == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+    import gevent
+    spawn, joinall = gevent.spawn, gevent.joinall
+else:
+    import eventlet
+    eventlet.monkey_patch()
+    spawn = eventlet.spawn
+    joinall = lambda threads: [thread.wait() for thread in threads]
+
+from app.crypto.key_pool import KeyPool
+from app.crypto.offload import CryptoOffloader
+from app.crypto.rsa_utils import sign_message, verify_signature
+
+offload = CryptoOffloader(workers=3)
+offload.start()
+pool = KeyPool(key_size=1024, pool_size=2, workers=2, offload=offload)
+pool.start()
+key_pairs = []
+joinall([spawn(lambda: key_pairs.append(pool.acquire())) for _ in range(4)])
+private_key, public_key = key_pairs[0]
+assert verify_signature('hello', offload.run(sign_message, 'hello', private_key), public_key)
+pool.stop()
+offload.stop()
+print(len(key_pairs))
+"""
+
+def check_key_pair(key_pair):
+    private_key, public_key = key_pair
+    assert private_key.publickey() == public_key
+    assert verify_signature('hello', sign_message('hello', private_key), public_key)
+
+def test_refills_in_worker_processes():
+    pool = KeyPool(key_size=1024, pool_size=2, workers=2)
+    try:
+        for _ in range(4):
+            check_key_pair(pool.acquire())
+        stats = pool.get_stats()
+        assert stats['hits'] + stats['misses'] == 4
+        assert stats['errors'] == 0
+    finally:
+        pool.stop()
+    assert not pool.get_stats()['running']
+
+@pytest.mark.parametrize('mode', ['gevent', 'eventlet'])
+def test_shares_offloader_under_monkey_patching(mode):
+    pytest.importorskip(mode)
+    result = subprocess.run([sys.executable, '-W', 'ignore', '-c', ASYNC_SCRIPT, mode], cwd=ROOT,
+                            capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.split()[-1] == '4'
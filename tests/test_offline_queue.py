@@ -0,0 +1,91 @@
+import os
+
+import pytest
+
+from app.backend.offline_queue import OfflineQueue
+
+@pytest.fixture
+def journal_path(tmp_path):
+    return str(tmp_path / 'offline' / 'offline.journal')
+
+def enqueue_texts(queue, user_id, texts):
+    return [queue.enqueue(user_id, {'sender': 'carol', 'recipient': user_id, 'message': text}) for text in texts]
+
+def queued(queue, user_id):
+    messages, _ = queue.peek(user_id, limit=1000)
+    return [(message['offline_seq'], message['message']) for message in messages]
+
+def test_chunks_stay_queued_until_acked():
+    queue = OfflineQueue()
+    enqueue_texts(queue, 'alice', ['m1', 'm2', 'm3'])
+    chunk, remaining = queue.peek('alice', limit=2)
+    assert [message['offline_seq'] for message in chunk] == [1, 2]
+    assert remaining == 1
+    assert queue.peek('alice', limit=2)[0] == chunk
+    assert queue.ack('alice', 2) == 2
+    assert queued(queue, 'alice') == [(3, 'm3')]
+    assert queue.ack('alice', 2) == 0
+
+def test_replays_queues_and_acks_after_restart(journal_path):
+    queue = OfflineQueue(journal_path=journal_path)
+    enqueue_texts(queue, 'alice', ['a1', 'a2', 'a3'])
+    enqueue_texts(queue, 'bob', ['b1', 'b2'])
+    queue.ack('alice', 1)
+    queue.ack('bob', 2)
+    queue.close()
+
+    queue = OfflineQueue(journal_path=journal_path)
+    assert queued(queue, 'alice') == [(2, 'a2'), (3, 'a3')]
+    assert queued(queue, 'bob') == []
+    # Sequence numbers carry on, so a late ack can't remove a new message
+    assert enqueue_texts(queue, 'alice', ['a4']) == [4]
+    assert enqueue_texts(queue, 'bob', ['b3']) == [3]
+    queue.close()
+
+    queue = OfflineQueue(journal_path=journal_path)
+    assert queued(queue, 'alice') == [(2, 'a2'), (3, 'a3'), (4, 'a4')]
+    assert queued(queue, 'bob') == [(3, 'b3')]
+    assert queue.get_stats()['messages'] == 4
+    queue.close()
+
+def test_replay_truncates_a_torn_final_record(journal_path):
+    queue = OfflineQueue(journal_path=journal_path)
+    enqueue_texts(queue, 'alice', ['a1', 'a2'])
+    queue.close()
+    with open(journal_path, 'ab') as f:
+        f.write(b'{"op":"enqueue","user":"alice","offline_seq":3,"at":')
+
+    queue = OfflineQueue(journal_path=journal_path)
+    assert queued(queue, 'alice') == [(1, 'a1'), (2, 'a2')]
+    enqueue_texts(queue, 'alice', ['a3'])
+    queue.close()
+
+    queue = OfflineQueue(journal_path=journal_path)
+    assert queued(queue, 'alice') == [(1, 'a1'), (2, 'a2'), (3, 'a3')]
+    queue.close()
+
+def test_compaction_keeps_live_messages_and_sequence_numbers(journal_path):
+    queue = OfflineQueue(journal_path=journal_path, compact_ratio=1)
+    enqueue_texts(queue, 'alice', [f'a{i}' for i in range(300)])
+    queue.ack('alice', 298)
+    enqueue_texts(queue, 'bob', ['b1'])
+    queue.close()
+    with open(journal_path, encoding='utf-8') as f:
+        assert len(f.readlines()) < 300
+
+    queue = OfflineQueue(journal_path=journal_path)
+    assert queued(queue, 'alice') == [(299, 'a298'), (300, 'a299')]
+    assert queued(queue, 'bob') == [(1, 'b1')]
+    assert enqueue_texts(queue, 'alice', ['a300']) == [301]
+    queue.close()
+    assert not os.path.exists(journal_path + '.tmp')
+
+def test_replay_drops_expired_messages(journal_path):
+    queue = OfflineQueue(journal_path=journal_path)
+    enqueue_texts(queue, 'alice', ['a1', 'a2'])
+    queue.close()
+
+    queue = OfflineQueue(journal_path=journal_path, max_age=0)
+    assert queue.count('alice') == 0
+    assert queue.get_stats()['expired'] == 2
+    queue.close()
@@ -0,0 +1,78 @@
+import types
+
+import pytest
+
+from app.utils import rate_limit
+from app.utils.rate_limit import RateLimits, TokenBucketLimiter, parse_rate_limits
+
+@pytest.fixture
+def clock(monkeypatch):
+    """A manual clock for the limiters; advance it with clock.now += seconds"""
+    clock = types.SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(rate_limit, 'time', types.SimpleNamespace(monotonic=lambda: clock.now))
+    return clock
+
+def test_burst_then_reject_with_retry_after(clock):
+    limiter = TokenBucketLimiter(rate=2, burst=3)
+    assert [limiter.acquire('alice') for _ in range(3)] == [0, 0, 0]
+    assert limiter.acquire('alice') == pytest.approx(0.5)
+    assert limiter.get_stats()['allowed'] == 3
+    assert limiter.get_stats()['rejected'] == 1
+
+def test_refills_at_rate(clock):
+    limiter = TokenBucketLimiter(rate=2, burst=3)
+    for _ in range(3):
+        limiter.acquire('alice')
+    clock.now += 0.25
+    assert limiter.acquire('alice') == pytest.approx(0.25)
+    clock.now += 0.25
+    assert limiter.acquire('alice') == 0
+    assert limiter.acquire('alice') == pytest.approx(0.5)
+
+def test_refill_is_capped_at_burst(clock):
+    limiter = TokenBucketLimiter(rate=2, burst=3, idle_ttl=3600)
+    limiter.acquire('alice')
+    clock.now += 60
+    assert [limiter.acquire('alice') for _ in range(4)][-1] == pytest.approx(0.5)
+
+def test_keys_have_separate_buckets(clock):
+    limiter = TokenBucketLimiter(rate=1, burst=1)
+    assert limiter.acquire('alice') == 0
+    assert limiter.acquire('alice') > 0
+    assert limiter.acquire('bob') == 0
+
+def test_idle_and_excess_buckets_are_evicted(clock):
+    limiter = TokenBucketLimiter(rate=1, burst=2, max_keys=2)
+    assert limiter.idle_ttl == 2
+    limiter.acquire('alice')
+    clock.now += 3
+    limiter.acquire('bob')
+    limiter.acquire('carol')
+    limiter.acquire('dave')
+    stats = limiter.get_stats()
+    assert stats['keys'] == 2
+    assert stats['evictions'] == 2
+
+def test_rejected_scope_does_not_charge_later_scopes(clock):
+    limits = RateLimits({'send_message': (1, 1)})
+    assert limits.check('send_message', 'alice', 'sid-1') == (None, 0)
+    scope, retry_after = limits.check('send_message', 'alice', 'sid-2')
+    assert scope == 'user'
+    assert retry_after == pytest.approx(1)
+    # sid-2 was never charged, so another user can still use it
+    assert limits.check('send_message', 'bob', 'sid-2') == (None, 0)
+    assert limits.check('send_message', 'carol', 'sid-1')[0] == 'connection'
+
+def test_unconfigured_events_and_missing_keys_are_not_limited(clock):
+    limits = RateLimits({'register_user': (1, 1)})
+    assert limits.check('send_message', 'alice', 'sid-1') == (None, 0)
+    assert limits.check('register_user', None, 'sid-1', address='10.0.0.1') == (None, 0)
+    assert limits.check('register_user', None, 'sid-2', address='10.0.0.1')[0] == 'address'
+
+def test_parse_rate_limits():
+    assert parse_rate_limits('send_message=20/40, register_user=0.5') == {
+        'send_message': (20.0, 40.0),
+        'register_user': (0.5, 1.0)
+    }
+    assert parse_rate_limits('') == {}
+    assert parse_rate_limits(None) == {}
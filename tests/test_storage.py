@@ -0,0 +1,59 @@
+import os
+
+import pytest
+
+from app.backend.storage import INDEX_FILE, SegmentLogMessageStore, conversation_key
+
+KEY = conversation_key('alice', 'bob')
+
+@pytest.fixture
+def directory(tmp_path):
+    return str(tmp_path / 'log')
+
+def append_texts(store, texts):
+    for text in texts:
+        store.append({'sender': 'alice', 'recipient': 'bob', 'message': text})
+    store.sync()
+
+def history(store):
+    messages, _ = store.get_conversation(KEY, limit=100)
+    return [message['message'] for message in messages]
+
+def cut_tail(path, size):
+    with open(path, 'r+b') as f:
+        f.truncate(os.path.getsize(path) - size)
+
+@pytest.mark.parametrize('cut', [1, 7, 20])
+def test_recovers_from_torn_index_tail(directory, cut):
+    store = SegmentLogMessageStore(directory)
+    append_texts(store, ['m0', 'm1', 'm2'])
+    store.close()
+
+    cut_tail(os.path.join(directory, INDEX_FILE), cut)
+    store = SegmentLogMessageStore(directory)
+    assert history(store) == ['m0', 'm1', 'm2']
+    append_texts(store, ['m3', 'm4'])
+    store.close()
+
+    store = SegmentLogMessageStore(directory)
+    assert history(store) == ['m0', 'm1', 'm2', 'm3', 'm4']
+    assert len(store) == 5
+    store.close()
+
+def test_recovers_from_torn_segment_tail(directory):
+    store = SegmentLogMessageStore(directory)
+    append_texts(store, ['m0', 'm1', 'm2'])
+    segment = store._segments[-1].path
+    store.close()
+
+    # Lose the last record and its index entry, as after a crash mid-write
+    os.remove(os.path.join(directory, INDEX_FILE))
+    cut_tail(segment, 3)
+    store = SegmentLogMessageStore(directory)
+    assert history(store) == ['m0', 'm1']
+    append_texts(store, ['m3'])
+    store.close()
+
+    store = SegmentLogMessageStore(directory)
+    assert history(store) == ['m0', 'm1', 'm3']
+    store.close()
@@ -0,0 +1,45 @@
+from app.backend.message_handler import MessageHandler
+
+def send(handler, sender, recipient, text):
+    handler.log_message({'sender': sender, 'recipient': recipient, 'message': text})
+
+def test_sync_merges_conversations_in_seq_order():
+    handler = MessageHandler()
+    for n in range(5):
+        send(handler, 'alice', 'bob', f"b{n}")
+        send(handler, 'carol', 'alice', f"c{n}")
+        send(handler, 'bob', 'carol', f"x{n}")
+
+    messages, cursor, has_more = handler.sync('alice', limit=4)
+    assert [message['message'] for message in messages] == ['b0', 'c0', 'b1', 'c1']
+    assert has_more
+
+    seen = [message['message'] for message in messages]
+    while has_more:
+        messages, cursor, has_more = handler.sync('alice', cursor, limit=4)
+        seen.extend(message['message'] for message in messages)
+    assert seen == [f"{kind}{n}" for n in range(5) for kind in ('b', 'c')]
+    assert handler.sync('alice', cursor, limit=4) == ([], cursor, False)
+
+def test_sync_reads_only_what_the_page_needs():
+    handler = MessageHandler()
+    for n in range(50):
+        send(handler, 'alice', f"user{n}", 'old')
+    cursor = handler.sync('alice', limit=100)[1]
+    for _ in range(10):
+        for n in range(50):
+            send(handler, 'alice', f"user{n}", 'new')
+
+    reads = []
+    get_conversation = handler.store.get_conversation
+
+    def counting_get_conversation(key, **kwargs):
+        page, more = get_conversation(key, **kwargs)
+        reads.append(len(page))
+        return page, more
+    handler.store.get_conversation = counting_get_conversation
+
+    messages, _, has_more = handler.sync('alice', cursor, limit=10)
+    assert len(messages) == 10 and has_more
+    # One message from every conversation plus the lazily paged ones that fill the page, not 50 * 10
+    assert sum(reads) <= 50 + 3 * 11
@@ -0,0 +1,42 @@
+import pytest
+
+from app.crypto.rsa_utils import generate_certificate, generate_key_pair
+from app.crypto.verify_cache import CertificateVerificationCache, RevocationListFull
+
+@pytest.fixture(scope='module')
+def ca():
+    return generate_key_pair(1024)
+
+@pytest.fixture(scope='module')
+def user_public_key():
+    return generate_key_pair(1024)[1]
+
+def certificate(ca, public_key, user_id, valid_days=365):
+    return generate_certificate(user_id, public_key, ca[0], valid_days=valid_days)
+
+def test_revoked_certificate_stops_verifying(ca, user_public_key):
+    cache = CertificateVerificationCache()
+    cert = certificate(ca, user_public_key, 'alice')
+    assert cache.verify(cert, ca[1])
+    cache.revoke(cert)
+    assert not cache.verify(cert, ca[1])
+
+def test_full_revocation_list_refuses_instead_of_unrevoking(ca, user_public_key):
+    cache = CertificateVerificationCache(max_revoked=2)
+    first, second, third = (certificate(ca, user_public_key, user_id) for user_id in ('a', 'b', 'c'))
+    cache.revoke(first)
+    cache.revoke(second)
+    with pytest.raises(RevocationListFull):
+        cache.revoke(third)
+    assert not cache.verify(first, ca[1])
+    assert not cache.verify(second, ca[1])
+    assert cache.verify(third, ca[1])
+    assert cache.get_stats()['revocations_refused'] == 1
+
+def test_expired_revocations_make_room(ca, user_public_key):
+    cache = CertificateVerificationCache(max_revoked=1)
+    cache.revoke(certificate(ca, user_public_key, 'old', valid_days=-2))
+    live = certificate(ca, user_public_key, 'new')
+    cache.revoke(live)
+    assert not cache.verify(live, ca[1])
+    assert cache.get_stats()['revoked'] == 1
@@ -0,0 +1,84 @@
+import pytest
+
+from app.backend.wire import (BINARY, BINARY_ZLIB, COMPRESSED, FIELDS, JSON, WIRE_VERSION, decode_message,
+                              encode_message, negotiate)
+
+MESSAGE = {
+    'id': '9f86d081884c7d65',
+    'seq': 300,
+    'sender': 'alice',
+    'recipient': 'bob',
+    'timestamp': '2024-01-01T12:00:00',
+    'message': 'hello ' * 400,
+    'signature': 'c2lnbmF0dXJl',
+    'encrypted': True,
+    'tampered': False,
+    'envelope': {'wrapped_key': 'a2V5', 'nonce': 'bm9uY2U=', 'ciphertext': 'Y2lwaGVy', 'tag': 'dGFn'},
+    'unknown_field': [1, 2, 3]
+}
+
+def record(name, raw):
+    return bytes((FIELDS[name][0], len(raw))) + raw
+
+@pytest.mark.parametrize('compression', [None, 'zlib'])
+def test_round_trip(compression):
+    assert decode_message(encode_message(MESSAGE, compression)) == MESSAGE
+
+@pytest.mark.parametrize('field, value', [
+    ('id', 'ABCDEF'),        # upper-case hex
+    ('id', 'abc'),           # odd length
+    ('signature', 'a2V5'),   # canonical base64 still packs
+    ('signature', 'a2V'),    # missing padding
+    ('seq', -1),
+    ('seq', True),
+    ('sender', 42),
+    ('encrypted', 1),
+    ('envelope', 'not a dict'),
+])
+def test_values_that_dont_fit_their_codec_round_trip(field, value):
+    message = {'sender': 'alice', field: value}
+    assert decode_message(encode_message(message)) == message
+
+def test_only_long_strings_are_compressed():
+    message = {'message': 'x' * 2000, 'sender': 'alice'}
+    plain = encode_message(message)
+    compressed = encode_message(message, 'zlib', compress_min_bytes=1024)
+    assert len(compressed) < len(plain) // 10
+    assert compressed[1] == FIELDS['message'][0] | COMPRESSED
+    assert compressed.endswith(record('sender', b'alice'))
+    assert encode_message(message, 'zlib', compress_min_bytes=4096) == plain
+
+@pytest.mark.parametrize('data', [
+    b'',
+    bytes((WIRE_VERSION + 1,)) + record('sender', b'alice'),
+    bytes((WIRE_VERSION,)) + record('sender', b'alice')[:-1],                 # value cut short
+    bytes((WIRE_VERSION, FIELDS['sender'][0], 0x80)),                         # length cut short
+    bytes((WIRE_VERSION, 120, 1, 0)),                                          # unknown tag
+    bytes((WIRE_VERSION, FIELDS['message'][0] | COMPRESSED, 3)) + b'abc',     # not zlib
+    bytes((WIRE_VERSION,)) + record('sender', b'\xff\xfe'),                   # not UTF-8
+    bytes((WIRE_VERSION, 0, 7)) + b'[1,2,3]',                                 # extra fields not an object
+    bytes((WIRE_VERSION, 0, 4)) + b'{"a"',                                    # extra fields not JSON
+    bytes((WIRE_VERSION,)) + record('envelope', bytes((FIELDS['nonce'][0], 9))),  # nested record cut short
+])
+def test_malformed_input_raises_value_error(data):
+    with pytest.raises(ValueError):
+        decode_message(data)
+
+def test_every_truncation_is_rejected_or_a_prefix():
+    encoded = encode_message(MESSAGE, 'zlib')
+    for size in range(1, len(encoded)):
+        try:
+            decoded = decode_message(encoded[:size])
+        except ValueError:
+            continue
+        # Cut exactly between records: the fields before the cut survive intact
+        assert all(MESSAGE[name] == value for name, value in decoded.items())
+
+@pytest.mark.parametrize('requested, compressions, expected', [
+    ('json', ['zlib'], JSON),
+    ('binary', [], BINARY),
+    ('binary', None, BINARY),
+    ('binary', ['zlib'], BINARY_ZLIB),
+])
+def test_negotiate(requested, compressions, expected):
+    assert negotiate(requested, compressions) == expected